@@ -0,0 +1,149 @@
+"""Content-addressed cache of blood test analyses.
+
+Entries are keyed by a hash of the normalized extracted text together with
+the prompt version and model, so re-uploads of the same lab export (under
+any filename) reuse the earlier analysis instead of calling the LLM again.
+
+Two tiers: a per-process LRU with TTL and a byte budget in front of a
+Mongo collection that all processes share.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+from metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("analysis_cache_hits_total", "Analysis cache hits", ["tier"])
+CACHE_MISSES = REGISTRY.counter("analysis_cache_misses_total", "Analysis cache misses")
+CACHE_SAVED_SECONDS = REGISTRY.counter(
+    "analysis_cache_saved_llm_seconds_total", "LLM latency avoided by cache hits")
+CACHE_SAVED_TOKENS = REGISTRY.counter(
+    "analysis_cache_saved_prompt_tokens_total", "Estimated prompt tokens avoided by cache hits")
+CACHE_MEMORY_BYTES = REGISTRY.gauge("analysis_cache_memory_bytes", "Bytes held by the in-memory tier")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapse layout differences that do not change the lab values"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(text: str, prompt_version: str, model: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{prompt_version}\0{model}\0".encode())
+    digest.update(normalize_text(text).encode())
+    return digest.hexdigest()
+
+
+def _entry_size(value: Dict[str, Any]) -> int:
+    return sum(len(v) for v in value.values() if isinstance(v, (str, bytes)))
+
+
+class LruTtlCache:
+    """Thread-safe LRU bounded by entry count and total byte size"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, size, value = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        size = _entry_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            CACHE_MEMORY_BYTES.set(self._bytes)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        CACHE_MEMORY_BYTES.set(self._bytes)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class AnalysisCache:
+    def __init__(self, collection, memory: LruTtlCache, ttl: float = 30 * 24 * 3600):
+        self.collection = collection
+        self.memory = memory
+        self.ttl = ttl
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._record_hit("memory", entry)
+            return entry
+
+        doc = await self.collection.find_one(
+            {"key": key, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "key": 0, "expires_at": 0}
+        )
+        if doc is None:
+            CACHE_MISSES.inc()
+            return None
+        self.memory.set(key, doc)
+        self._record_hit("mongo", doc)
+        return doc
+
+    async def put(self, key: str, fields: Dict[str, Any]) -> None:
+        """Create or extend the entry for ``key`` with ``fields``"""
+        doc = await self.collection.find_one_and_update(
+            {"key": key},
+            {
+                "$set": {**fields, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+                "$setOnInsert": {"created_at": datetime.utcnow()},
+            },
+            projection={"_id": 0, "key": 0, "expires_at": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.memory.set(key, doc)
+
+    async def invalidate(self, key: str) -> None:
+        self.memory.delete(key)
+        await self.collection.delete_one({"key": key})
+
+    @staticmethod
+    def _record_hit(tier: str, entry: Dict[str, Any]) -> None:
+        CACHE_HITS.inc(tier=tier)
+        CACHE_SAVED_SECONDS.inc(entry.get("llm_seconds", 0))
+        CACHE_SAVED_TOKENS.inc(entry.get("prompt_tokens", 0))
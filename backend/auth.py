@@ -0,0 +1,160 @@
+"""JWT access / refresh tokens and a short-lived in-process user cache.
+
+Access tokens carry the claims most endpoints need (id, email, name and
+the user's token version), so read-only endpoints can authenticate
+without touching the users collection. Incrementing a user's
+``token_version`` revokes every token issued before it. Refresh tokens
+are long-lived and only good for minting a new token pair.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from jose import JWTError, jwt
+
+from metrics import REGISTRY
+
+USER_CACHE_LOOKUPS = REGISTRY.counter(
+    "auth_user_cache_lookups_total", "User cache lookups by result", ["result"])
+
+TOKEN_ACCESS = "access"
+TOKEN_REFRESH = "refresh"
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenService:
+    def __init__(self, secret: str, access_ttl: timedelta, refresh_ttl: timedelta, algorithm: str = "HS256"):
+        self.secret = secret
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.algorithm = algorithm
+
+    def _encode(self, claims: Dict[str, Any], ttl: timedelta) -> str:
+        now = datetime.utcnow()
+        return jwt.encode({**claims, "iat": now, "exp": now + ttl}, self.secret, algorithm=self.algorithm)
+
+    def create_access_token(self, user: dict) -> str:
+        return self._encode({
+            "sub": user["id"],
+            "type": TOKEN_ACCESS,
+            "email": user["email"],
+            "name": user["full_name"],
+            "ver": user.get("token_version", 0),
+        }, self.access_ttl)
+
+    def create_refresh_token(self, user: dict) -> str:
+        return self._encode({
+            "sub": user["id"],
+            "type": TOKEN_REFRESH,
+            "ver": user.get("token_version", 0),
+            "jti": uuid.uuid4().hex,
+        }, self.refresh_ttl)
+
+    def token_pair(self, user: dict) -> dict:
+        return {
+            "access_token": self.create_access_token(user),
+            "refresh_token": self.create_refresh_token(user),
+            "token_type": "bearer",
+            "expires_in": int(self.access_ttl.total_seconds()),
+        }
+
+    def decode(self, token: str, token_type: str = TOKEN_ACCESS) -> dict:
+        """Verified claims; raises TokenError.
+
+        Tokens issued before the type claim existed count as access tokens.
+        """
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except JWTError as e:
+            raise TokenError(str(e))
+        if payload.get("sub") is None or payload.get("type", TOKEN_ACCESS) != token_type:
+            raise TokenError("Invalid token")
+        return payload
+
+
+def claims_user(payload: dict) -> Optional[dict]:
+    """User fields carried by an access token, or None for a token without them"""
+    if "ver" not in payload or "email" not in payload:
+        return None
+    return {
+        "id": payload["sub"],
+        "email": payload["email"],
+        "full_name": payload.get("name", ""),
+        "token_version": payload["ver"],
+    }
+
+
+class UserCache:
+    """Thread-safe LRU of user documents with a short TTL.
+
+    Each process has its own copy, so callers invalidate it when a user's
+    credits, profile or token version change and rely on the TTL to bound
+    staleness from changes made by other processes.
+
+    It also remembers, per user, the lowest token version still valid after
+    a revocation in this process. Floors outlive the cached documents (they
+    are kept for ``revocation_ttl``, the access token lifetime), so
+    endpoints that trust token claims keep rejecting revoked tokens after
+    the user's entry has expired or been invalidated.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000, revocation_ttl: float = 900):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.revocation_ttl = revocation_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._floors: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is None or item[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                USER_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(user_id)
+            USER_CACHE_LOOKUPS.inc(result="hit")
+            return item[1]
+
+    def set(self, user: dict) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user["id"]] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user["id"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def revoke(self, user_id: str, token_version: int) -> None:
+        """Reject this user's tokens older than ``token_version`` from now on"""
+        with self._lock:
+            item = self._floors.get(user_id)
+            if item is not None and item[0] >= time.monotonic():
+                token_version = max(token_version, item[1])
+            self._floors[user_id] = (time.monotonic() + self.revocation_ttl, token_version)
+            self._floors.move_to_end(user_id)
+            while len(self._floors) > self.max_entries:
+                self._floors.popitem(last=False)
+
+    def revoked(self, user_id: str, token_version: int) -> bool:
+        """Whether a token carrying ``token_version`` was revoked in this process"""
+        with self._lock:
+            item = self._floors.get(user_id)
+            if item is None or item[0] < time.monotonic():
+                self._floors.pop(user_id, None)
+                return False
+            return token_version < item[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
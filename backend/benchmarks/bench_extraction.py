@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: page-parallel PDF extraction vs. the original sequential extractor.
+
+Generates synthetic lab PDFs of 1, 20 and 200 pages and times
+  * legacy   - the original extract_text_from_pdf (bytes in memory, text +=)
+  * parallel - extraction.extract_pdf on a CpuExecutor
+
+Usage (from backend/):
+    python benchmarks/bench_extraction.py [--workers N] [--repeat R]
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import PyPDF2
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from executor import CpuExecutor
+from extraction import extract_pdf
+
+PAGE_COUNTS = (1, 20, 200)
+
+LAB_ROWS = [
+    ("WBC", "10.2", "K/uL", "5.5 - 16.9"),
+    ("RBC", "6.8", "M/uL", "5.5 - 8.5"),
+    ("HGB", "16.1", "g/dL", "12.0 - 18.0"),
+    ("HCT", "47.3", "%", "37.0 - 55.0"),
+    ("PLT", "310", "K/uL", "175 - 500"),
+    ("ALT", "64", "U/L", "10 - 125"),
+    ("ALKP", "88", "U/L", "23 - 212"),
+    ("BUN", "18", "mg/dL", "7 - 27"),
+    ("CREA", "1.1", "mg/dL", "0.5 - 1.8"),
+    ("GLU", "97", "mg/dL", "70 - 143"),
+]
+
+
+def make_pdf(pages: int) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    for page in range(pages):
+        y = 740
+        pdf.drawString(72, y, f"Canine Laboratory Report - page {page + 1} of {pages}")
+        y -= 24
+        for repeat in range(4):
+            for name, value, unit, ref in LAB_ROWS:
+                pdf.drawString(72, y, f"{name:<8} {value:>8} {unit:<8} {ref}")
+                y -= 14
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def legacy_extract_text(file_content: bytes) -> str:
+    """The extractor as it was before the page-parallel engine"""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+    text = ""
+    for page in pdf_reader.pages:
+        text += page.extract_text()
+    return text
+
+
+def time_call(fn, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def time_parallel(executor: CpuExecutor, path: str, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await extract_pdf(executor, path, max_pages=10_000)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    executor = CpuExecutor(max_workers=args.workers, max_pending=10_000)
+    executor.start()
+    # Warm the worker processes so spawn cost is not counted
+    await asyncio.gather(*[executor.run(len, "warm") for _ in range(args.workers)])
+
+    print(f"workers={args.workers} repeat={args.repeat}")
+    print(f"{'pages':>6} {'legacy (s)':>12} {'parallel (s)':>14} {'speedup':>9}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for pages in PAGE_COUNTS:
+                content = make_pdf(pages)
+                path = os.path.join(tmp, f"lab_{pages}.pdf")
+                with open(path, "wb") as f:
+                    f.write(content)
+
+                legacy = statistics.median(time_call(lambda: legacy_extract_text(content), args.repeat))
+                parallel = statistics.median(await time_parallel(executor, path, args.repeat))
+                print(f"{pages:>6} {legacy:>12.4f} {parallel:>14.4f} {legacy / parallel:>8.2f}x")
+    finally:
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
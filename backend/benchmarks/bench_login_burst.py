@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /api/user/profile latency while a burst of logins is verified.
+
+Runs in-process on one event loop, the way a single uvicorn worker does.
+A burst of concurrent login verifications is started while profile
+requests (a cached-user lookup, as get_current_user does on a cache hit)
+arrive every --probe-interval seconds. Two modes:
+  * inline - pwd_context.verify called directly in the handler (the original)
+  * pool   - passwords.PasswordHasher with its thread pool and limits
+
+Logins refused by the hasher (503 saturated / 429 per-key limit) are
+counted separately. No Mongo or network needed.
+
+Usage (from backend/):
+    python benchmarks/bench_login_burst.py [--logins 500] [--rounds 12] [--sources 100]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from auth import UserCache
+from passwords import HasherSaturated, PasswordHasher, TooManyConcurrentAttempts, build_crypt_context
+
+PASSWORD = "correct horse battery staple"
+
+
+async def profile_probe(user_cache: UserCache, interval: float, stop: asyncio.Event, latencies: list):
+    # Probes "arrive" on a fixed schedule; latency is measured from the
+    # scheduled arrival so a blocked loop shows up as queued requests
+    arrival = time.perf_counter()
+    while not stop.is_set():
+        arrival += interval
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        await asyncio.sleep(0)  # yield once, like awaiting the request body
+        user_cache.get("probe-user")
+        latencies.append(time.perf_counter() - arrival)
+
+
+async def run_burst(mode: str, context, stored_hash: str, args) -> dict:
+    user_cache = UserCache(ttl=3600)
+    user_cache.set({"id": "probe-user", "email": "probe@example.com", "full_name": "Probe", "credits": 3})
+    hasher = PasswordHasher(context, max_workers=args.workers, max_pending=args.max_pending,
+                            per_key_limit=args.per_key_limit)
+    outcomes = {"ok": 0, "saturated": 0, "per_key": 0}
+
+    async def login(i: int):
+        await asyncio.sleep(0)
+        keys = [f"ip:10.0.{i % args.sources // 256}.{i % args.sources % 256}", f"account:user{i}@example.com"]
+        try:
+            if mode == "inline":
+                context.verify(PASSWORD, stored_hash)
+            else:
+                await hasher.verify_and_update(PASSWORD, stored_hash, keys)
+            outcomes["ok"] += 1
+        except HasherSaturated:
+            outcomes["saturated"] += 1
+        except TooManyConcurrentAttempts:
+            outcomes["per_key"] += 1
+
+    latencies = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(profile_probe(user_cache, args.probe_interval, stop, latencies))
+    await asyncio.sleep(args.probe_interval * 5)  # baseline samples before the burst
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(args.logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    hasher.shutdown()
+    return {"latencies": latencies, "elapsed": elapsed, **outcomes}
+
+
+def summarize(mode: str, result: dict):
+    timings = sorted(result["latencies"])
+    pct = lambda p: timings[min(int(len(timings) * p), len(timings) - 1)] * 1000
+    print(f"{mode:<7} profile p50={pct(0.50):8.2f}ms p95={pct(0.95):8.2f}ms p99={pct(0.99):8.2f}ms "
+          f"max={timings[-1] * 1000:8.2f}ms mean={statistics.mean(timings) * 1000:7.2f}ms "
+          f"({len(timings)} probes)")
+    print(f"        logins ok={result['ok']} saturated={result['saturated']} per_key={result['per_key']} "
+          f"burst={result['elapsed']:.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--sources", type=int, default=100, help="distinct client IPs in the burst")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--per-key-limit", type=int, default=2)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--modes", default="inline,pool")
+    args = parser.parse_args()
+
+    context = build_crypt_context(["bcrypt"], bcrypt_rounds=args.rounds)
+    stored_hash = context.hash(PASSWORD)
+    for mode in args.modes.split(","):
+        summarize(mode, await run_burst(mode, context, stored_hash, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
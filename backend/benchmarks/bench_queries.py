@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dashboard-list and report-view latency on a large blood_tests collection.
+
+Seeds a separate database (default ``dogbloodgpt_bench``) with synthetic
+blood tests, then times the two hot read paths twice:
+  * baseline - no secondary indexes, full documents (the original queries)
+  * tuned    - indexes from indexes.py, field projections from server.py
+
+Needs a running MongoDB (MONGO_URL). Seeding 1M documents takes a while and
+several GB of disk; use --tests for a smaller run and --skip-seed to reuse
+an existing seed.
+
+Usage (from backend/):
+    python benchmarks/bench_queries.py [--tests 1000000] [--users 2000] [--samples 500]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import motor.motor_asyncio
+from decouple import config
+
+from indexes import INDEXES
+
+MONGO_URL = config('MONGO_URL', default='mongodb://localhost:27017/dogbloodgpt')
+
+# Same shapes as server.TEST_LIST_PROJECTION / TEST_VIEW_PROJECTION
+TEST_LIST_PROJECTION = {"_id": 0, "id": 1, "filename": 1, "created_at": 1, "status": 1}
+TEST_VIEW_PROJECTION = {
+    "_id": 0, "id": 1, "filename": 1, "analysis": 1, "created_at": 1, "status": 1,
+    "error": 1, "analysis_source": 1
+}
+
+EXTRACTED_TEXT = "WBC 10.2 K/uL 5.5 - 16.9\nRBC 6.8 M/uL 5.5 - 8.5\n" * 60
+ANALYSIS = "Summary: All reported values are within their reference ranges.\n\n" * 30
+
+
+async def seed(collection, tests: int, users: int, batch_size: int = 5000):
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    start = datetime.utcnow() - timedelta(days=365)
+    inserted = 0
+    while inserted < tests:
+        batch = []
+        for i in range(min(batch_size, tests - inserted)):
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "user_id": random.choice(user_ids),
+                "filename": f"panel_{inserted + i}.pdf",
+                "extracted_text": EXTRACTED_TEXT,
+                "analysis": ANALYSIS,
+                "created_at": start + timedelta(seconds=random.randint(0, 365 * 86400)),
+                "status": "completed",
+            })
+        await collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+        print(f"\rseeded {inserted}/{tests}", end="", flush=True)
+    print()
+
+
+async def sample_keys(collection, samples: int):
+    pipeline = [{"$sample": {"size": samples}}, {"$project": {"_id": 0, "id": 1, "user_id": 1}}]
+    return await collection.aggregate(pipeline).to_list(length=samples)
+
+
+async def time_queries(collection, keys, projected: bool):
+    dashboard, report = [], []
+    for key in keys:
+        t0 = time.perf_counter()
+        await collection.find(
+            {"user_id": key["user_id"]},
+            TEST_LIST_PROJECTION if projected else None
+        ).sort([("created_at", -1), ("id", -1)]).limit(21).to_list(length=21)
+        dashboard.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await collection.find_one(
+            {"id": key["id"], "user_id": key["user_id"]},
+            TEST_VIEW_PROJECTION if projected else None
+        )
+        report.append(time.perf_counter() - t0)
+    return dashboard, report
+
+
+def summarize(label: str, timings):
+    timings = sorted(timings)
+    pct = lambda p: timings[min(int(len(timings) * p), len(timings) - 1)] * 1000
+    print(f"  {label:<16} p50={pct(0.50):8.2f}ms p95={pct(0.95):8.2f}ms "
+          f"p99={pct(0.99):8.2f}ms mean={statistics.mean(timings) * 1000:8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tests", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--database", default="dogbloodgpt_bench")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    collection = client[args.database].blood_tests
+
+    if not args.skip_seed:
+        await collection.drop()
+        await seed(collection, args.tests, args.users)
+    keys = await sample_keys(collection, args.samples)
+
+    await collection.drop_indexes()
+    # The unindexed baseline scans the collection; keep its sample small
+    baseline_keys = keys[:max(args.samples // 50, 5)]
+    print(f"baseline (no indexes, full documents, {len(baseline_keys)} samples)")
+    dashboard, report = await time_queries(collection, baseline_keys, projected=False)
+    summarize("dashboard list", dashboard)
+    summarize("report view", report)
+
+    await collection.create_indexes(INDEXES["blood_tests"])
+    print(f"tuned (indexes + projections, {len(keys)} samples)")
+    dashboard, report = await time_queries(collection, keys, projected=True)
+    summarize("dashboard list", dashboard)
+    summarize("report view", report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: report rendering throughput on one core.
+
+Renders the same synthetic analyses in a single process with
+  * legacy   - the original generate_pdf_report body (styles rebuilt per call,
+               buffer read back with seek + read)
+  * template - reports.render_report with the per-process ReportTemplate
+  * file     - reports.render_report_file into a spool file, as the render
+               stage does
+
+and prints reports/sec for short, typical and long analyses.
+
+Usage (from backend/):
+    python benchmarks/bench_reports.py [--reports N] [--modes legacy,template,file]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+
+from reports import render_report, render_report_file
+
+PARAGRAPH = (
+    "The complete blood count is within reference ranges. Red cell indices are stable and there is "
+    "no sign of anaemia. Kidney markers (BUN, creatinine) are normal; ALT is mildly raised, which is "
+    "often seen with recent medication or a fatty meal before sampling."
+)
+ANALYSES = {"short": 2, "typical": 8, "long": 40}  # paragraphs
+
+
+def legacy_render(analysis_text: str, user_name: str, test_date: str) -> bytes:
+    """The original server.generate_pdf_report body"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+    title_style = ParagraphStyle(
+        'CustomTitle', parent=styles['Heading1'], fontSize=24, textColor=colors.darkblue, alignment=1
+    )
+    story.append(Paragraph("DogBloodGPT Analysis Report", title_style))
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"<b>Pet Owner:</b> {user_name}", styles['Normal']))
+    story.append(Paragraph(f"<b>Analysis Date:</b> {test_date}", styles['Normal']))
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("<b>Blood Test Analysis:</b>", styles['Heading2']))
+    story.append(Spacer(1, 12))
+    for para in analysis_text.split('\n\n'):
+        if para.strip():
+            story.append(Paragraph(para, styles['Normal']))
+            story.append(Spacer(1, 12))
+    disclaimer_style = ParagraphStyle(
+        'Disclaimer', parent=styles['Normal'], fontSize=10, textColor=colors.red, leftIndent=20, rightIndent=20
+    )
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("<b>DISCLAIMER:</b> This analysis is for educational purposes only and should not replace professional veterinary consultation. Always consult with a qualified veterinarian for medical advice.", disclaimer_style))
+    doc.build(story)
+    buffer.seek(0)
+    return buffer.read()
+
+
+def run_mode(mode: str, analysis: str, reports: int, spool_dir: str) -> float:
+    start = time.perf_counter()
+    for i in range(reports):
+        if mode == "legacy":
+            legacy_render(analysis, "Benchmark Owner", "2024-01-01")
+        elif mode == "template":
+            render_report(analysis, "Benchmark Owner", "2024-01-01")
+        else:
+            path = os.path.join(spool_dir, f"{i}.pdf")
+            render_report_file(path, analysis, "Benchmark Owner", "2024-01-01")
+            os.remove(path)
+    return reports / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=200)
+    parser.add_argument("--modes", default="legacy,template,file")
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        for name, paragraphs in ANALYSES.items():
+            analysis = "\n\n".join([PARAGRAPH] * paragraphs)
+            for mode in modes:
+                run_mode(mode, analysis, 5, spool_dir)  # warm up imports and font caches
+            rates = {mode: run_mode(mode, analysis, args.reports, spool_dir) for mode in modes}
+            line = "  ".join(f"{mode}={rate:7.1f}/s" for mode, rate in rates.items())
+            if "legacy" in rates and "template" in rates:
+                line += f"  template speedup={rates['template'] / rates['legacy']:.2f}x"
+            print(f"{name:<8} ({paragraphs:>2} paragraphs)  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end load test of the API.
+
+Runs the FastAPI app in-process, lifespan and background workers included,
+with no network and no external services:
+  * Mongo      - the in-memory stand-in from mongo_standin.py, or a real
+                 server with --mongo-url (use a throwaway one: the app
+                 writes to its dogbloodgpt database)
+  * LLM        - the stub provider (LLM_STUB), --llm-latency seconds to the
+                 first token
+  * Stripe     - a stub checkout client that pays every session at once
+  * uploads    - a generated corpus of synthetic canine lab PDFs of 1, 5 and
+                 20 pages, normal and abnormal panels, so both the rule-based
+                 and the LLM analysis paths run
+
+After seeding --users accounts it drives a mixed workload for --duration
+seconds:
+  * login      - bursts of --login-burst concurrent logins every --login-interval s
+  * upload     - --uploaders clients uploading a PDF, polling its status until
+                 it finishes and downloading some of the reports
+  * chat       - --chatters clients asking about their completed tests
+  * dashboard  - --pollers clients polling the test list and profile
+  * checkout   - --buyers clients buying credits (checkout, webhook, status)
+
+and reports requests/sec and p50/p95/p99 latency per endpoint, the
+upload-to-completed time and the server's own stage timings. --output
+writes the results as JSON; --baseline compares them with an earlier run
+and exits with status 1 when an endpoint's p95 or throughput regressed by
+more than --tolerance.
+
+Usage (from backend/):
+    python benchmarks/loadtest.py [--duration 30] [--users 20] [--output results.json]
+                                  [--baseline previous.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+PASSWORD = "load-test password 1"
+HOST_URL = "http://loadtest.local"
+
+# name, unit, low, high; values are drawn inside the range for normal panels
+ANALYTES = [
+    ("WBC", "K/uL", 5.5, 16.9),
+    ("RBC", "M/uL", 5.5, 8.5),
+    ("HGB", "g/dL", 12.0, 18.0),
+    ("HCT", "%", 37.0, 55.0),
+    ("PLT", "K/uL", 175, 500),
+    ("ALT", "U/L", 10, 125),
+    ("ALKP", "U/L", 23, 212),
+    ("BUN", "mg/dL", 7, 27),
+    ("CREA", "mg/dL", 0.5, 1.8),
+    ("GLU", "mg/dL", 70, 143),
+    ("TP", "g/dL", 5.2, 8.2),
+    ("ALB", "g/dL", 2.3, 4.0),
+]
+PAGE_SIZES = ((1, 0.6), (5, 0.3), (20, 0.1))  # pages, share of the corpus
+QUESTIONS = [
+    "Is the ALT value something to worry about?",
+    "What does the kidney panel say?",
+    "Should we repeat any of these tests?",
+    "Explain the red cell results in simple terms.",
+]
+
+
+# Corpus
+
+def make_lab_pdf(pages: int, abnormal: bool, rng: random.Random) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    for page in range(pages):
+        y = 740
+        pdf.drawString(72, y, f"Canine Laboratory Report - page {page + 1} of {pages}")
+        y -= 24
+        out_of_range = set(rng.sample(range(len(ANALYTES)), 3)) if abnormal and page == 0 else set()
+        for i, (name, unit, low, high) in enumerate(ANALYTES):
+            if i in out_of_range:
+                value = high * rng.uniform(1.3, 2.0)
+            else:
+                value = rng.uniform(low + (high - low) * 0.2, high - (high - low) * 0.2)
+            pdf.drawString(72, y, f"{name:<8} {value:>8.1f} {unit:<8} {low} - {high}")
+            y -= 14
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def make_corpus(size: int, seed: int) -> List[Tuple[str, bytes]]:
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        pages = rng.choices([p for p, _ in PAGE_SIZES], weights=[w for _, w in PAGE_SIZES])[0]
+        abnormal = i % 2 == 1
+        name = f"panel_{i:03d}_{pages}p_{'abnormal' if abnormal else 'normal'}.pdf"
+        corpus.append((name, make_lab_pdf(pages, abnormal, rng)))
+    return corpus
+
+
+# Stub Stripe
+
+class StubCheckout:
+    """Offline stand-in for StripeCheckout; every session is paid at once"""
+
+    sessions: Dict[str, Any] = {}  # shared by the clients for every webhook URL
+
+    def __init__(self, api_key: str, webhook_url: str):
+        self.webhook_url = webhook_url
+
+    async def create_checkout_session(self, request):
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = request
+        return SimpleNamespace(session_id=session_id, url=f"https://checkout.stripe.test/{session_id}")
+
+    async def get_checkout_status(self, session_id: str):
+        request = self.sessions.get(session_id)
+        amount = round(request.amount * 100) if request else 0
+        return SimpleNamespace(status="complete", payment_status="paid", amount_total=amount, currency="usd",
+                               metadata=getattr(request, "metadata", {}))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        event = json.loads(body)
+        session = event["data"]["object"]
+        return SimpleNamespace(event_id=event["id"], event_type=event["type"], session_id=session["id"],
+                               payment_status=session["payment_status"], metadata=session.get("metadata", {}))
+
+
+# In-process HTTP
+
+class Response:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+def encode_multipart(files: Dict[str, Tuple[str, bytes, str]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, (filename, content, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class AsgiClient:
+    """Calls the ASGI app directly: the full middleware and routing stack, no sockets"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, token: Optional[str] = None, json_body: Any = None,
+                      form: Optional[Dict[str, Any]] = None, files: Optional[Dict[str, Tuple]] = None,
+                      query: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+                      client: str = "127.0.0.1") -> Response:
+        body, content_type = b"", None
+        if json_body is not None:
+            body, content_type = json.dumps(json_body).encode(), "application/json"
+        elif files:
+            body, content_type = encode_multipart(files)
+        elif form is not None:
+            body, content_type = urlencode(form).encode(), "application/x-www-form-urlencoded"
+        header_list = [(b"host", b"loadtest.local"), (b"content-length", str(len(body)).encode())]
+        if content_type:
+            header_list.append((b"content-type", content_type.encode()))
+        if token:
+            header_list.append((b"authorization", f"Bearer {token}".encode()))
+        for name, value in (headers or {}).items():
+            header_list.append((name.lower().encode(), value.encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(query or {}).encode(), "headers": header_list,
+            "client": (client, 50000), "server": ("loadtest.local", 80),
+        }
+
+        finished = asyncio.Event()
+        body_sent = False
+        status, response_headers, chunks = 500, {}, []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return Response(status, response_headers, b"".join(chunks))
+
+
+# Measurement
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(max(math.ceil(p * len(sorted_values)) - 1, 0), len(sorted_values) - 1)]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        "count": len(values),
+        "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1]) if values else 0.0,
+        "mean_ms": ms(sum(values) / len(values)) if values else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+
+    async def call(self, name: str, request) -> Optional[Response]:
+        """Await ``request`` and record it under ``name``; None if it raised"""
+        started = time.perf_counter()
+        try:
+            response = await request
+        except Exception as e:
+            self.latencies[name].append(time.perf_counter() - started)
+            self.statuses[name][type(e).__name__] += 1
+            logging.getLogger("loadtest").debug("%s raised %r", name, e)
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][str(response.status)] += 1
+        return response
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.timings[name].append(seconds)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for name in sorted(self.latencies):
+            statuses = self.statuses[name]
+            errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500)
+            endpoints[name] = {
+                **summarize(self.latencies[name], elapsed),
+                "errors": errors,
+                "statuses": dict(sorted(statuses.items())),
+            }
+        timings = {name: summarize(values, elapsed) for name, values in sorted(self.timings.items())}
+        return {"endpoints": endpoints, "timings": timings}
+
+
+# Workload
+
+class LoadTest:
+    def __init__(self, server, args, corpus: List[Tuple[str, bytes]]):
+        self.server = server
+        self.args = args
+        self.corpus = corpus
+        self.client = AsgiClient(server.app)
+        self.recorder = Recorder()
+        self.rng = random.Random(args.seed)
+        self.users: List[Dict[str, Any]] = []
+        self.deadline = 0.0
+
+    @property
+    def running(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    async def pause(self, seconds: float) -> None:
+        await asyncio.sleep(max(min(seconds, self.deadline - time.monotonic()), 0))
+
+    async def setup(self, recorder: Recorder) -> None:
+        """Register the users and give them credits for the run"""
+        async def register(i: int):
+            email = f"loadtest{i}@example.com"
+            address = f"10.0.{i // 250}.{i % 250 + 1}"  # login limits are per client address
+            response = await recorder.call("POST /api/auth/register", self.client.request(
+                "POST", "/api/auth/register", client=address,
+                json_body={"email": email, "password": PASSWORD, "full_name": f"Load Test {i}"}))
+            if response is None or response.status != 200:
+                raise RuntimeError(f"Could not register {email}: {response and response.body[:200]}")
+            body = response.json()
+            return {"email": email, "address": address, "id": body["user"]["id"], "token": body["access_token"],
+                    "completed": []}
+
+        self.users = await asyncio.gather(*(register(i) for i in range(self.args.users)))
+        await self.server.users_collection.update_many({}, {"$set": {"credits": self.args.credits}})
+        for user in self.users:
+            self.server.invalidate_user(user["id"])
+
+    async def login_bursts(self) -> None:
+        while self.running:
+            burst = self.rng.sample(self.users, min(self.args.login_burst, len(self.users)))
+            await asyncio.gather(*(
+                self.recorder.call("POST /api/auth/login", self.client.request(
+                    "POST", "/api/auth/login", client=user["address"],
+                    json_body={"email": user["email"], "password": PASSWORD}))
+                for user in burst
+            ))
+            await self.pause(self.args.login_interval)
+
+    async def uploader(self, user: Dict[str, Any]) -> None:
+        while self.running:
+            filename, content = self.rng.choice(self.corpus)
+            started = time.perf_counter()
+            response = await self.recorder.call("POST /api/blood-test/upload", self.client.request(
+                "POST", "/api/blood-test/upload", token=user["token"],
+                files={"file": (filename, content, "application/pdf")}))
+            if response is None or response.status != 200:
+                await self.pause(float((response and response.headers.get("retry-after")) or 1))
+                continue
+            test_id = response.json()["test_id"]
+
+            status = response.json()["status"]
+            while status not in self.server.TERMINAL_TEST_STATUSES and self.running:
+                await self.pause(self.args.status_interval)
+                response = await self.recorder.call("GET /api/blood-test/{test_id}/status", self.client.request(
+                    "GET", f"/api/blood-test/{test_id}/status", token=user["token"]))
+                if response is not None and response.status == 200:
+                    status = response.json()["status"]
+            if status != self.server.TEST_STATUS_COMPLETED:
+                continue
+            self.recorder.observe("upload_to_completed", time.perf_counter() - started)
+            user["completed"].append(test_id)
+
+            if self.running and self.rng.random() < self.args.download_ratio:
+                await self.recorder.call("GET /api/blood-test/{test_id}/download", self.client.request(
+                    "GET", f"/api/blood-test/{test_id}/download", token=user["token"]))
+
+    async def chatter(self, user: Dict[str, Any]) -> None:
+        while self.running:
+            if not user["completed"]:
+                await self.pause(0.5)
+                continue
+            await self.recorder.call("POST /api/chat/ask", self.client.request(
+                "POST", "/api/chat/ask", token=user["token"],
+                json_body={"message": self.rng.choice(QUESTIONS), "session_id": self.rng.choice(user["completed"])}))
+            await self.pause(self.args.chat_interval)
+
+    async def poller(self, user: Dict[str, Any]) -> None:
+        while self.running:
+            await self.recorder.call("GET /api/user/blood-tests", self.client.request(
+                "GET", "/api/user/blood-tests", token=user["token"], query={"limit": 20}))
+            await self.recorder.call("GET /api/user/profile", self.client.request(
+                "GET", "/api/user/profile", token=user["token"]))
+            await self.pause(self.args.poll_interval)
+
+    async def buyer(self, user: Dict[str, Any]) -> None:
+        while self.running:
+            response = await self.recorder.call("POST /api/payments/create-checkout", self.client.request(
+                "POST", "/api/payments/create-checkout", token=user["token"],
+                form={"credits": 1, "host_url": HOST_URL}))
+            if response is not None and response.status == 200:
+                session_id = response.json()["session_id"]
+                event = {
+                    "id": f"evt_{uuid.uuid4().hex}", "type": "checkout.session.completed",
+                    "data": {"object": {"id": session_id, "payment_status": "paid",
+                                        "metadata": {"user_id": user["id"], "credits": "1"}}}
+                }
+                await self.recorder.call("POST /api/webhook/stripe", self.client.request(
+                    "POST", "/api/webhook/stripe", json_body=event, headers={"Stripe-Signature": "t=0,v1=stub"}))
+                await self.recorder.call("GET /api/payments/status/{session_id}", self.client.request(
+                    "GET", f"/api/payments/status/{session_id}"))
+            await self.pause(self.args.checkout_interval)
+
+    async def run(self) -> float:
+        user = lambda i: self.users[i % len(self.users)]
+        workers = [self.login_bursts()]
+        workers += [self.uploader(user(i)) for i in range(self.args.uploaders)]
+        workers += [self.chatter(user(i)) for i in range(self.args.chatters)]
+        workers += [self.poller(user(i)) for i in range(self.args.pollers)]
+        workers += [self.buyer(user(i)) for i in range(self.args.buyers)]
+        started = time.perf_counter()
+        self.deadline = time.monotonic() + self.args.duration
+        await asyncio.gather(*workers)
+        return time.perf_counter() - started
+
+
+# Reporting
+
+def server_metrics(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Histograms (count, mean) and counters from the app's registry that saw traffic.
+
+    Means of ``*_seconds`` histograms are reported in ms; other histograms
+    (ratios, token counts) keep their own unit.
+    """
+    result = {}
+    for name, metric in sorted(snapshot.items()):
+        if metric["type"] not in ("histogram", "counter") or name == "http_request_duration_seconds":
+            continue
+        seconds = name.endswith("_seconds")
+        samples = {}
+        for sample in metric["samples"]:
+            label = ",".join(f"{k}={v}" for k, v in sample["labels"].items()) or "_"
+            value = sample["value"]
+            if metric["type"] == "histogram":
+                if value["count"]:
+                    mean = value["sum"] / value["count"]
+                    samples[label] = {"count": value["count"], **(
+                        {"mean_ms": round(mean * 1000, 2)} if seconds else {"mean": round(mean, 2)}
+                    )}
+            elif value:
+                samples[label] = value
+        if samples:
+            result[name] = samples
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"\n{'endpoint':<42} {'count':>7} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for name, stats in results["endpoints"].items():
+        print(f"{name:<42} {stats['count']:>7} {stats['rps']:>8.2f} {stats['p50_ms']:>7.1f}ms "
+              f"{stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms {stats['errors']:>7}")
+    for name, stats in results["timings"].items():
+        print(f"{name:<42} {stats['count']:>7} {'':>8} {stats['p50_ms']:>7.1f}ms "
+              f"{stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float,
+            min_count: int) -> List[str]:
+    """Endpoints whose p95 rose, or whose throughput fell, by more than ``tolerance``"""
+    regressions = []
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'} ({baseline.get('started_at')}):")
+    ignored = ("output", "baseline", "tolerance", "min_delta_ms", "min_count", "mongo_url")
+    changed = sorted(
+        key for key, value in results["config"].items()
+        if key not in ignored and baseline.get("config", {}).get(key) != value
+    )
+    if changed:
+        print(f"  warning: the baseline ran with different settings: {', '.join(changed)}")
+    for name, stats in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or min(before["count"], stats["count"]) < min_count:
+            continue
+        p95_change = (stats["p95_ms"] - before["p95_ms"]) / max(before["p95_ms"], 1e-9)
+        rps_change = (stats["rps"] - before["rps"]) / max(before["rps"], 1e-9)
+        regressed = (p95_change > tolerance and stats["p95_ms"] - before["p95_ms"] > min_delta_ms) \
+            or rps_change < -tolerance
+        print(f"  {'REGRESSED' if regressed else 'ok':<10} {name:<42} p95 {before['p95_ms']:.1f} -> "
+              f"{stats['p95_ms']:.1f}ms ({p95_change:+.0%})  rps {before['rps']:.2f} -> {stats['rps']:.2f} "
+              f"({rps_change:+.0%})")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+# Setup
+
+def configure_environment(args, workdir: str) -> None:
+    """Settings the app reads at import time"""
+    os.environ.update({
+        "LLM_STUB": "true",
+        "LLM_STUB_LATENCY": str(args.llm_latency),
+        "LLM_STUB_OUTPUT_TOKENS": str(args.llm_output_tokens),
+        "LLM_STUB_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "STRIPE_API_KEY": "sk_test_loadtest",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "JOB_QUEUE_BACKEND": "local",
+        "BLOB_BACKEND": "filesystem",
+        "BLOB_ROOT": os.path.join(workdir, "blobs"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "REPORT_SPOOL_DIR": os.path.join(workdir, "reports"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+    })
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    else:
+        import motor.motor_asyncio
+        import mongo_standin
+        mongo_standin.StandInClient.latency = args.mongo_latency_ms / 1000
+        motor.motor_asyncio.AsyncIOMotorClient = mongo_standin.StandInClient
+
+
+async def run(args) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="dogbloodgpt-loadtest-") as workdir:
+        configure_environment(args, workdir)
+        import server
+        server.payment_clients.factory = StubCheckout
+        server.payment_clients.request_factory = SimpleNamespace
+
+        print(f"Generating {args.corpus_size} synthetic lab PDFs...")
+        corpus = make_corpus(args.corpus_size, args.seed)
+        sizes = sorted(len(content) for _, content in corpus)
+        print(f"  {sizes[0] // 1024}-{sizes[-1] // 1024} KB")
+
+        async with server.app.router.lifespan_context(server.app):
+            test = LoadTest(server, args, corpus)
+            setup = Recorder()
+            started = time.perf_counter()
+            await test.setup(setup)
+            print(f"Registered {args.users} users in {time.perf_counter() - started:.1f}s; "
+                  f"running for {args.duration:.0f}s...")
+            elapsed = await test.run()
+            snapshot = server.REGISTRY.snapshot()
+
+        return {
+            "started_at": datetime.utcnow().isoformat(),
+            "revision": git_revision(),
+            "config": vars(args),
+            "elapsed_s": round(elapsed, 2),
+            **test.recorder.report(elapsed),
+            "setup": setup.report(elapsed)["endpoints"],
+            "server_metrics": server_metrics(snapshot),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of mixed load")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--credits", type=int, default=10000, help="credits given to each user")
+    parser.add_argument("--uploaders", type=int, default=8)
+    parser.add_argument("--chatters", type=int, default=4)
+    parser.add_argument("--pollers", type=int, default=10)
+    parser.add_argument("--buyers", type=int, default=1)
+    parser.add_argument("--login-burst", type=int, default=20)
+    parser.add_argument("--login-interval", type=float, default=5)
+    parser.add_argument("--poll-interval", type=float, default=1)
+    parser.add_argument("--status-interval", type=float, default=0.5)
+    parser.add_argument("--chat-interval", type=float, default=2)
+    parser.add_argument("--checkout-interval", type=float, default=3)
+    parser.add_argument("--download-ratio", type=float, default=0.5, help="share of completed tests downloaded")
+    parser.add_argument("--corpus-size", type=int, default=40)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="stub LLM seconds to first token")
+    parser.add_argument("--llm-output-tokens", type=int, default=200)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0, help="0 = instant")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--mongo-url", default="", help="real Mongo instead of the in-memory stand-in")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.5, help="stand-in round trip")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/rps change before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=5, help="ignore p95 increases smaller than this")
+    parser.add_argument("--min-count", type=int, default=20, help="ignore endpoints with fewer requests")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms, args.min_count)
+        if regressions:
+            print(f"{len(regressions)} endpoint(s) regressed")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
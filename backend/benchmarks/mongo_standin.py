@@ -0,0 +1,463 @@
+"""
+In-memory stand-in for the Motor client, for offline load tests.
+
+Implements the subset of the collection API the backend uses (find with
+sort/limit, find_one_and_update, upserts, $set/$inc/$push/$pull/...,
+unique indexes) with Mongo's matching rules for the operators it queries
+with. Each operation yields to the event loop, after ``latency`` seconds if
+given, the way a round trip to a real server would; the operation itself
+then runs atomically. Scans are linear, which is fine for load-test sized
+data sets but makes this no substitute for bench_queries.py.
+
+Install it before the API server is imported:
+    import motor.motor_asyncio, mongo_standin
+    motor.motor_asyncio.AsyncIOMotorClient = mongo_standin.StandInClient
+"""
+import asyncio
+import copy
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+@dataclass
+class InsertOneResult:
+    inserted_id: Any
+
+
+@dataclass
+class InsertManyResult:
+    inserted_ids: List[Any]
+
+
+@dataclass
+class UpdateResult:
+    matched_count: int
+    modified_count: int
+    upserted_id: Any = None
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int
+
+
+# Matching
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value: Any, expected: Any, op: str) -> bool:
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        if item is _MISSING or item is None or expected is None:
+            continue
+        try:
+            if op == "$gt" and item > expected or op == "$gte" and item >= expected \
+                    or op == "$lt" and item < expected or op == "$lte" and item <= expected:
+                return True
+        except TypeError:
+            continue  # different BSON types never compare in a query
+    return False
+
+
+def _match_operators(value: Any, condition: Dict[str, Any]) -> bool:
+    options = condition.get("$options", "")
+    for op, expected in condition.items():
+        if op == "$eq":
+            ok = _equals(value, expected)
+        elif op == "$ne":
+            ok = not _equals(value, expected)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _compare(value, expected, op)
+        elif op == "$in":
+            ok = any(_equals(value, item) for item in expected)
+        elif op == "$nin":
+            ok = not any(_equals(value, item) for item in expected)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(expected)
+        elif op == "$not":
+            ok = not _match_value(value, expected)
+        elif op == "$regex":
+            flags = re.IGNORECASE if "i" in options else 0
+            ok = isinstance(value, str) and re.search(expected, value, flags) is not None
+        elif op == "$options":
+            continue
+        else:
+            raise NotImplementedError(f"Query operator {op} is not supported by the stand-in")
+        if not ok:
+            return False
+    return True
+
+
+def _match_value(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        return _match_operators(value, condition)
+    return _equals(value, condition)
+
+
+def matches(document: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            ok = all(matches(document, sub) for sub in condition)
+        elif key == "$or":
+            ok = any(matches(document, sub) for sub in condition)
+        elif key == "$nor":
+            ok = not any(matches(document, sub) for sub in condition)
+        elif "." in key:
+            raise NotImplementedError("Dotted paths are not supported by the stand-in")
+        else:
+            ok = _match_value(document.get(key, _MISSING), condition)
+        if not ok:
+            return False
+    return True
+
+
+# Updates
+
+def _apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for field, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                document[field] = copy.deepcopy(value)
+            elif op == "$unset":
+                document.pop(field, None)
+            elif op == "$inc":
+                document[field] = document.get(field, 0) + value
+            elif op == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                document.setdefault(field, []).extend(copy.deepcopy(items))
+            elif op == "$addToSet":
+                current = document.setdefault(field, [])
+                if value not in current:
+                    current.append(copy.deepcopy(value))
+            elif op == "$pull":
+                document[field] = [item for item in document.get(field, []) if not _match_value(item, value)]
+            elif op in ("$min", "$max"):
+                current = document.get(field, _MISSING)
+                if current is _MISSING or (value < current if op == "$min" else value > current):
+                    document[field] = value
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported by the stand-in")
+
+
+def _upsert_base(query: Dict[str, Any]) -> Dict[str, Any]:
+    """The equality fields of a query, which an upserted document starts from"""
+    base = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                base[key] = copy.deepcopy(condition["$eq"])
+            continue
+        base[key] = copy.deepcopy(condition)
+    return base
+
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(document)
+    include = {field for field, flag in projection.items() if flag and field != "_id"}
+    if include:
+        result = {field: copy.deepcopy(document[field]) for field in include if field in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    exclude = {field for field, flag in projection.items() if not flag}
+    return {field: copy.deepcopy(value) for field, value in document.items() if field not in exclude}
+
+
+def _sort_rank(value: Any) -> Tuple:
+    # Mongo's cross-type order for the types the backend stores
+    if value is _MISSING or value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (4, str(value))
+    if isinstance(value, datetime):
+        return (6, value)
+    return (3, str(value))
+
+
+def _sort(documents: List[Dict[str, Any]], spec: Iterable[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    # Stable sorts, least significant key first
+    for field, direction in reversed(list(spec)):
+        documents.sort(key=lambda d: _sort_rank(d.get(field, _MISSING)), reverse=direction < 0)
+    return documents
+
+
+def _sort_spec(key_or_list, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return list(key_or_list)
+
+
+class StandInCursor:
+    def __init__(self, collection: "StandInCollection", query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "StandInCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "StandInCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "StandInCursor":
+        self._limit = count
+        return self
+
+    def _run(self) -> List[Dict[str, Any]]:
+        documents = _sort([d for d in self.collection._documents if matches(d, self.query)], self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(d, self.projection) for d in documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await self.collection._round_trip()
+        results = self._run()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            await self.collection._round_trip()
+            self._results = self._run()
+        if not self._results:
+            raise StopAsyncIteration
+        return self._results.pop(0)
+
+
+class StandInCollection:
+    def __init__(self, name: str, latency: float = 0):
+        self.name = name
+        self.latency = latency
+        self._documents: List[Dict[str, Any]] = []
+        # index name -> (fields, unique, sparse)
+        self._indexes: Dict[str, Tuple[List[Tuple[str, int]], bool, bool]] = {"_id_": ([("_id", 1)], True, False)}
+
+    async def _round_trip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    # Indexes
+
+    async def create_index(self, keys, unique: bool = False, sparse: bool = False, name: Optional[str] = None,
+                           **kwargs) -> str:
+        fields = _sort_spec(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in fields)
+        self._indexes[name] = (fields, unique, sparse)
+        return name
+
+    async def create_indexes(self, models) -> List[str]:
+        names = []
+        for model in models:
+            spec = model.document
+            names.append(await self.create_index(
+                list(spec["key"].items()), unique=spec.get("unique", False),
+                sparse=spec.get("sparse", False), name=spec.get("name")
+            ))
+        return names
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"key": fields, **({"unique": True} if unique else {}), **({"sparse": True} if sparse else {})}
+            for name, (fields, unique, sparse) in self._indexes.items()
+        }
+
+    def _check_unique(self, document: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None) -> None:
+        for name, (fields, unique, sparse) in self._indexes.items():
+            if not unique:
+                continue
+            key = tuple(document.get(field) for field, _ in fields)
+            if sparse and all(field not in document for field, _ in fields):
+                continue
+            for other in self._documents:
+                if other is ignore or other is document:
+                    continue
+                if sparse and all(field not in other for field, _ in fields):
+                    continue
+                if tuple(other.get(field) for field, _ in fields) == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: {name}", 11000)
+
+    # Writes
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._documents.append(stored)
+        return document["_id"]
+
+    async def insert_one(self, document: Dict[str, Any]) -> InsertOneResult:
+        await self._round_trip()
+        return InsertOneResult(self._insert(document))
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True) -> InsertManyResult:
+        await self._round_trip()
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return InsertManyResult(inserted)
+
+    def _first(self, query, sort=None) -> Optional[Dict[str, Any]]:
+        candidates = [d for d in self._documents if matches(d, query)]
+        if sort:
+            candidates = _sort(candidates, _sort_spec(sort))
+        return candidates[0] if candidates else None
+
+    def _update_document(self, document: Dict[str, Any], update: Dict[str, Any]) -> bool:
+        updated = copy.deepcopy(document)
+        _apply_update(updated, update, inserting=False)
+        if updated == document:
+            return False
+        self._check_unique(updated, ignore=document)
+        document.clear()
+        document.update(updated)
+        return True
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+        document = _upsert_base(query)
+        _apply_update(document, update, inserting=True)
+        self._insert(document)
+        return self._documents[-1]
+
+    async def update_one(self, query, update, upsert: bool = False) -> UpdateResult:
+        await self._round_trip()
+        document = self._first(query)
+        if document is None:
+            if upsert:
+                return UpdateResult(0, 0, self._upsert(query, update)["_id"])
+            return UpdateResult(0, 0)
+        return UpdateResult(1, int(self._update_document(document, update)))
+
+    async def update_many(self, query, update, upsert: bool = False) -> UpdateResult:
+        await self._round_trip()
+        documents = [d for d in self._documents if matches(d, query)]
+        if not documents and upsert:
+            return UpdateResult(0, 0, self._upsert(query, update)["_id"])
+        modified = sum(self._update_document(d, update) for d in documents)
+        return UpdateResult(len(documents), modified)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = False, **kwargs) -> Optional[Dict[str, Any]]:
+        await self._round_trip()
+        document = self._first(query, sort)
+        if document is None:
+            if not upsert:
+                return None
+            document = self._upsert(query, update)
+            return _project(document, projection) if return_document else None
+        before = _project(document, projection)
+        self._update_document(document, update)
+        return _project(document, projection) if return_document else before
+
+    async def delete_one(self, query) -> DeleteResult:
+        await self._round_trip()
+        document = self._first(query)
+        if document is None:
+            return DeleteResult(0)
+        self._documents.remove(document)
+        return DeleteResult(1)
+
+    async def delete_many(self, query) -> DeleteResult:
+        await self._round_trip()
+        keep = [d for d in self._documents if not matches(d, query)]
+        deleted = len(self._documents) - len(keep)
+        self._documents = keep
+        return DeleteResult(deleted)
+
+    # Reads
+
+    async def find_one(self, query=None, projection=None, sort=None, **kwargs) -> Optional[Dict[str, Any]]:
+        await self._round_trip()
+        document = self._first(query, sort)
+        return _project(document, projection) if document is not None else None
+
+    def find(self, query=None, projection=None, **kwargs) -> StandInCursor:
+        return StandInCursor(self, query, projection)
+
+    async def count_documents(self, query, limit: int = 0, **kwargs) -> int:
+        await self._round_trip()
+        count = sum(1 for d in self._documents if matches(d, query))
+        return min(count, limit) if limit else count
+
+
+class StandInDatabase:
+    def __init__(self, name: str, latency: float = 0):
+        self.name = name
+        self.latency = latency
+        self._collections: Dict[str, StandInCollection] = {}
+
+    def __getitem__(self, name: str) -> StandInCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = StandInCollection(name, self.latency)
+        return collection
+
+    def __getattr__(self, name: str) -> StandInCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+
+class StandInClient:
+    """Accepts (and ignores) the AsyncIOMotorClient arguments"""
+
+    latency = 0.0  # seconds per operation, set before the client is created
+
+    def __init__(self, *args, **kwargs):
+        self._databases: Dict[str, StandInDatabase] = {}
+
+    def __getitem__(self, name: str) -> StandInDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = StandInDatabase(name, self.latency)
+        return database
+
+    def __getattr__(self, name: str) -> StandInDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,429 @@
+"""Pluggable storage for generated PDF reports.
+
+Backends share one small async interface: ``put`` a blob (or ``put_file``
+one already written to disk), ``stat`` it and stream a byte range of it
+back with ``iter_range``. Blood test documents
+keep only a reference (key, size, ETag) to the stored blob.
+
+* ``FilesystemBlobStore`` - files under a local directory
+* ``GridFSBlobStore`` - Mongo GridFS bucket
+* ``S3BlobStore`` - any client with the boto3 S3 object methods;
+  ``LocalS3Client`` satisfies that interface on local disk for tests
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Tuple
+
+import aiofiles
+
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class BlobInfo:
+    key: str
+    size: int
+    etag: str
+    content_type: str = "application/octet-stream"
+
+    def to_dict(self) -> dict:
+        return {"key": self.key, "size": self.size, "etag": self.etag, "content_type": self.content_type}
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+def compute_etag(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _file_etag(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single-range ``Range`` header.
+
+    Returns None when there is no usable range (serve the whole blob) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(f"Malformed range: {header}")
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+class BlobStore:
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> BlobInfo:
+        raise NotImplementedError
+
+    async def put_file(self, key: str, path: str, content_type: str = "application/octet-stream",
+                       etag: Optional[str] = None) -> BlobInfo:
+        """Store the file at ``path``, which the store may move or consume.
+
+        ``etag`` is the file's sha256 hex digest when the caller already has it.
+        """
+        data = await asyncio.to_thread(_read_file, path)
+        return await self.put(key, data, content_type)
+
+    async def stat(self, key: str) -> BlobInfo:
+        """Blob metadata; raises BlobNotFound"""
+        raise NotImplementedError
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield bytes ``start`` to ``end`` (inclusive; None means to the end)"""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_range(key)])
+
+
+class FilesystemBlobStore(BlobStore):
+    """Blobs as files under ``root``.
+
+    A blob's bytes go to a file named after its ETag, next to a ``.meta``
+    file that names it. The data file is written first and the metadata
+    replaced atomically after, so readers always see a matching pair; the
+    previous data file is removed once the new metadata is in place.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_meta(self, key: str) -> dict:
+        try:
+            with open(self._path(key) + ".meta") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def _data_path(self, key: str, meta: dict) -> str:
+        path = self._path(key)
+        # Blobs stored before data files were named by ETag live at the key's path
+        return os.path.join(os.path.dirname(path), meta["data"]) if "data" in meta else path
+
+    def _commit(self, info: BlobInfo, data_path: str) -> None:
+        """Point the key's metadata at ``data_path`` and drop the data it replaced"""
+        try:
+            previous = self._data_path(info.key, self._read_meta(info.key))
+        except BlobNotFound:
+            previous = None
+        meta = {**info.to_dict(), "data": os.path.basename(data_path)}
+        self._write_atomic(self._path(info.key) + ".meta", json.dumps(meta).encode())
+        if previous is not None and previous != data_path:
+            with suppress(FileNotFoundError):
+                os.remove(previous)
+
+    def _put(self, info: BlobInfo, data: bytes) -> None:
+        data_path = f"{self._path(info.key)}.{info.etag}"
+        self._write_atomic(data_path, data)
+        self._commit(info, data_path)
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> BlobInfo:
+        info = BlobInfo(key=key, size=len(data), etag=compute_etag(data), content_type=content_type)
+        await asyncio.to_thread(self._put, info, data)
+        return info
+
+    def _put_file(self, info: BlobInfo, path: str) -> None:
+        data_path = f"{self._path(info.key)}.{info.etag}"
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # Same filesystem: an atomic rename; otherwise copied next to the target first
+        self._move_atomic(path, data_path)
+        self._commit(info, data_path)
+
+    async def put_file(self, key: str, path: str, content_type: str = "application/octet-stream",
+                       etag: Optional[str] = None) -> BlobInfo:
+        """Move the file into place instead of copying it through memory"""
+        if etag is None:
+            etag = await asyncio.to_thread(_file_etag, path)
+        size = await asyncio.to_thread(os.path.getsize, path)
+        info = BlobInfo(key=key, size=size, etag=etag[:32], content_type=content_type)
+        await asyncio.to_thread(self._put_file, info, path)
+        return info
+
+    @staticmethod
+    def _move_atomic(path: str, target: str) -> None:
+        try:
+            os.replace(path, target)
+        except OSError:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+            os.close(fd)
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+            os.remove(path)
+
+    async def stat(self, key: str) -> BlobInfo:
+        meta = await asyncio.to_thread(self._read_meta, key)
+        return BlobInfo(key=meta["key"], size=meta["size"], etag=meta["etag"], content_type=meta["content_type"])
+
+    async def _open(self, key: str):
+        # A concurrent put may remove the data file between reading the metadata and opening it
+        for _ in range(2):
+            meta = await asyncio.to_thread(self._read_meta, key)
+            try:
+                return await aiofiles.open(self._data_path(key, meta), "rb")
+            except FileNotFoundError:
+                pass
+        raise BlobNotFound(key)
+
+    async def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        f = await self._open(key)
+        try:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await f.close()
+
+    def _delete(self, key: str) -> None:
+        path = self._path(key)
+        try:
+            data_path = self._data_path(key, self._read_meta(key))
+        except BlobNotFound:
+            data_path = path
+        for stale in (path + ".meta", data_path, path):
+            with suppress(FileNotFoundError):
+                os.remove(stale)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+
+class GridFSBlobStore(BlobStore):
+    def __init__(self, db, bucket_name: str = "reports"):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+
+    async def _latest(self, key: str):
+        cursor = self.bucket.find({"filename": key}).sort("uploadDate", -1).limit(1)
+        files = await cursor.to_list(length=1)
+        if not files:
+            raise BlobNotFound(key)
+        return files[0]
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> BlobInfo:
+        info = BlobInfo(key=key, size=len(data), etag=compute_etag(data), content_type=content_type)
+        file_id = await self.bucket.upload_from_stream(key, data, metadata=info.to_dict())
+        # Keep only the newest revision
+        async for old in self.bucket.find({"filename": key, "_id": {"$ne": file_id}}):
+            await self.bucket.delete(old._id)
+        return info
+
+    async def put_file(self, key: str, path: str, content_type: str = "application/octet-stream",
+                       etag: Optional[str] = None) -> BlobInfo:
+        """Upload from the open file in chunks"""
+        if etag is None:
+            etag = await asyncio.to_thread(_file_etag, path)
+        info = BlobInfo(key=key, size=os.path.getsize(path), etag=etag[:32], content_type=content_type)
+        with open(path, "rb") as f:
+            file_id = await self.bucket.upload_from_stream(key, f, metadata=info.to_dict())
+        async for old in self.bucket.find({"filename": key, "_id": {"$ne": file_id}}):
+            await self.bucket.delete(old._id)
+        return info
+
+    async def stat(self, key: str) -> BlobInfo:
+        grid_out = await self._latest(key)
+        return BlobInfo(**grid_out.metadata)
+
+    async def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        grid_out = await self._latest(key)
+        stream = await self.bucket.open_download_stream(grid_out._id)
+        stream.seek(start)
+        remaining = (end if end is not None else stream.length - 1) - start + 1
+        while remaining > 0:
+            chunk = await stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    async def delete(self, key: str) -> None:
+        async for grid_out in self.bucket.find({"filename": key}):
+            await self.bucket.delete(grid_out._id)
+
+
+class LocalS3Client:
+    """Stand-in for a boto3 S3 client that stores objects on local disk"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType: str = "binary/octet-stream",
+                   Metadata: Optional[dict] = None):
+        path = self._path(Bucket, Key)
+        FilesystemBlobStore._write_atomic(path, Body)
+        head = {"ContentType": ContentType, "Metadata": Metadata or {}, "ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+        FilesystemBlobStore._write_atomic(path + ".head", json.dumps(head).encode())
+        return {"ETag": head["ETag"]}
+
+    def head_object(self, Bucket: str, Key: str):
+        path = self._path(Bucket, Key)
+        try:
+            with open(path + ".head") as f:
+                head = json.load(f)
+        except FileNotFoundError:
+            raise BlobNotFound(Key)
+        head["ContentLength"] = os.path.getsize(path)
+        return head
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise BlobNotFound(Key)
+        f = open(path, "rb")
+        if Range:
+            start, _, end = Range.replace("bytes=", "").partition("-")
+            f.seek(int(start))
+            body = _LimitedReader(f, int(end) - int(start) + 1 if end else None)
+        else:
+            body = f
+        return {"Body": body}
+
+    def delete_object(self, Bucket: str, Key: str):
+        for path in (self._path(Bucket, Key), self._path(Bucket, Key) + ".head"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _LimitedReader:
+    """File wrapper that stops reading after ``limit`` bytes, like a ranged S3 body"""
+
+    def __init__(self, f, limit: Optional[int]):
+        self.f = f
+        self.remaining = limit
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining is not None:
+            size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket; client calls run in a thread"""
+
+    def __init__(self, client, bucket: str, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> BlobInfo:
+        info = BlobInfo(key=key, size=len(data), etag=compute_etag(data), content_type=content_type)
+        await asyncio.to_thread(
+            self.client.put_object, Bucket=self.bucket, Key=self._key(key), Body=data,
+            ContentType=content_type, Metadata={"etag": info.etag}
+        )
+        return info
+
+    async def stat(self, key: str) -> BlobInfo:
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(key))
+        except BlobNotFound:
+            raise
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNotFound(key)
+            raise
+        return BlobInfo(
+            key=key,
+            size=head["ContentLength"],
+            etag=head.get("Metadata", {}).get("etag") or head["ETag"].strip('"'),
+            content_type=head.get("ContentType", "application/octet-stream"),
+        )
+
+    async def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=self._key(key), Range=byte_range
+        )
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(key))
+
+
+def create_blob_store(backend: str, db=None, root: str = "/tmp/dogbloodgpt/blobs", bucket: str = "",
+                      endpoint_url: str = "") -> BlobStore:
+    """Build the configured backend: filesystem, gridfs, s3 or s3-local"""
+    if backend == "filesystem":
+        return FilesystemBlobStore(root)
+    if backend == "gridfs":
+        return GridFSBlobStore(db)
+    if backend == "s3-local":
+        return S3BlobStore(LocalS3Client(root), bucket or "reports")
+    if backend == "s3":
+        import boto3  # optional dependency, only needed for real S3
+        return S3BlobStore(boto3.client("s3", endpoint_url=endpoint_url or None), bucket)
+    raise ValueError(f"Unknown blob backend: {backend}")
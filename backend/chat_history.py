@@ -0,0 +1,150 @@
+"""Chat history storage.
+
+Messages live in the append-only ``chat_messages`` collection, one
+document per message with a per-session sequence number. The session
+document stays small: a message count, the newest few messages and a
+rolling extractive summary of everything older. Building a prompt reads
+only the session document, however long the conversation gets.
+
+Sessions written before this layout keep their messages in an embedded
+``messages`` array; they are moved over the first time they are loaded.
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from chat_manager import roll_summary
+
+SESSION_PROJECTION = {"_id": 0, "session_id": 1, "message_count": 1, "summary": 1, "recent": 1, "messages": 1}
+MESSAGE_PROJECTION = {"_id": 0, "id": 1, "seq": 1, "role": 1, "content": 1, "timestamp": 1}
+
+
+class ChatHistoryStore:
+    def __init__(self, sessions, messages, recent_messages: int = 20, summary_token_budget: int = 300):
+        self.sessions = sessions
+        self.messages = messages
+        self.recent_messages = recent_messages
+        self.summary_token_budget = summary_token_budget
+
+    def _message(self, session_id: str, user_id: str, seq: int, role: str, content: str,
+                 timestamp: datetime) -> Dict[str, Any]:
+        return {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "user_id": user_id,
+            "seq": seq,
+            "role": role,
+            "content": content,
+            "timestamp": timestamp,
+        }
+
+    def _compact(self, summary: str, recent: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """Fold messages beyond the recent window into the summary"""
+        overflow = len(recent) - self.recent_messages
+        if overflow <= 0:
+            return summary, recent
+        return roll_summary(summary, recent[:overflow], self.summary_token_budget), recent[overflow:]
+
+    async def load(self, query: Dict[str, Any], user_id: str) -> Optional[Dict[str, Any]]:
+        """Session matching ``query`` with ``summary``, ``recent`` and ``message_count``"""
+        session = await self.sessions.find_one(query, SESSION_PROJECTION)
+        if session is not None and "messages" in session:
+            session = await self.migrate_legacy(session["session_id"], user_id, session["messages"])
+        return session
+
+    async def get_or_create(self, session_id: str, user_id: str, test_id: str) -> Dict[str, Any]:
+        session = await self.load({"session_id": session_id}, user_id)
+        if session is None:
+            session = {
+                "session_id": session_id,
+                "user_id": user_id,
+                "test_id": test_id,
+                "message_count": 0,
+                "summary": "",
+                "recent": [],
+                "created_at": datetime.utcnow()
+            }
+            await self.sessions.update_one(
+                {"session_id": session_id}, {"$setOnInsert": session}, upsert=True
+            )
+        return session
+
+    async def migrate_legacy(self, session_id: str, user_id: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Move an embedded ``messages`` array into chat_messages"""
+        documents = [
+            self._message(session_id, user_id, seq, m["role"], m["content"], m.get("timestamp") or datetime.utcnow())
+            for seq, m in enumerate(messages, start=1)
+        ]
+        if documents:
+            try:
+                await self.messages.insert_many(documents, ordered=False)
+            except BulkWriteError:
+                pass  # a concurrent or interrupted migration already stored some sequence numbers
+        summary, recent = self._compact("", [
+            {"role": d["role"], "content": d["content"], "timestamp": d["timestamp"]} for d in documents
+        ])
+        fields = {"message_count": len(documents), "summary": summary, "recent": recent}
+        await self.sessions.update_one(
+            {"session_id": session_id, "messages": {"$exists": True}},
+            {"$set": fields, "$unset": {"messages": ""}}
+        )
+        return {"session_id": session_id, **fields}
+
+    async def append_turn(self, session_id: str, user_id: str, question: str, answer: str) -> None:
+        # Reserve two sequence numbers; the returned document is the state before this turn
+        before = await self.sessions.find_one_and_update(
+            {"session_id": session_id},
+            {"$inc": {"message_count": 2}},
+            projection={"_id": 0, "message_count": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        count = (before or {}).get("message_count", 0)
+        now = datetime.utcnow()
+        documents = [
+            self._message(session_id, user_id, count + 1, "user", question, now),
+            self._message(session_id, user_id, count + 2, "assistant", answer, now),
+        ]
+        await self.messages.insert_many(documents)
+        await self._add_to_window(session_id, [
+            {"seq": d["seq"], "role": d["role"], "content": d["content"], "timestamp": d["timestamp"]}
+            for d in documents
+        ], now)
+
+    async def _add_to_window(self, session_id: str, entries: List[Dict[str, Any]], now: datetime) -> None:
+        """Merge messages into the recent window and summary.
+
+        Concurrent turns in one session each rebuild both from what they
+        read, so the write only applies if ``window_version`` is unchanged;
+        otherwise it is redone on top of the other turn's result.
+        """
+        while True:
+            session = await self.sessions.find_one(
+                {"session_id": session_id}, {"_id": 0, "summary": 1, "recent": 1, "window_version": 1}
+            )
+            if session is None:
+                return
+            # Turns can finish out of order; messages from before seq numbers were stored sort first
+            recent = sorted(session.get("recent", []) + entries, key=lambda m: m.get("seq", 0))
+            summary, recent = self._compact(session.get("summary", ""), recent)
+            result = await self.sessions.update_one(
+                {"session_id": session_id, "window_version": session.get("window_version")},
+                {"$set": {"summary": summary, "recent": recent, "updated_at": now}, "$inc": {"window_version": 1}}
+            )
+            if result.matched_count:
+                return
+
+    async def page(self, session_id: str, before: Optional[int] = None,
+                   limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Up to ``limit`` messages older than sequence ``before`` (newest page
+        when None), oldest first, plus the ``before`` value for the next page"""
+        query: Dict[str, Any] = {"session_id": session_id}
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        newest_first = await self.messages.find(query, MESSAGE_PROJECTION) \
+            .sort("seq", -1).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(newest_first) > limit
+        page = list(reversed(newest_first[:limit]))
+        return page, (page[0]["seq"] if has_more and page else None)
@@ -0,0 +1,197 @@
+"""Pooled, token-budgeted LLM chat sessions for /api/chat/ask.
+
+One chat client is kept per ``chat_sessions.session_id``. The client holds
+the conversation itself, so the lab report is sent only on the first turn
+and later turns send just the new question. When a session is new to this
+process (first question, eviction, restart) or its context outgrows the
+budget, the client is rebuilt from the report, a short summary of older
+turns and a window of the most recent turns that fits the history budget.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+PROMPT_TOKENS_SENT = REGISTRY.counter(
+    "chat_prompt_tokens_sent_total", "Estimated prompt tokens sent for chat turns", ["mode"])
+PROMPT_TOKENS_SAVED = REGISTRY.counter(
+    "chat_prompt_tokens_saved_total",
+    "Estimated prompt tokens not sent compared with rebuilding report and history every turn")
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "chat_context_tokens", "Estimated tokens held in a pooled chat's context after each turn",
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000))
+CHAT_TURNS = REGISTRY.counter("chat_turns_total", "Chat turns by prompt mode", ["mode"])
+POOLED_SESSIONS = REGISTRY.gauge("chat_pooled_sessions", "Chat clients currently pooled")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)"""
+    return (len(text) + 3) // 4
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    end = text.find(". ")
+    sentence = text if end == -1 else text[:end + 1]
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+
+def _summary_lines(messages: List[Dict[str, Any]]) -> List[str]:
+    lines = []
+    for message in messages:
+        prefix = "Owner asked" if message["role"] == "user" else "You answered"
+        lines.append(f"- {prefix}: {_first_sentence(message['content'], 200)}")
+    return lines
+
+
+def _fit_newest(lines: List[str], max_tokens: int) -> str:
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += estimate_tokens(line)
+        if used > max_tokens:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+def summarize_turns(messages: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Extractive summary: each question with the first sentence of its answer"""
+    return _fit_newest(_summary_lines(messages), max_tokens)
+
+
+def roll_summary(summary: str, messages: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Extend an existing summary with ``messages``, dropping its oldest lines to fit"""
+    lines = summary.splitlines() if summary else []
+    return _fit_newest(lines + _summary_lines(messages), max_tokens)
+
+
+def recent_window(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """Index into ``messages`` where the newest turns fitting ``max_tokens`` start"""
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[i]["content"])
+        if used > max_tokens:
+            break
+        start = i
+    return start
+
+
+@dataclass
+class PooledChat:
+    chat: Any
+    context_tokens: int = 0
+    history_len: int = 0  # stored messages this client has seen
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class ChatSessionManager:
+    def __init__(self, chat_factory: Callable[[str, Optional[str]], Any], stream_fn: Callable[[Any, str], AsyncIterator[str]],
+                 max_sessions: int = 500, idle_ttl: float = 1800, history_token_budget: int = 1500,
+                 summary_token_budget: int = 300, context_token_budget: int = 12000):
+        self.chat_factory = chat_factory
+        self.stream_fn = stream_fn
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.history_token_budget = history_token_budget
+        self.summary_token_budget = summary_token_budget
+        self.context_token_budget = context_token_budget
+        self._pool: "OrderedDict[str, PooledChat]" = OrderedDict()
+
+    def _checkout(self, session_id: str) -> Optional[PooledChat]:
+        now = time.monotonic()
+        # Drop idle sessions from the cold end of the LRU
+        while self._pool:
+            oldest_id, oldest = next(iter(self._pool.items()))
+            if now - oldest.last_used <= self.idle_ttl or oldest.lock.locked():
+                break
+            del self._pool[oldest_id]
+        pooled = self._pool.get(session_id)
+        if pooled is not None:
+            self._pool.move_to_end(session_id)
+        return pooled
+
+    def _store(self, session_id: str, pooled: PooledChat) -> None:
+        self._pool[session_id] = pooled
+        self._pool.move_to_end(session_id)
+        while len(self._pool) > self.max_sessions:
+            self._pool.popitem(last=False)
+        POOLED_SESSIONS.set(len(self._pool))
+
+    def discard(self, session_id: str) -> None:
+        self._pool.pop(session_id, None)
+        POOLED_SESSIONS.set(len(self._pool))
+
+    def build_seed_prompt(self, report_text: str, history: List[Dict[str, Any]], question: str,
+                          summary: str = "") -> str:
+        """Prompt for a fresh client: report, summary of older turns, recent turns, question.
+
+        ``history`` may be only the newest turns, with ``summary`` covering the rest.
+        """
+        start = recent_window(history, self.history_token_budget)
+        sections = [f"Here are the blood test results:\n\n{report_text}"]
+        if start > 0 or summary:
+            summary = roll_summary(summary, history[:start], self.summary_token_budget)
+            if summary:
+                sections.append(f"Summary of the earlier conversation:\n{summary}")
+        if start < len(history):
+            turns = "\n".join(
+                f"{'Owner' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in history[start:]
+            )
+            sections.append(f"Most recent conversation:\n{turns}")
+        sections.append(f"Specific question: {question}")
+        return "\n\n".join(sections)
+
+    async def stream_turn(self, session_id: str, report_text: str, history: List[Dict[str, Any]],
+                          question: str, tier: Optional[str] = None, summary: str = "",
+                          message_count: Optional[int] = None) -> AsyncIterator[str]:
+        """Ask ``question`` in the session and yield the answer as text deltas.
+
+        ``history`` is the newest stored messages, ``summary`` covers older
+        ones and ``message_count`` is the total stored (defaults to
+        ``len(history)``). Each model ``tier`` gets its own pooled client.
+        """
+        if message_count is None:
+            message_count = len(history)
+        pool_key = session_id if tier is None else f"{session_id}:{tier}"
+        pooled = self._checkout(pool_key)
+        if pooled is None:
+            pooled = PooledChat(chat=None)
+            self._store(pool_key, pooled)
+
+        async with pooled.lock:
+            seed_prompt = self.build_seed_prompt(report_text, history, question, summary)
+            # Reseed when turns were answered elsewhere (another tier or process)
+            rebuild = pooled.chat is None or pooled.context_tokens > self.context_token_budget \
+                or pooled.history_len != message_count
+            if rebuild:
+                pooled.chat = self.chat_factory(session_id, tier)
+                prompt = seed_prompt
+                pooled.context_tokens = 0
+            else:
+                prompt = question
+
+            mode = "seed" if rebuild else "incremental"
+            sent = estimate_tokens(prompt)
+            CHAT_TURNS.inc(mode=mode)
+            PROMPT_TOKENS_SENT.inc(sent, mode=mode)
+            PROMPT_TOKENS_SAVED.inc(max(estimate_tokens(seed_prompt) - sent, 0))
+
+            parts = []
+            try:
+                async for delta in self.stream_fn(pooled.chat, prompt):
+                    parts.append(delta)
+                    yield delta
+            except BaseException:
+                # The client's history may now be missing this turn; rebuild next time
+                self.discard(pool_key)
+                raise
+
+            pooled.context_tokens += sent + estimate_tokens("".join(parts))
+            pooled.history_len = message_count + 2
+            pooled.last_used = time.monotonic()
+            CONTEXT_TOKENS.observe(pooled.context_tokens)
@@ -0,0 +1,296 @@
+"""Credit ledger: atomic, idempotent reserve / commit / refund.
+
+The balance stays on the user document (``credits``), so reading it is a
+single indexed lookup. Every change also has an entry in the
+``credit_ledger`` collection, keyed by a caller-supplied request key.
+
+A reservation is two single-document writes, ordered so that a retry with
+the same key never charges twice:
+
+1. insert the ledger entry (state ``reserving``) with a random owner; a
+   duplicate key means the request was seen before and is replayed
+   instead, once the call that owns the entry has finished with it
+2. ``find_one_and_update`` the user with ``credits >= amount`` and the
+   key not yet in ``pending_reservations``: decrement and push the key
+3. mark the entry ``reserved``, if this call still owns it
+
+Only the owner of an entry reserves; every other call with its key gets
+``replayed=True``. An entry left ``reserving`` for ``claim_after``
+seconds belongs to a call that stopped half way, and the next call with
+the key takes it over (step 2 is safe to repeat).
+
+Commit and refund move the entry out of ``reserved`` with a conditional
+update first, so each runs at most once. Only a refund whose key is still
+in ``pending_reservations`` gives credits back. A multi-credit reservation
+(a batch upload) can also be settled one credit at a time with
+``commit_part`` / ``refund_part``; it is final once every part is settled. Concurrent uploads never
+wait on a lock; each either wins its conditional decrement or is told
+the balance is too low.
+
+Purchased credits are added with ``grant``, which follows the same steps
+with an increment and the user's ``pending_grants``, so a redelivered
+payment event never credits twice. Only the entry's owner increments, and
+the guard key is pulled only once the entry is ``granted``. An owner that
+was taken over after its increment checks the entry's ``credited_by`` and
+undoes its increment if the new owner credited as well.
+"""
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import REGISTRY
+
+CREDIT_OPERATIONS = REGISTRY.counter(
+    "credit_ledger_operations_total", "Credit ledger operations by type and outcome", ["op", "outcome"])
+
+STATE_RESERVING = "reserving"
+STATE_RESERVED = "reserved"
+STATE_COMMITTED = "committed"
+STATE_REFUNDED = "refunded"
+STATE_REJECTED = "rejected"
+STATE_GRANTING = "granting"
+STATE_GRANTED = "granted"
+
+
+class InsufficientCredits(Exception):
+    pass
+
+
+@dataclass
+class Reservation:
+    key: str
+    user_id: str
+    amount: int
+    balance: Optional[int]
+    ref: Optional[str] = None
+    state: str = STATE_RESERVED
+    replayed: bool = False
+
+
+def new_request_key() -> str:
+    return uuid.uuid4().hex
+
+
+class CreditLedger:
+    def __init__(self, users, ledger, claim_after: float = 10, poll_interval: float = 0.05):
+        self.users = users
+        self.ledger = ledger
+        self.claim_after = claim_after
+        self.poll_interval = poll_interval
+
+    async def balance(self, user_id: str) -> int:
+        user = await self.users.find_one({"id": user_id}, {"_id": 0, "credits": 1})
+        return user["credits"] if user else 0
+
+    async def reserve(self, user_id: str, amount: int, key: str, ref: Optional[str] = None) -> Reservation:
+        """Take ``amount`` credits from the user; raises InsufficientCredits.
+
+        Calling again with the same key returns the original reservation
+        (``replayed=True``) without charging again. A call made while the
+        first is still running waits for its outcome.
+        """
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            await self.ledger.insert_one({
+                "key": key, "user_id": user_id, "amount": amount, "ref": ref, "owner": owner,
+                "state": STATE_RESERVING, "created_at": now, "updated_at": now
+            })
+        except DuplicateKeyError:
+            entry = await self._claim(key, user_id, owner, STATE_RESERVING)
+            if entry.get("owner") != owner:
+                return await self._replay(entry, user_id)
+            amount, ref = entry["amount"], entry.get("ref")
+
+        user = await self.users.find_one_and_update(
+            {"id": user_id, "credits": {"$gte": amount}, "pending_reservations": {"$ne": key}},
+            {"$inc": {"credits": -amount}, "$push": {"pending_reservations": key}},
+            projection={"_id": 0, "credits": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            already_applied = await self.users.find_one(
+                {"id": user_id, "pending_reservations": key}, {"_id": 0, "credits": 1})
+            if already_applied is None:
+                await self._set_state(key, STATE_RESERVING, STATE_REJECTED, owner=owner)
+                CREDIT_OPERATIONS.inc(op="reserve", outcome="insufficient")
+                raise InsufficientCredits()
+            user = already_applied
+
+        if await self._set_state(key, STATE_RESERVING, STATE_RESERVED, owner=owner) is None:
+            # Taken over while this call stalled; the new owner answers for the key
+            return await self._replay(await self.ledger.find_one({"key": key}, {"_id": 0}), user_id)
+        CREDIT_OPERATIONS.inc(op="reserve", outcome="ok")
+        return Reservation(key, user_id, amount, user["credits"], ref=ref)
+
+    async def _claim(self, key: str, user_id: str, owner: str, pending_state: str) -> dict:
+        """Wait until the entry for ``key`` leaves ``pending_state`` or this call owns it.
+
+        Returns the entry; its ``owner`` is ``owner`` when this call should
+        go on (the earlier attempt was refused or stopped half way).
+        """
+        claim_at = time.monotonic() + self.claim_after
+        while True:
+            entry = await self.ledger.find_one({"key": key}, {"_id": 0})
+            if entry["user_id"] != user_id:
+                raise ValueError(f"Request key {key} belongs to another user")
+            if entry["state"] == STATE_REJECTED:
+                # Refused earlier for lack of credits; try again now
+                claimed = await self._take(key, {"state": STATE_REJECTED}, owner, pending_state)
+            elif entry["state"] != pending_state:
+                return entry
+            elif time.monotonic() >= claim_at:
+                claimed = await self._take(
+                    key, {"state": pending_state, "owner": entry.get("owner")}, owner, pending_state)
+                claim_at = time.monotonic() + self.claim_after  # lost the race: wait on the new owner
+            else:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if claimed is not None:
+                return claimed
+
+    async def _take(self, key: str, condition: dict, owner: str, state: str) -> Optional[dict]:
+        return await self.ledger.find_one_and_update(
+            {"key": key, **condition},
+            {"$set": {"state": state, "owner": owner, "updated_at": datetime.utcnow()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _replay(self, entry: dict, user_id: str) -> Reservation:
+        CREDIT_OPERATIONS.inc(op="reserve", outcome="replayed")
+        return Reservation(entry["key"], user_id, entry["amount"], await self.balance(user_id),
+                           ref=entry.get("ref"), state=entry["state"], replayed=True)
+
+    async def commit(self, key: str) -> bool:
+        """Make a reservation final; False if it was not in the reserved state"""
+        entry = await self._set_state(key, STATE_RESERVED, STATE_COMMITTED)
+        if entry is None:
+            CREDIT_OPERATIONS.inc(op="commit", outcome="noop")
+            return False
+        await self.users.update_one({"id": entry["user_id"]}, {"$pull": {"pending_reservations": key}})
+        CREDIT_OPERATIONS.inc(op="commit", outcome="ok")
+        return True
+
+    async def refund(self, key: str) -> bool:
+        """Give a reservation's credits back; False if there was nothing to refund"""
+        entry = await self.ledger.find_one_and_update(
+            {"key": key, "state": {"$in": [STATE_RESERVING, STATE_RESERVED]}},
+            {"$set": {"state": STATE_REFUNDED, "updated_at": datetime.utcnow()}},
+            projection={"_id": 0, "user_id": 1, "amount": 1}
+        )
+        if entry is None:
+            CREDIT_OPERATIONS.inc(op="refund", outcome="noop")
+            return False
+        result = await self.users.update_one(
+            {"id": entry["user_id"], "pending_reservations": key},
+            {"$inc": {"credits": entry["amount"]}, "$pull": {"pending_reservations": key}}
+        )
+        CREDIT_OPERATIONS.inc(op="refund", outcome="ok" if result.modified_count else "noop")
+        return bool(result.modified_count)
+
+    async def grant(self, user_id: str, amount: int, key: str, ref: Optional[str] = None) -> bool:
+        """Add ``amount`` credits to the user once per key.
+
+        Returns False when the key was already granted; raises LookupError
+        when the user does not exist. A call made while another is granting
+        the same key waits for it.
+        """
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            await self.ledger.insert_one({
+                "key": key, "user_id": user_id, "amount": amount, "ref": ref, "owner": owner,
+                "state": STATE_GRANTING, "created_at": now, "updated_at": now
+            })
+        except DuplicateKeyError:
+            entry = await self._claim(key, user_id, owner, STATE_GRANTING)
+            if entry.get("owner") != owner:
+                CREDIT_OPERATIONS.inc(op="grant", outcome="replayed")
+                return False
+            # Earlier attempt stopped half way; the increment below is guarded by pending_grants
+            amount = entry["amount"]
+
+        result = await self.users.update_one(
+            {"id": user_id, "pending_grants": {"$ne": key}},
+            {"$inc": {"credits": amount}, "$push": {"pending_grants": key}}
+        )
+        credited = bool(result.modified_count)
+        if not credited and await self.users.find_one({"id": user_id}, {"_id": 0, "id": 1}) is None:
+            CREDIT_OPERATIONS.inc(op="grant", outcome="no_user")
+            raise LookupError(f"User {user_id} not found")
+
+        # credited_by stays None when an earlier owner's increment (its guard key) blocked ours
+        granted = await self.ledger.find_one_and_update(
+            {"key": key, "state": STATE_GRANTING, "owner": owner},
+            {"$set": {"state": STATE_GRANTED, "credited_by": owner if credited else None,
+                      "updated_at": datetime.utcnow()}},
+            projection={"_id": 0, "key": 1}
+        )
+        if granted is None:
+            # Taken over while this call stalled; the new owner has granted the key
+            entry = await self.ledger.find_one({"key": key}, {"_id": 0, "credited_by": 1})
+            if credited and entry.get("credited_by"):
+                # Both increments went through: undo this one
+                await self.users.update_one(
+                    {"id": user_id, "pending_grants": key},
+                    {"$inc": {"credits": -amount}, "$pull": {"pending_grants": key}}
+                )
+            elif credited:
+                await self.users.update_one({"id": user_id}, {"$pull": {"pending_grants": key}})
+            CREDIT_OPERATIONS.inc(op="grant", outcome="replayed")
+            return False
+
+        await self.users.update_one({"id": user_id}, {"$pull": {"pending_grants": key}})
+        CREDIT_OPERATIONS.inc(op="grant", outcome="ok")
+        return True
+
+    async def commit_part(self, key: str, part: str) -> bool:
+        """Keep one credit of a multi-credit reservation"""
+        return await self._settle_part(key, part, refund=False)
+
+    async def refund_part(self, key: str, part: str) -> bool:
+        """Give back one credit of a multi-credit reservation"""
+        return await self._settle_part(key, part, refund=True)
+
+    async def _settle_part(self, key: str, part: str, refund: bool) -> bool:
+        op = "refund_part" if refund else "commit_part"
+        entry = await self.ledger.find_one_and_update(
+            {"key": key, "state": STATE_RESERVED, "settled_parts": {"$ne": part}},
+            {
+                "$push": {"settled_parts": part},
+                "$inc": {"refunded_amount" if refund else "committed_amount": 1},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            projection={"_id": 0, "user_id": 1, "amount": 1, "settled_parts": 1, "refunded_amount": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if entry is None:
+            CREDIT_OPERATIONS.inc(op=op, outcome="noop")
+            return False
+        if refund:
+            await self.users.update_one(
+                {"id": entry["user_id"], "pending_reservations": key}, {"$inc": {"credits": 1}})
+        if len(entry["settled_parts"]) >= entry["amount"]:
+            final_state = STATE_REFUNDED if entry.get("refunded_amount", 0) >= entry["amount"] else STATE_COMMITTED
+            if await self._set_state(key, STATE_RESERVED, final_state):
+                await self.users.update_one({"id": entry["user_id"]}, {"$pull": {"pending_reservations": key}})
+        CREDIT_OPERATIONS.inc(op=op, outcome="ok")
+        return True
+
+    async def _set_state(self, key: str, from_state: str, to_state: str,
+                         owner: Optional[str] = None) -> Optional[dict]:
+        condition = {"key": key, "state": from_state}
+        if owner is not None:
+            condition["owner"] = owner
+        return await self.ledger.find_one_and_update(
+            condition,
+            {"$set": {"state": to_state, "updated_at": datetime.utcnow()}},
+            projection={"_id": 0, "user_id": 1, "amount": 1}
+        )
@@ -0,0 +1,144 @@
+"""Process pool for CPU-bound stages (PDF extraction, report rendering).
+
+``CpuExecutor.run`` keeps the event loop free while PyPDF2 or ReportLab work
+runs in a worker process. It bounds the number of in-flight tasks; once the
+bound is reached new work is refused with ``ExecutorSaturated`` so the API
+can answer 503 instead of queueing without limit. Background work that has
+already been accepted passes ``wait=True`` to wait for a free slot instead.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_PENDING = REGISTRY.gauge(
+    "cpu_executor_pending_tasks", "Tasks submitted to the CPU executor and not yet finished")
+EXECUTOR_REJECTED = REGISTRY.counter(
+    "cpu_executor_rejected_total", "Tasks refused because the CPU executor was full", ["task"])
+EXECUTOR_TIMEOUTS = REGISTRY.counter(
+    "cpu_executor_timeouts_total", "Tasks that exceeded the per-task timeout", ["task"])
+EXECUTOR_SLOT_WAIT = REGISTRY.histogram(
+    "cpu_executor_slot_wait_seconds", "Time a waiting task spent waiting for the executor to have room", ["task"])
+EXECUTOR_QUEUE_WAIT = REGISTRY.histogram(
+    "cpu_executor_queue_wait_seconds", "Time a task waited for a free worker process", ["task"])
+EXECUTOR_RUN_TIME = REGISTRY.histogram(
+    "cpu_executor_run_seconds", "Time a task spent running in a worker process", ["task"])
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the executor already has ``max_pending`` tasks in flight"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("CPU executor is at capacity")
+        self.retry_after = retry_after
+
+
+class ExecutorTimeout(Exception):
+    """Raised when a task runs longer than the executor's task timeout"""
+
+
+def _timed_call(fn: Callable, args: tuple):
+    # Runs in the worker process; wall-clock start lets the parent compute queue wait
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return started, time.perf_counter() - t0, result
+
+
+class CpuExecutor:
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 task_timeout: float = 60, retry_after: int = 5):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.task_timeout = task_timeout
+        self.retry_after = retry_after
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._slot_waiters: deque = deque()
+
+    def start(self) -> None:
+        if self._pool is None:
+            # spawn keeps the workers free of the server's Mongo client threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def saturated(self) -> bool:
+        return self._pending >= self.max_pending
+
+    async def _wait_for_slot(self, task: str) -> None:
+        started = time.perf_counter()
+        while self.saturated:
+            waiter = asyncio.get_running_loop().create_future()
+            self._slot_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    self._wake_slot_waiter()  # woken just as we were cancelled; pass it on
+                raise
+        EXECUTOR_SLOT_WAIT.observe(time.perf_counter() - started, task=task)
+
+    async def run(self, fn: Callable, *args: Any, timeout: Optional[float] = None, wait: bool = False) -> Any:
+        """Run ``fn(*args)`` in a worker process and return its result.
+
+        When the executor is full this raises ``ExecutorSaturated``, or with
+        ``wait`` waits until a task finishes and there is room.
+        """
+        task = fn.__name__
+        if self.saturated:
+            if not wait:
+                EXECUTOR_REJECTED.inc(task=task)
+                raise ExecutorSaturated(self.retry_after)
+            await self._wait_for_slot(task)
+        self.start()
+
+        self._pending += 1
+        EXECUTOR_PENDING.set(self._pending)
+        submitted = time.time()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._pool, _timed_call, fn, args)
+            try:
+                started, run_time, result = await asyncio.wait_for(future, timeout or self.task_timeout)
+            except asyncio.TimeoutError:
+                # The worker keeps running the task; only the caller gives up on it
+                EXECUTOR_TIMEOUTS.inc(task=task)
+                raise ExecutorTimeout(f"{task} exceeded {timeout or self.task_timeout}s")
+            except BrokenProcessPool:
+                logger.error("CPU executor pool broke while running %s; restarting it", task)
+                self.shutdown()
+                raise
+            EXECUTOR_QUEUE_WAIT.observe(max(started - submitted, 0), task=task)
+            EXECUTOR_RUN_TIME.observe(run_time, task=task)
+            return result
+        finally:
+            self._pending -= 1
+            EXECUTOR_PENDING.set(self._pending)
+            self._wake_slot_waiter()
+
+    def _wake_slot_waiter(self) -> None:
+        while self._slot_waiters:
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
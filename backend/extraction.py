@@ -0,0 +1,85 @@
+"""PDF text extraction.
+
+The synchronous functions here are CPU bound and run in the CPU executor's
+worker processes, so this module must stay importable without the API
+server. ``extract_pdf`` is the async entry point: it checks the page limit,
+fans page ranges out across workers and joins the page texts once.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import List
+
+import PyPDF2
+
+PAGE_SEPARATOR = "\n"
+
+
+class PdfTooManyPages(Exception):
+    def __init__(self, page_count: int, max_pages: int):
+        super().__init__(f"PDF has {page_count} pages; the limit is {max_pages}")
+        self.page_count = page_count
+        self.max_pages = max_pages
+
+
+@dataclass
+class PageText:
+    number: int  # 1-based page number
+    text: str
+    start: int  # offset of the page's text in ExtractedDocument.text
+    end: int
+
+
+@dataclass
+class ExtractedDocument:
+    text: str
+    pages: List[PageText] = field(default_factory=list)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def page_offsets(self) -> List[dict]:
+        """Page boundaries without the text, for storing next to the full text"""
+        return [{"number": p.number, "start": p.start, "end": p.end} for p in self.pages]
+
+
+def count_pages(path: str) -> int:
+    """Page count from the page tree, without extracting any text"""
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Extract text for pages ``start`` (inclusive) to ``stop`` (exclusive)"""
+    pages = PyPDF2.PdfReader(path).pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def join_pages(page_texts: List[str]) -> ExtractedDocument:
+    """Build the document text in a single join and record page offsets"""
+    pages = []
+    offset = 0
+    for number, text in enumerate(page_texts, start=1):
+        pages.append(PageText(number=number, text=text, start=offset, end=offset + len(text)))
+        offset += len(text) + len(PAGE_SEPARATOR)
+    return ExtractedDocument(text=PAGE_SEPARATOR.join(page_texts), pages=pages)
+
+
+async def extract_pdf(executor, path: str, max_pages: int, pages_per_task: int = 16,
+                      wait: bool = False) -> ExtractedDocument:
+    """Extract a PDF on disk, splitting its pages across executor workers.
+
+    ``wait`` is passed to ``executor.run``: wait for room instead of failing.
+    """
+    page_count = await executor.run(count_pages, path, wait=wait)
+    if page_count > max_pages:
+        raise PdfTooManyPages(page_count, max_pages)
+
+    # Never split finer than the pool can run at once: each task re-opens the file
+    workers = getattr(executor, "max_workers", 1)
+    per_task = max(pages_per_task, -(-page_count // workers))
+    ranges = [(start, min(start + per_task, page_count))
+              for start in range(0, page_count, per_task)]
+    chunks = await asyncio.gather(*[
+        executor.run(extract_page_range, path, start, stop, wait=wait) for start, stop in ranges
+    ])
+    return join_pages([text for chunk in chunks for text in chunk])
@@ -0,0 +1,154 @@
+"""Rule-based analysis for panels that need no clinical interpretation.
+
+When every parsed value is inside its reference range, or only a few sit
+just outside it, the report is generated from templates in milliseconds
+instead of waiting on the LLM. Anything else (meaningful abnormalities,
+too few parsed values, result rows that did not parse) goes to the model.
+"""
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY
+
+ANALYSIS_PATHS = REGISTRY.counter(
+    "analysis_path_total", "Analyses by the path that produced them", ["path"])
+
+PATH_RULES = "rules"
+PATH_CACHE = "cache"
+PATH_LLM = "llm"
+
+ANALYTE_DESCRIPTIONS: Dict[str, str] = {
+    "WBC": "white blood cells, which fight infection",
+    "RBC": "red blood cells, which carry oxygen",
+    "HGB": "hemoglobin, the oxygen-carrying protein in red cells",
+    "HCT": "hematocrit, the share of blood made up of red cells",
+    "MCV": "average red cell size",
+    "MCH": "average hemoglobin per red cell",
+    "MCHC": "hemoglobin concentration within red cells",
+    "RDW": "variation in red cell size",
+    "RETIC": "young red cells, a sign of bone marrow response",
+    "PLT": "platelets, which help blood clot",
+    "NEU": "neutrophils, the main bacteria-fighting white cells",
+    "LYM": "lymphocytes, white cells of the immune response",
+    "MONO": "monocytes, white cells that clear debris",
+    "EOS": "eosinophils, white cells linked to allergy and parasites",
+    "BASO": "basophils, white cells involved in inflammation",
+    "GLU": "blood sugar",
+    "BUN": "urea, a waste product cleared by the kidneys",
+    "CREA": "creatinine, a marker of kidney filtration",
+    "SDMA": "an early marker of kidney function",
+    "PHOS": "phosphorus, balanced by the kidneys",
+    "CA": "calcium",
+    "TP": "total protein in the blood",
+    "ALB": "albumin, a protein made by the liver",
+    "GLOB": "globulins, proteins that include antibodies",
+    "ALT": "a liver enzyme",
+    "AST": "an enzyme from liver and muscle",
+    "ALKP": "alkaline phosphatase, a liver and bone enzyme",
+    "GGT": "a liver and bile duct enzyme",
+    "TBIL": "bilirubin, processed by the liver",
+    "CHOL": "cholesterol",
+    "TRIG": "triglycerides, a blood fat",
+    "AMYL": "amylase, a pancreatic enzyme",
+    "LIPA": "lipase, a pancreatic enzyme",
+    "CK": "creatine kinase, a muscle enzyme",
+    "NA": "sodium, an electrolyte",
+    "K": "potassium, an electrolyte",
+    "CL": "chloride, an electrolyte",
+}
+
+DISCLAIMER = (
+    "Disclaimer: This analysis is for educational purposes only and should not replace "
+    "professional veterinary consultation. Always discuss your dog's results with a qualified veterinarian."
+)
+
+
+def deviation(value: dict) -> float:
+    """Distance outside the reference range as a fraction of the range width"""
+    width = max(value["high"] - value["low"], 1e-9)
+    if value["value"] > value["high"]:
+        return (value["value"] - value["high"]) / width
+    if value["value"] < value["low"]:
+        return (value["low"] - value["value"]) / width
+    return 0.0
+
+
+def relative_deviation(value: dict) -> float:
+    """Distance outside the reference range as a fraction of the nearest limit.
+
+    Catches values on the wrong scale (a misread decimal point) that
+    ``deviation`` misses when the range is wide relative to its limits:
+    1.25 against 10-125 is 8% of the width but 88% below the limit.
+    """
+    if value["value"] > value["high"]:
+        return (value["value"] - value["high"]) / max(abs(value["high"]), 1e-9)
+    if value["value"] < value["low"]:
+        return (value["low"] - value["value"]) / max(abs(value["low"]), 1e-9)
+    return 0.0
+
+
+def fast_path_eligible(lab_values: List[dict], unparsed_rows: Optional[List[str]], min_analytes: int = 8,
+                       tolerance: float = 0.1, max_trivial: int = 2) -> bool:
+    """True when every result row parsed and the panel has no meaningful abnormality.
+
+    ``unparsed_rows`` is None when it is not known whether any rows were
+    dropped (tests extracted before it was recorded); those go to the model.
+    """
+    if unparsed_rows is None or unparsed_rows or len(lab_values) < min_analytes:
+        return False
+    outside = [v for v in lab_values if v["flag"]]
+    return len(outside) <= max_trivial and all(
+        deviation(v) <= tolerance and relative_deviation(v) <= tolerance for v in outside
+    )
+
+
+def _fmt(number: float) -> str:
+    return f"{number:g}"
+
+
+def render_rule_based_analysis(lab_values: List[dict], tolerance: float = 0.1) -> str:
+    """Standard report for an eligible panel; paragraphs separated by blank lines"""
+    in_range = [v for v in lab_values if not v["flag"]]
+    borderline = [v for v in lab_values if v["flag"]]
+
+    sections = []
+    if borderline:
+        sections.append(
+            f"Summary: {len(lab_values)} values were reported. {len(in_range)} are within their "
+            f"reference ranges and {len(borderline)} {'is' if len(borderline) == 1 else 'are'} only "
+            f"marginally outside, by no more than {int(tolerance * 100)}% of the range width. "
+            "Overall this panel does not show a clinically meaningful abnormality."
+        )
+    else:
+        sections.append(
+            f"Summary: All {len(lab_values)} reported values are within their reference ranges. "
+            "This is a normal panel with no abnormal findings."
+        )
+
+    lines = ["Results:"]
+    for v in lab_values:
+        status = {"H": "slightly high", "L": "slightly low"}.get(v["flag"], "normal")
+        lines.append(
+            f"- {v['analyte']}: {_fmt(v['value'])} {v['unit']} "
+            f"(reference {_fmt(v['low'])}-{_fmt(v['high'])}) - {status}".replace("  ", " ")
+        )
+    sections.append("\n".join(lines))
+
+    for v in borderline:
+        direction = "above" if v["flag"] == "H" else "below"
+        what = ANALYTE_DESCRIPTIONS.get(v["analyte"], "this analyte")
+        sections.append(
+            f"{v['analyte']} measures {what}. The result is just {direction} the reference range. "
+            "Small deviations like this are common in healthy dogs and can reflect normal individual "
+            "variation, hydration, recent meals, stress or sample handling. On its own it is not "
+            "considered clinically significant."
+        )
+
+    recommendation = "Recommendations: No follow-up is needed based on these values alone."
+    if borderline:
+        recommendation += (
+            " Your veterinarian may choose to recheck the marginal values at the next routine visit, "
+            "particularly if your dog shows any symptoms."
+        )
+    sections.append(recommendation)
+    sections.append(DISCLAIMER)
+    return "\n\n".join(sections)
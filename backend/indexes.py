@@ -0,0 +1,75 @@
+"""Mongo index definitions, created and verified at startup.
+
+``ensure_indexes`` creates every index below (a no-op when it already
+exists). A failure on one index, such as a unique index over existing
+duplicates, is logged and does not stop the others. ``missing_indexes``
+reports what is still absent so startup can warn about it.
+"""
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "blood_tests": [
+        # Serves lookups by id alone (pipeline) and by id + owner (API)
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="id_user_unique"),
+        # Dashboard listing: keyset pagination on (created_at, id) per user, optionally by status
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="user_created_id"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING),
+                    ("id", DESCENDING)], name="user_status_created_id"),
+        IndexModel([("batch_id", ASCENDING)], sparse=True, name="batch_id"),
+    ],
+    "chat_sessions": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+    ],
+    "chat_messages": [
+        # History pages per session; seq orders messages that share a timestamp
+        IndexModel([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="session_seq_unique"),
+    ],
+    "credit_ledger": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+    ],
+    "payment_events": [
+        IndexModel([("event_id", ASCENDING)], unique=True, name="event_id_unique"),
+        # Replays select by state
+        IndexModel([("state", ASCENDING), ("received_at", ASCENDING)], name="state_received"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+        # Background sweep of pending checkout sessions
+        IndexModel([("payment_status", ASCENDING), ("created_at", ASCENDING)], name="payment_status_created"),
+    ],
+}
+
+
+async def ensure_indexes(db) -> None:
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        for model in models:
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s on %s: %s",
+                             model.document["name"], collection_name, e)
+
+
+async def missing_indexes(db) -> List[str]:
+    """Names (collection.index) of defined indexes that do not exist"""
+    missing = []
+    for collection_name, models in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for model in models:
+            name = model.document["name"]
+            if name not in existing:
+                missing.append(f"{collection_name}.{name}")
+    return missing
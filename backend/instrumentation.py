@@ -0,0 +1,159 @@
+"""Request, pipeline stage and Mongo instrumentation.
+
+* ``RequestMetricsMiddleware`` times every HTTP request, labelled by the
+  route template (``/api/blood-test/{test_id}``) rather than the raw path so
+  the number of series stays bounded. Streaming responses are timed until
+  their last byte.
+* ``stage_timer`` times one step of the blood test pipeline (extract,
+  analyze, render, store, credit). While ``stage_trace`` holds a list (a
+  profiled request or job), each step is also appended to it.
+* ``MongoCommandTimer`` is a pymongo command listener that times every
+  command the driver sends.
+
+Errors are counted by exception type in ``errors_total``, labelled with the
+route, stage or ``mongo`` they came from.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import REGISTRY
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route", "status"])
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being handled")
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Blood test pipeline step duration", ["stage", "outcome"])
+MONGO_COMMAND_SECONDS = REGISTRY.histogram(
+    "mongo_command_seconds", "Mongo command round trip as seen by the driver",
+    ["command", "collection", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+ERRORS = REGISTRY.counter("errors_total", "Errors by where they happened and exception type", ["component", "type"])
+
+UNMATCHED_ROUTE = "unmatched"
+
+# (stage, seconds, outcome) of the steps run by the current profiled request or job
+stage_trace: ContextVar[Optional[List[Tuple[str, float, str]]]] = ContextVar("stage_trace", default=None)
+
+
+def count_error(component: str, error: Any) -> None:
+    """Count an exception (or an error name) against ``component``"""
+    name = error if isinstance(error, str) else type(error).__name__
+    ERRORS.inc(component=component, type=name)
+
+
+# Endpoint -> route template, filled in as routes are first seen
+_route_templates: Dict[Callable, str] = {}
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Template of the route that handled the request, once routing has run"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    template = _route_templates.get(endpoint)
+    if template is None:
+        app = scope.get("app")
+        for candidate in getattr(getattr(app, "router", None), "routes", ()):
+            if getattr(candidate, "endpoint", None) is endpoint:
+                template = _route_templates[endpoint] = candidate.path
+                break
+        else:
+            return UNMATCHED_ROUTE
+    return template
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording latency, status and unhandled errors per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            status = 500
+            count_error(route_label(scope), e)
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, method=scope["method"], route=route_label(scope), status=str(status)
+            )
+
+
+def _record_stage(stage: str, started: float, outcome: str) -> None:
+    seconds = time.perf_counter() - started
+    STAGE_SECONDS.observe(seconds, stage=stage, outcome=outcome)
+    trace = stage_trace.get()
+    if trace is not None:
+        trace.append((stage, seconds, outcome))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a pipeline step; failures are also counted by exception type"""
+    started = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        _record_stage(stage, started, "cancelled")
+        raise
+    except Exception as e:
+        _record_stage(stage, started, "error")
+        count_error(stage, e)
+        raise
+    else:
+        _record_stage(stage, started, "ok")
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times driver commands; pass to the client as ``event_listeners=[...]``"""
+
+    def __init__(self):
+        # (connection, request id) -> (command, collection) for commands in flight
+        self._started: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")  # getMore names it separately
+        self._started[(event.connection_id, event.request_id)] = (event.command_name, str(target))
+
+    def _finish(self, event, outcome: str) -> None:
+        command, collection = self._started.pop(
+            (event.connection_id, event.request_id), (event.command_name, "")
+        )
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6, command=command, collection=collection, outcome=outcome
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, "error")
+        failure = event.failure if isinstance(event.failure, dict) else {}
+        count_error("mongo", failure.get("codeName") or "CommandFailure")
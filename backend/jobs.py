@@ -0,0 +1,304 @@
+"""Background job queues and worker pool for the blood test pipeline.
+
+Two queue backends share the same interface:
+
+* ``LocalJobQueue`` keeps jobs in an in-process ``asyncio.Queue``. It is meant
+  for tests and single-process deployments; queued jobs are lost on restart.
+* ``MongoJobQueue`` stores jobs in a collection and claims them with
+  ``find_one_and_update``, so several API processes can share one queue.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int = 0
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+
+class JobQueue:
+    """Interface implemented by the queue backends"""
+
+    max_attempts: int = 3
+
+    async def put(self, kind: str, payload: Dict[str, Any], delay: float = 0) -> str:
+        raise NotImplementedError
+
+    async def get(self) -> Job:
+        raise NotImplementedError
+
+    async def ack(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def retry(self, job: Job, delay: float, count_attempt: bool = True) -> None:
+        raise NotImplementedError
+
+    async def bury(self, job: Job, error: str) -> None:
+        raise NotImplementedError
+
+    async def depth(self) -> int:
+        raise NotImplementedError
+
+
+class LocalJobQueue(JobQueue):
+    """In-process queue backed by asyncio.Queue"""
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self.buried: List[Job] = []
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def put(self, kind: str, payload: Dict[str, Any], delay: float = 0) -> str:
+        job = Job(id=str(uuid.uuid4()), kind=kind, payload=payload)
+        await self._enqueue(job, delay)
+        return job.id
+
+    async def _enqueue(self, job: Job, delay: float) -> None:
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+        else:
+            await self.queue.put(job)
+
+    async def get(self) -> Job:
+        job = await self.queue.get()
+        job.attempts += 1
+        return job
+
+    async def ack(self, job: Job) -> None:
+        self.queue.task_done()
+
+    async def retry(self, job: Job, delay: float, count_attempt: bool = True) -> None:
+        self.queue.task_done()
+        if not count_attempt:
+            job.attempts -= 1
+        await self._enqueue(job, delay)
+
+    async def bury(self, job: Job, error: str) -> None:
+        self.queue.task_done()
+        self.buried.append(job)
+
+    async def depth(self) -> int:
+        return self.queue.qsize()
+
+
+class MongoJobQueue(JobQueue):
+    """Queue stored in a Mongo collection, safe to share between processes.
+
+    A claimed job is leased for ``visibility_timeout`` seconds; if the worker
+    dies before acking, the lease expires and another worker picks it up.
+    """
+
+    def __init__(self, collection, max_attempts: int = 3, visibility_timeout: float = 300,
+                 poll_interval: float = 0.5):
+        self.collection = collection
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = str(uuid.uuid4())
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("status", 1), ("available_at", 1)])
+
+    async def put(self, kind: str, payload: Dict[str, Any], delay: float = 0) -> str:
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        await self.collection.insert_one({
+            "id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "available_at": now + timedelta(seconds=delay),
+            "created_at": now,
+        })
+        return job_id
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "available_at": {"$lte": now}},
+                {"status": "running", "locked_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "locked_until": now + timedelta(seconds=self.visibility_timeout),
+                    "worker": self.worker_id,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def get(self) -> Job:
+        while True:
+            doc = await self._claim()
+            if doc:
+                return Job(
+                    id=doc["id"],
+                    kind=doc["kind"],
+                    payload=doc["payload"],
+                    attempts=doc["attempts"],
+                    created_at=doc["created_at"],
+                )
+            await asyncio.sleep(self.poll_interval)
+
+    async def ack(self, job: Job) -> None:
+        await self.collection.update_one(
+            {"id": job.id},
+            {"$set": {"status": "done", "finished_at": datetime.utcnow()}}
+        )
+
+    async def retry(self, job: Job, delay: float, count_attempt: bool = True) -> None:
+        update: Dict[str, Any] = {"$set": {
+            "status": "queued",
+            "available_at": datetime.utcnow() + timedelta(seconds=delay),
+        }}
+        if not count_attempt:
+            # Hand back the attempt the claim took
+            update["$inc"] = {"attempts": -1}
+        await self.collection.update_one({"id": job.id}, update)
+
+    async def bury(self, job: Job, error: str) -> None:
+        await self.collection.update_one(
+            {"id": job.id},
+            {"$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow()}}
+        )
+
+    async def depth(self) -> int:
+        return await self.collection.count_documents({"status": "queued"})
+
+
+JOB_QUEUE_DEPTH = REGISTRY.gauge("job_queue_depth", "Jobs queued and not yet claimed, as of the last scrape")
+JOBS_RUNNING = REGISTRY.gauge("jobs_running", "Jobs being handled by this process", ["kind"])
+JOB_RUN_SECONDS = REGISTRY.histogram(
+    "job_run_seconds", "Job handler duration by kind and result", ["kind", "outcome"])
+JOB_WORKER_ERRORS = REGISTRY.counter(
+    "job_worker_errors_total", "Queue or dead-letter errors survived by a worker", ["where"])
+
+JobHandler = Callable[[Job], Awaitable[None]]
+DeadLetterHandler = Callable[[Job, Exception], Awaitable[None]]
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot help"""
+
+
+class RetryLater(Exception):
+    """Raised by a handler to run the job again after ``delay`` seconds.
+
+    Unlike a failure this does not use up one of the job's attempts, so a
+    dependency that is known to be down (an open circuit, say) cannot push
+    jobs into the dead-letter queue.
+    """
+
+    def __init__(self, delay: float, reason: str = ""):
+        super().__init__(reason or f"retry in {delay:.1f}s")
+        self.delay = delay
+
+
+class JobWorkerPool:
+    """Runs ``concurrency`` workers that pull jobs and dispatch them by kind"""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, JobHandler], concurrency: int = 4,
+                 on_dead_letter: Optional[DeadLetterHandler] = None, retry_base_delay: float = 2.0,
+                 error_backoff: float = 1.0, max_error_backoff: float = 30.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.on_dead_letter = on_dead_letter
+        self.retry_base_delay = retry_base_delay
+        self.error_backoff = error_backoff
+        self.max_error_backoff = max_error_backoff
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, index: int) -> None:
+        # A queue error (Mongo unreachable, say) must not end the worker: back off and go on
+        failures = 0
+        while True:
+            try:
+                job = await self.queue.get()
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failures += 1
+                delay = min(self.error_backoff * 2 ** (failures - 1), self.max_error_backoff)
+                JOB_WORKER_ERRORS.inc(where="queue")
+                logger.exception("Job worker %d hit a queue error; retrying in %.1fs", index, delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            else:
+                failures = 0
+
+    async def run_job(self, job: Job) -> None:
+        handler = self.handlers.get(job.kind)
+        started = time.perf_counter()
+        JOBS_RUNNING.inc(kind=job.kind)
+        try:
+            if handler is None:
+                raise PermanentJobError(f"No handler registered for job kind '{job.kind}'")
+            await handler(job)
+        except asyncio.CancelledError:
+            raise
+        except RetryLater as e:
+            JOB_RUN_SECONDS.observe(time.perf_counter() - started, kind=job.kind, outcome="deferred")
+            logger.info("Job %s (%s) deferred for %.1fs: %s", job.id, job.kind, e.delay, e)
+            await self.queue.retry(job, e.delay, count_attempt=False)
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError) or job.attempts >= self.queue.max_attempts
+            JOB_RUN_SECONDS.observe(
+                time.perf_counter() - started, kind=job.kind, outcome="failed" if permanent else "retry")
+            if permanent:
+                logger.exception("Job %s (%s) failed permanently", job.id, job.kind)
+                await self.queue.bury(job, str(e))
+                if self.on_dead_letter:
+                    try:
+                        await self.on_dead_letter(job, e)
+                    except Exception:
+                        JOB_WORKER_ERRORS.inc(where="dead_letter")
+                        logger.exception("Dead-letter handler failed for job %s (%s)", job.id, job.kind)
+            else:
+                delay = self.retry_base_delay * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+                logger.warning("Job %s (%s) failed, retrying in %.1fs: %s", job.id, job.kind, delay, e)
+                await self.queue.retry(job, delay)
+        else:
+            JOB_RUN_SECONDS.observe(time.perf_counter() - started, kind=job.kind, outcome="ok")
+            await self.queue.ack(job)
+        finally:
+            JOBS_RUNNING.dec(kind=job.kind)
@@ -0,0 +1,214 @@
+"""Parsing of canine CBC / chemistry panels out of extracted PDF text.
+
+Lab exports repeat headers, clinic addresses and reference tables on every
+page. ``parse_lab_panel`` keeps only result rows (analyte, value, unit,
+reference range, flag) so the model gets a compact table instead of the
+raw text. Rows that name a known analyte and a value but do not parse, and
+repeats of an analyte that disagree with its first row, are kept verbatim
+below the table, so the model still sees them. Runs in the
+CPU executor, so it must not import the server.
+"""
+import re
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+PROMPT_TOKENS_RAW = REGISTRY.counter(
+    "analysis_prompt_tokens_raw_total", "Estimated tokens of extracted text before preprocessing")
+PROMPT_TOKENS_COMPACT = REGISTRY.counter(
+    "analysis_prompt_tokens_compact_total", "Estimated tokens sent to the model after preprocessing")
+PROMPT_COMPRESSION = REGISTRY.histogram(
+    "analysis_prompt_compression_ratio", "Raw to compact token ratio per upload",
+    buckets=(1, 1.5, 2, 3, 5, 10, 20, 50))
+
+# Canonical analyte names and the spellings labs use for them
+ANALYTE_ALIASES: Dict[str, Tuple[str, ...]] = {
+    # CBC
+    "WBC": ("wbc", "white blood cells", "white blood cell count", "leukocytes"),
+    "RBC": ("rbc", "red blood cells", "red blood cell count", "erythrocytes"),
+    "HGB": ("hgb", "hb", "hemoglobin", "haemoglobin"),
+    "HCT": ("hct", "hematocrit", "haematocrit", "pcv"),
+    "MCV": ("mcv",),
+    "MCH": ("mch",),
+    "MCHC": ("mchc",),
+    "RDW": ("rdw",),
+    "RETIC": ("retic", "reticulocytes", "reticulocyte count"),
+    "PLT": ("plt", "platelets", "platelet count"),
+    "MPV": ("mpv",),
+    "NEU": ("neu", "neut", "neutrophils", "seg neutrophils", "segs"),
+    "BAND": ("band", "bands", "band neutrophils"),
+    "LYM": ("lym", "lymph", "lymphocytes"),
+    "MONO": ("mono", "monocytes"),
+    "EOS": ("eos", "eosinophils"),
+    "BASO": ("baso", "basophils"),
+    # Chemistry
+    "GLU": ("glu", "glucose"),
+    "BUN": ("bun", "urea", "urea nitrogen", "blood urea nitrogen"),
+    "CREA": ("crea", "creat", "creatinine"),
+    "SDMA": ("sdma",),
+    "BUN/CREA": ("bun/crea", "bun/creatinine ratio", "bun:crea"),
+    "PHOS": ("phos", "phosphorus", "phosphate"),
+    "CA": ("ca", "calcium"),
+    "TP": ("tp", "total protein"),
+    "ALB": ("alb", "albumin"),
+    "GLOB": ("glob", "globulin"),
+    "ALB/GLOB": ("alb/glob", "a/g ratio", "a/g"),
+    "ALT": ("alt", "alanine aminotransferase", "sgpt"),
+    "AST": ("ast", "aspartate aminotransferase", "sgot"),
+    "ALKP": ("alkp", "alp", "alk phos", "alkaline phosphatase"),
+    "GGT": ("ggt", "gamma gt"),
+    "TBIL": ("tbil", "t bili", "total bilirubin", "bilirubin"),
+    "CHOL": ("chol", "cholesterol"),
+    "TRIG": ("trig", "triglycerides"),
+    "AMYL": ("amyl", "amylase"),
+    "LIPA": ("lipa", "lipase"),
+    "CK": ("ck", "cpk", "creatine kinase"),
+    "NA": ("na", "sodium"),
+    "K": ("k", "potassium"),
+    "NA/K": ("na/k", "na:k"),
+    "CL": ("cl", "chloride"),
+    "TCO2": ("tco2", "bicarbonate", "co2"),
+    "T4": ("t4", "total t4"),
+}
+
+_ALIAS_LOOKUP = {alias: name for name, aliases in ANALYTE_ALIASES.items() for alias in aliases}
+
+# "1,250" and "12,500.5" use thousands separators; any other comma is a decimal comma ("1,25")
+_THOUSANDS = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?"
+_NUMBER = rf"(?:{_THOUSANDS}|\d+(?:[.,]\d+)?)"
+_ROW = re.compile(
+    rf"^(?P<name>[A-Za-z][A-Za-z0-9 /:%#().\-]*?)\s*:?\s+"
+    rf"(?P<value>[<>]?\s*{_NUMBER})\s*"
+    rf"(?P<flag1>\b(?:H|L|HI|LO|HIGH|LOW)\b|[*↑↓])?\s*"
+    rf"(?P<unit>(?:[A-Za-z%µμ/^.0-9]+(?:/[A-Za-z0-9^.]+)?))?\s+"
+    rf"\(?(?P<low>{_NUMBER})\s*(?:-|–|to)\s*(?P<high>{_NUMBER})\)?"
+    rf"\s*(?P<flag2>\b(?:H|L|HI|LO|HIGH|LOW)\b|[*↑↓])?\s*$",
+    re.IGNORECASE,
+)
+# Anything that starts like a result row: a name followed by a value
+_CANDIDATE = re.compile(r"^(?P<name>[A-Za-z][A-Za-z0-9 /:%#().\-]*?)\s*:?\s+[<>]?\s*\d")
+_THOUSANDS_NUMBER = re.compile(_THOUSANDS)
+
+FLAG_HIGH = "H"
+FLAG_LOW = "L"
+
+
+@dataclass
+class LabValue:
+    analyte: str
+    value: float
+    unit: str
+    low: float
+    high: float
+    flag: str = ""  # "H", "L" or "" when within the reference range
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def canonical_analyte(raw_name: str) -> Optional[str]:
+    key = " ".join(raw_name.lower().replace("_", " ").split()).rstrip(":. ")
+    return _ALIAS_LOOKUP.get(key)
+
+
+def _number(text: str) -> float:
+    text = text.lstrip("<> ")
+    if _THOUSANDS_NUMBER.fullmatch(text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+
+def _flag(value: float, low: float, high: float, printed: Optional[str]) -> str:
+    if value > high:
+        return FLAG_HIGH
+    if value < low:
+        return FLAG_LOW
+    printed = (printed or "").upper()
+    if printed in ("H", "HI", "HIGH", "↑"):
+        return FLAG_HIGH
+    if printed in ("L", "LO", "LOW", "↓"):
+        return FLAG_LOW
+    return ""
+
+
+def scan_lab_panel(text: str) -> Tuple[List[LabValue], List[str]]:
+    """Result rows of known analytes (first occurrence of each) and the
+    rows that look like results of a known analyte but did not parse.
+
+    A later row for an analyte already seen is dropped when it repeats the
+    first one (a panel printed on every page) and counted as unparsed when
+    its value, unit or range differ, so the conflict is not lost.
+    """
+    results: Dict[str, LabValue] = {}
+    unparsed: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        match = _ROW.match(line)
+        value = _parse_row(match) if match else None
+        if value is None:
+            candidate = _CANDIDATE.match(line)
+            if candidate and canonical_analyte(candidate["name"]) and line not in unparsed:
+                unparsed.append(line)
+            continue
+        first = results.setdefault(value.analyte, value)
+        if _reading(first) != _reading(value) and line not in unparsed:
+            unparsed.append(line)
+    return list(results.values()), unparsed
+
+
+def _reading(value: LabValue) -> Tuple[float, str, float, float]:
+    return value.value, value.unit, value.low, value.high
+
+
+def _parse_row(match: re.Match) -> Optional[LabValue]:
+    analyte = canonical_analyte(match["name"])
+    if analyte is None:
+        return None
+    try:
+        value = _number(match["value"])
+        low, high = _number(match["low"]), _number(match["high"])
+    except ValueError:
+        return None
+    if low > high:
+        return None
+    return LabValue(
+        analyte=analyte,
+        value=value,
+        unit=match["unit"] or "",
+        low=low,
+        high=high,
+        flag=_flag(value, low, high, match["flag1"] or match["flag2"]),
+    )
+
+
+def parse_lab_panel(text: str) -> List[LabValue]:
+    """Result rows of known analytes, first occurrence of each"""
+    return scan_lab_panel(text)[0]
+
+
+def _fmt(number: float) -> str:
+    return f"{number:g}"
+
+
+def format_lab_table(values: List[LabValue], unparsed: List[str] = ()) -> str:
+    """Compact pipe-separated table sent to the model in place of the raw text"""
+    rows = ["Analyte | Value | Unit | Reference range | Flag"]
+    for v in values:
+        rows.append(f"{v.analyte} | {_fmt(v.value)} | {v.unit} | {_fmt(v.low)}-{_fmt(v.high)} | {v.flag}")
+    if unparsed:
+        rows.append("")
+        rows.append("Result rows that could not be parsed (as printed):")
+        rows.extend(unparsed)
+    return "\n".join(rows)
+
+
+def prepare_analysis_input(text: str, min_analytes: int = 5) -> Tuple[str, List[dict], List[str]]:
+    """Return (text for the model, parsed values as dicts, unparsed result rows).
+
+    Falls back to the raw text when too few rows parse to trust the table.
+    """
+    values, unparsed = scan_lab_panel(text)
+    if len(values) < min_analytes:
+        return text, [v.to_dict() for v in values], unparsed
+    return format_lab_table(values, unparsed), [v.to_dict() for v in values], unparsed
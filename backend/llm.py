@@ -0,0 +1,87 @@
+"""Helpers for streaming LLM output to HTTP clients"""
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager, suppress
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+
+async def stream_message(chat, prompt: str) -> AsyncIterator[str]:
+    """Yield the response to ``prompt`` as text deltas.
+
+    Uses the chat client's streaming call when it has one; otherwise the
+    whole completion is yielded as a single delta once it arrives.
+    """
+    if getattr(chat, "accepts_text", False):
+        user_message = prompt
+    else:
+        from emergentintegrations.llm.chat import UserMessage
+        user_message = UserMessage(text=prompt)
+    stream = getattr(chat, "stream_message", None)
+    if stream is not None:
+        async for delta in stream(user_message):
+            if delta:
+                yield delta
+        return
+
+    response = await chat.send_message(user_message)
+    yield getattr(response, "content", response)
+
+
+async def with_keepalive(chunks: AsyncIterator[str], interval: float) -> AsyncIterator[Optional[str]]:
+    """Pass ``chunks`` through, yielding None whenever ``interval`` seconds
+    pass without output so the caller can send a keepalive to the client"""
+    iterator = chunks.__aiter__()
+    next_chunk = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_chunk}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        # Let the pending __anext__ settle before closing, or aclose() finds the generator running
+        next_chunk.cancel()
+        with suppress(asyncio.CancelledError, StopAsyncIteration, Exception):
+            await next_chunk
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            with suppress(Exception):
+                await aclose()
+
+
+class StreamHub:
+    """In-process fan-out of events (e.g. analysis tokens) to subscribers.
+
+    Only subscribers in the process that runs the producer see its events;
+    with a shared Mongo job queue, clients fall back to status updates.
+    """
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    @contextmanager
+    def subscribe(self, topic: str):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
+        self._subscribers[topic].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[topic].discard(queue)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self._subscribers.get(topic))
+
+    def publish(self, topic: str, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(topic, ()):
+            # A slow reader drops events rather than stalling the producer
+            if not queue.full():
+                queue.put_nowait(event)
@@ -0,0 +1,352 @@
+"""Gateway in front of the LLM provider.
+
+Every provider call goes through ``LlmGateway``, which applies, in order:
+
+* a circuit breaker, which fails fast while the provider keeps erroring
+* single-flight coalescing, so identical in-flight prompts are sent once
+* priority admission: a bounded number of calls in flight, with waiting
+  chat requests admitted before bulk upload analyses
+* token buckets sized to the provider quota (requests and prompt tokens
+  per minute)
+* jittered exponential backoff on rate limits and transient errors,
+  limited by a retry budget so retries cannot multiply a traffic spike
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from chat_manager import estimate_tokens
+from metrics import REGISTRY
+
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Time a provider call waited for admission", ["priority"])
+LLM_QUEUE_DEPTH = REGISTRY.gauge(
+    "llm_queue_depth", "Provider calls waiting for admission", ["priority"])
+LLM_IN_FLIGHT = REGISTRY.gauge("llm_in_flight", "Provider calls in flight")
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_provider_seconds", "Provider call latency per attempt", ["priority", "outcome"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests_total", "Gateway calls by priority and final outcome", ["priority", "outcome"])
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Estimated tokens of successful provider calls", ["priority", "direction"])
+LLM_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "Streamed call latency until the first output", ["priority"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60))
+LLM_RETRIES = REGISTRY.counter("llm_retries_total", "Provider call retries", ["priority"])
+LLM_COALESCED = REGISTRY.counter("llm_coalesced_total", "Calls served by an identical in-flight call")
+LLM_CIRCUIT_STATE = REGISTRY.gauge("llm_circuit_open", "1 while the provider circuit breaker is open")
+
+PRIORITY_CHAT = 0
+PRIORITY_UPLOAD = 1
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_UPLOAD: "upload"}
+
+
+class LlmUnavailable(Exception):
+    """The circuit is open; retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("LLM provider is unavailable")
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, provider 5xx and timeouts; anything else is a caller error"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    message = str(error).lower()
+    return any(marker in message for marker in (
+        "rate limit", "429", "overloaded", "timeout", "timed out", "temporarily unavailable", "503", "502"
+    ))
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        # Callers take turns, so a large request is not starved by small ones
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class RetryBudget:
+    """Each call earns ``ratio`` of a retry and each retry spends one, so
+    retries stay near ``ratio`` of traffic; ``initial`` are available at
+    start and at most ``max_balance`` are banked"""
+
+    def __init__(self, ratio: float = 0.2, initial: int = 10, max_balance: int = 50):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self._balance = float(initial)
+
+    def record_request(self) -> None:
+        self._balance = min(self._balance + self.ratio, self.max_balance)
+
+    def try_spend(self) -> bool:
+        if self._balance >= 1:
+            self._balance -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; after
+    ``reset_timeout`` seconds one trial call is let through"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial: Optional[object] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self) -> Optional[object]:
+        """Raise LlmUnavailable while open; returns a token when this call is the trial"""
+        if self._opened_at is None:
+            return None
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self._trial is not None:
+            raise LlmUnavailable(max(int(remaining) + 1, 1))
+        self._trial = object()
+        return self._trial
+
+    def end_trial(self, trial: Optional[object]) -> None:
+        """Free the trial slot when the trial ended without an outcome
+        (cancelled, or a stream the client left), so the next call can try"""
+        if trial is not None and self._trial is trial:
+            self._trial = None
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._trial = None
+        LLM_CIRCUIT_STATE.set(0)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._trial is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            LLM_CIRCUIT_STATE.set(1)
+        self._trial = None
+
+
+class LlmGateway:
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 retry_budget: Optional[RetryBudget] = None, breaker: Optional[CircuitBreaker] = None):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(requests_per_minute / 60, 1)) \
+            if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 6) \
+            if tokens_per_minute > 0 else None
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._single_flight: Dict[str, asyncio.Future] = {}
+
+    # Admission
+
+    async def _admit(self, priority: int) -> None:
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        started = time.perf_counter()
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            LLM_QUEUE_DEPTH.inc(priority=label)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # admitted just as we were cancelled
+                else:
+                    self._waiters = [w for w in self._waiters if w[2] is not waiter]
+                    heapq.heapify(self._waiters)
+                raise
+            finally:
+                LLM_QUEUE_DEPTH.dec(priority=label)
+        LLM_IN_FLIGHT.set(self._in_flight)
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - started, priority=label)
+
+    def _release(self) -> None:
+        # Hand the slot straight to the highest-priority live waiter
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+        LLM_IN_FLIGHT.set(self._in_flight)
+
+    async def _throttle(self, prompt_tokens: int) -> None:
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket and prompt_tokens:
+            await self.token_bucket.acquire(prompt_tokens)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform between 0 and the exponential cap
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    # Calls
+
+    async def call(self, fn: Callable[[], Awaitable[str]], priority: int = PRIORITY_UPLOAD,
+                   prompt_tokens: int = 0, key: Optional[str] = None) -> str:
+        """Run ``fn`` (one provider call) under the gateway's limits.
+
+        Calls sharing a ``key`` while one is in flight get its result.
+        """
+        if key is not None:
+            pending = self._single_flight.get(key)
+            if pending is not None:
+                LLM_COALESCED.inc()
+                return await asyncio.shield(pending)
+            pending = asyncio.get_running_loop().create_future()
+            self._single_flight[key] = pending
+            try:
+                result = await self._call(fn, priority, prompt_tokens)
+            except BaseException as e:
+                if not pending.done():
+                    pending.set_exception(e if isinstance(e, Exception) else RuntimeError("Call cancelled"))
+                    pending.exception()  # mark retrieved when nobody else is waiting
+                raise
+            else:
+                pending.set_result(result)
+                return result
+            finally:
+                self._single_flight.pop(key, None)
+        return await self._call(fn, priority, prompt_tokens)
+
+    async def _call(self, fn: Callable[[], Awaitable[str]], priority: int, prompt_tokens: int) -> str:
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            attempt += 1
+            trial = None
+            try:
+                try:
+                    trial = self.breaker.before_call()
+                except LlmUnavailable:
+                    LLM_REQUESTS.inc(priority=label, outcome="circuit_open")
+                    raise
+                await self._admit(priority)
+                started = time.perf_counter()
+                try:
+                    await self._throttle(prompt_tokens)
+                    result = await fn()
+                except Exception as e:
+                    LLM_LATENCY.observe(time.perf_counter() - started, priority=label, outcome="error")
+                    retryable = is_retryable(e)
+                    if retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()  # the provider answered; the request was bad
+                    if not retryable or attempt >= self.max_attempts or not self.retry_budget.try_spend():
+                        LLM_REQUESTS.inc(priority=label, outcome="error")
+                        raise
+                    LLM_RETRIES.inc(priority=label)
+                else:
+                    LLM_LATENCY.observe(time.perf_counter() - started, priority=label, outcome="ok")
+                    LLM_REQUESTS.inc(priority=label, outcome="ok")
+                    LLM_TOKENS.inc(prompt_tokens, priority=label, direction="prompt")
+                    LLM_TOKENS.inc(estimate_tokens(result or ""), priority=label, direction="completion")
+                    self.breaker.record_success()
+                    return result
+                finally:
+                    self._release()
+            finally:
+                # Cancelled (or a stream closed by its reader) before an outcome was recorded
+                self.breaker.end_trial(trial)
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def stream(self, open_stream: Callable[[], AsyncIterator[str]], priority: int = PRIORITY_CHAT,
+                     prompt_tokens: int = 0) -> AsyncIterator[str]:
+        """Stream a provider response under the gateway's limits.
+
+        Retries only while nothing has been yielded yet; once output has
+        reached the caller an error is passed through.
+        """
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            attempt += 1
+            trial = None
+            try:
+                try:
+                    trial = self.breaker.before_call()
+                except LlmUnavailable:
+                    LLM_REQUESTS.inc(priority=label, outcome="circuit_open")
+                    raise
+                await self._admit(priority)
+                started = time.perf_counter()
+                yielded = False
+                output_chars = 0
+                try:
+                    await self._throttle(prompt_tokens)
+                    async for delta in open_stream():
+                        if not yielded:
+                            LLM_FIRST_TOKEN.observe(time.perf_counter() - started, priority=label)
+                        yielded = True
+                        output_chars += len(delta)
+                        yield delta
+                except Exception as e:
+                    LLM_LATENCY.observe(time.perf_counter() - started, priority=label, outcome="error")
+                    retryable = is_retryable(e)
+                    if retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()  # the provider answered; the request was bad
+                    if yielded or not retryable or attempt >= self.max_attempts or not self.retry_budget.try_spend():
+                        LLM_REQUESTS.inc(priority=label, outcome="error")
+                        raise
+                    LLM_RETRIES.inc(priority=label)
+                else:
+                    LLM_LATENCY.observe(time.perf_counter() - started, priority=label, outcome="ok")
+                    LLM_REQUESTS.inc(priority=label, outcome="ok")
+                    LLM_TOKENS.inc(prompt_tokens, priority=label, direction="prompt")
+                    # estimate_tokens on the whole output, without keeping it
+                    LLM_TOKENS.inc((output_chars + 3) // 4, priority=label, direction="completion")
+                    self.breaker.record_success()
+                    return
+                finally:
+                    self._release()
+            finally:
+                # Cancelled (or a stream closed by its reader) before an outcome was recorded
+                self.breaker.end_trial(trial)
+            await asyncio.sleep(self._backoff(attempt))
@@ -0,0 +1,90 @@
+"""Event loop lag monitor.
+
+A task on the loop records a heartbeat every ``interval`` seconds and a
+watchdog thread checks it. When the heartbeat is more than ``threshold``
+seconds old the loop is blocked by whatever is running on it, so the
+watchdog logs that task and the loop thread's current stack while the
+blocking code is still on it. The lag seen by the heartbeat is also
+recorded as a histogram.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late the loop monitor's heartbeat ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_BLOCKED = REGISTRY.counter("event_loop_blocked_total", "Times the loop was blocked past the threshold")
+
+
+class LoopLagMonitor:
+    def __init__(self, threshold: float = 0.2, interval: Optional[float] = None, stack_limit: int = 25):
+        self.threshold = threshold
+        self.interval = interval or min(threshold / 2, 0.1)
+        self.stack_limit = stack_limit
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None or self.threshold <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(time.monotonic() - self._last_beat - self.interval, 0))
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopped.wait(self.interval):
+            beat = self._last_beat
+            blocked_for = time.monotonic() - beat - self.interval
+            if blocked_for > self.threshold and beat != reported_beat:
+                reported_beat = beat  # once per blocked stretch
+                LOOP_BLOCKED.inc()
+                self._report(blocked_for)
+
+    def _report(self, blocked_for: float) -> None:
+        # Read from another thread, so both are best effort
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)[-self.stack_limit:]) if frame is not None else ""
+        if task is not None:
+            coro = task.get_coro()
+            running = f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        else:
+            running = "no task (a callback or the loop itself)"
+        logger.warning(
+            "Event loop blocked for %.0f ms so far by %s:\n%s", blocked_for * 1000, running, stack
+        )
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Move embedded chat_sessions.messages arrays into the chat_messages collection.
+
+Each session with a ``messages`` array gets one chat_messages document per
+message, a ``message_count``, the newest messages in ``recent`` and a
+rolling ``summary``; the array is then removed. The API does the same the
+first time it loads a legacy session, so running this is optional. Safe to
+re-run: migrated sessions no longer match.
+
+Usage (from backend/, with the same environment as the API):
+    python migrations/migrate_chat_messages.py [--batch-size N] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import motor.motor_asyncio
+from decouple import config
+
+from chat_history import ChatHistoryStore
+
+MONGO_URL = config('MONGO_URL', default='mongodb://localhost:27017/dogbloodgpt')
+CHAT_RECENT_MESSAGES = config('CHAT_RECENT_MESSAGES', default=20, cast=int)
+
+
+async def migrate(batch_size: int, dry_run: bool):
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    db = client.dogbloodgpt
+    store = ChatHistoryStore(db.chat_sessions, db.chat_messages, recent_messages=CHAT_RECENT_MESSAGES)
+
+    pending = await db.chat_sessions.count_documents({"messages": {"$exists": True}})
+    print(f"{pending} chat sessions with embedded messages")
+    if dry_run:
+        return
+
+    migrated = 0
+    while True:
+        batch = await db.chat_sessions.find(
+            {"messages": {"$exists": True}},
+            {"_id": 0, "session_id": 1, "user_id": 1, "messages": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        for session in batch:
+            await store.migrate_legacy(session["session_id"], session.get("user_id"), session["messages"])
+            migrated += 1
+        print(f"migrated {migrated}/{pending}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
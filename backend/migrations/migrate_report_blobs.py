@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Move base64 PDF reports out of blood_tests documents into the blob store.
+
+Each document with an embedded ``pdf_report`` gets its report written to
+the configured blob backend, a ``report_blob`` reference set and the
+``pdf_report`` field removed. Safe to re-run: migrated documents no longer
+match. Report copies held in the analysis cache are dropped; they are
+re-rendered on demand.
+
+Usage (from backend/, with the same environment as the API):
+    python migrations/migrate_report_blobs.py [--batch-size N] [--dry-run]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import motor.motor_asyncio
+from decouple import config
+
+from blob_store import create_blob_store
+
+MONGO_URL = config('MONGO_URL', default='mongodb://localhost:27017/dogbloodgpt')
+BLOB_BACKEND = config('BLOB_BACKEND', default='filesystem')
+BLOB_ROOT = config('BLOB_ROOT', default='/tmp/dogbloodgpt/blobs')
+BLOB_BUCKET = config('BLOB_BUCKET', default='dogbloodgpt-reports')
+BLOB_ENDPOINT_URL = config('BLOB_ENDPOINT_URL', default='')
+
+
+async def migrate(batch_size: int, dry_run: bool):
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    db = client.dogbloodgpt
+    blob_store = create_blob_store(
+        BLOB_BACKEND, db=db, root=BLOB_ROOT, bucket=BLOB_BUCKET, endpoint_url=BLOB_ENDPOINT_URL
+    )
+
+    pending = await db.blood_tests.count_documents({"pdf_report": {"$exists": True}})
+    print(f"{pending} blood tests with embedded reports")
+    if dry_run:
+        return
+
+    migrated = 0
+    while True:
+        batch = await db.blood_tests.find(
+            {"pdf_report": {"$exists": True}},
+            {"_id": 0, "id": 1, "pdf_report": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        for test in batch:
+            info = await blob_store.put(
+                f"reports/{test['id']}.pdf", base64.b64decode(test["pdf_report"]), "application/pdf"
+            )
+            await db.blood_tests.update_one(
+                {"id": test["id"]},
+                {"$set": {"report_blob": info.to_dict()}, "$unset": {"pdf_report": ""}}
+            )
+            migrated += 1
+        print(f"migrated {migrated}/{pending}")
+
+    result = await db.analysis_cache.update_many(
+        {"pdf_report": {"$exists": True}},
+        {"$unset": {"pdf_report": "", "report_user_id": ""}}
+    )
+    print(f"dropped embedded reports from {result.modified_count} cache entries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.dry_run))
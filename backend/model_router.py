@@ -0,0 +1,122 @@
+"""Model selection per request, and the chat clients that serve them.
+
+``ModelRouter`` maps a request type and prompt size to a model tier: full
+panel analyses go to the large model, short chat follow-ups to a fast
+one. Models are written ``provider/model``; the ``stub`` provider is a
+deterministic local model with configurable latency and output length,
+so the whole pipeline can be load tested without a network.
+"""
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict
+
+from metrics import REGISTRY
+
+MODEL_ROUTES = REGISTRY.counter(
+    "llm_model_routes_total", "Requests routed to each model tier", ["request_type", "tier"])
+
+REQUEST_ANALYSIS = "analysis"
+REQUEST_CHAT = "chat"
+
+TIER_LARGE = "large"
+TIER_FAST = "fast"
+
+STUB_PROVIDER = "stub"
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    tier: str
+    provider: str
+    model: str
+
+    @classmethod
+    def parse(cls, tier: str, spec: str) -> "ModelSpec":
+        provider, _, model = spec.partition("/")
+        if not model:
+            raise ValueError(f"Model for tier {tier} must look like provider/model, got {spec!r}")
+        return cls(tier, provider, model)
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+class ModelRouter:
+    def __init__(self, tiers: Dict[str, ModelSpec], fast_max_prompt_tokens: int = 300):
+        self.tiers = tiers
+        self.fast_max_prompt_tokens = fast_max_prompt_tokens
+
+    def route(self, request_type: str, prompt_tokens: int) -> ModelSpec:
+        """Analyses always get the large model; chat questions up to
+        ``fast_max_prompt_tokens`` get the fast one"""
+        tier = TIER_LARGE
+        if request_type == REQUEST_CHAT and prompt_tokens <= self.fast_max_prompt_tokens:
+            tier = TIER_FAST
+        spec = self.tiers.get(tier) or self.tiers[TIER_LARGE]
+        MODEL_ROUTES.inc(request_type=request_type, tier=spec.tier)
+        return spec
+
+
+_STUB_WORDS = (
+    "values", "within", "reference", "range", "the", "panel", "shows", "normal", "kidney", "liver",
+    "markers", "are", "stable", "no", "clinically", "significant", "findings", "recheck", "at", "next",
+    "visit", "hydration", "may", "explain", "mild", "changes", "in", "red", "cell", "indices",
+)
+
+
+class StubChat:
+    """Deterministic stand-in for a provider chat client.
+
+    The same prompt always yields the same text. The first delta arrives
+    after ``latency`` seconds, then ``output_tokens`` words are streamed
+    at ``tokens_per_second`` (0 means all at once).
+    """
+
+    accepts_text = True
+
+    def __init__(self, session_id: str, model: str = "stub", latency: float = 0.5,
+                 output_tokens: int = 200, tokens_per_second: float = 0):
+        self.session_id = session_id
+        self.model = model
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.tokens_per_second = tokens_per_second
+
+    def _words(self, prompt: str):
+        digest = hashlib.sha256(f"{self.model}\n{prompt}".encode()).digest()
+        for i in range(self.output_tokens):
+            yield _STUB_WORDS[digest[i % len(digest)] % len(_STUB_WORDS)] + ("." if i % 12 == 11 else "")
+
+    async def stream_message(self, message) -> AsyncIterator[str]:
+        prompt = getattr(message, "text", message)
+        await asyncio.sleep(self.latency)
+        chunk = []
+        for word in self._words(prompt):
+            chunk.append(word)
+            if len(chunk) == 8:
+                if self.tokens_per_second:
+                    await asyncio.sleep(len(chunk) / self.tokens_per_second)
+                yield " ".join(chunk) + " "
+                chunk = []
+        if chunk:
+            if self.tokens_per_second:
+                await asyncio.sleep(len(chunk) / self.tokens_per_second)
+            yield " ".join(chunk)
+
+    async def send_message(self, message) -> str:
+        return "".join([delta async for delta in self.stream_message(message)])
+
+
+def create_chat(spec: ModelSpec, session_id: str, system_message: str, api_key: str = "",
+                stub_latency: float = 0.5, stub_output_tokens: int = 200, stub_tokens_per_second: float = 0):
+    """Chat client for ``spec``; the provider SDK is only imported for real providers"""
+    if spec.provider == STUB_PROVIDER:
+        return StubChat(session_id, spec.model, stub_latency, stub_output_tokens, stub_tokens_per_second)
+    from emergentintegrations.llm.chat import LlmChat
+    return LlmChat(
+        api_key=api_key,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model(spec.provider, spec.model)
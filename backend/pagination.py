@@ -0,0 +1,41 @@
+"""Keyset (cursor) pagination over (created_at, id), newest first.
+
+The cursor is the sort key of the last item on a page, so fetching the
+next page is an index seek no matter how deep the client has paged.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, item_id: str) -> str:
+    raw = json.dumps({"c": created_at.isoformat(), "i": item_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["c"]), str(data["i"])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def after_cursor(cursor: Optional[str]) -> Dict[str, Any]:
+    """Filter matching items that sort after ``cursor`` in (created_at desc, id desc) order"""
+    if not cursor:
+        return {}
+    created_at, item_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": item_id}},
+    ]}
+
+
+KEYSET_SORT = [("created_at", -1), ("id", -1)]
@@ -0,0 +1,114 @@
+"""Password hashing off the event loop.
+
+bcrypt costs 100-300 ms of CPU per call, so hashing and verification run
+on a dedicated, bounded thread pool (bcrypt and argon2 release the GIL).
+Concurrency is also capped per key - the client IP and the account -
+so a brute-force burst from one source cannot take every slot.
+
+Hashes made with a deprecated scheme or an old bcrypt cost are reported
+by ``verify_and_update`` so the caller can store the upgraded hash.
+"""
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable, Optional, Sequence, Tuple
+
+from passlib.context import CryptContext
+
+from metrics import REGISTRY
+
+PASSWORD_PENDING = REGISTRY.gauge(
+    "password_hash_pending", "Password hash/verify calls queued or running")
+PASSWORD_REJECTED = REGISTRY.counter(
+    "password_hash_rejected_total", "Password hash/verify calls refused", ["reason"])
+PASSWORD_SECONDS = REGISTRY.histogram(
+    "password_hash_seconds", "Time spent hashing or verifying a password", ["op"])
+PASSWORD_REHASHED = REGISTRY.counter(
+    "password_rehashed_total", "Stored hashes upgraded on login")
+
+
+class HasherSaturated(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Password hasher is saturated")
+        self.retry_after = retry_after
+
+
+class TooManyConcurrentAttempts(Exception):
+    def __init__(self, key: str):
+        super().__init__(f"Too many concurrent attempts for {key}")
+        self.key = key
+
+
+def build_crypt_context(schemes: Sequence[str], bcrypt_rounds: int = 12) -> CryptContext:
+    """First scheme hashes new passwords; the rest are only verified (and upgraded)"""
+    return CryptContext(schemes=list(schemes), deprecated="auto", bcrypt__rounds=bcrypt_rounds)
+
+
+class PasswordHasher:
+    def __init__(self, context: CryptContext, max_workers: int = 2, max_pending: int = 64,
+                 per_key_limit: int = 2, retry_after: int = 2):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.per_key_limit = per_key_limit
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
+        self._pending = 0
+        self._active = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @contextmanager
+    def _slot(self, keys: Iterable[str]):
+        keys = [k for k in keys if k]
+        with self._lock:
+            if self._pending >= self.max_pending:
+                PASSWORD_REJECTED.inc(reason="saturated")
+                raise HasherSaturated(self.retry_after)
+            for key in keys:
+                if self._active[key] >= self.per_key_limit:
+                    PASSWORD_REJECTED.inc(reason="per_key")
+                    raise TooManyConcurrentAttempts(key)
+            self._pending += 1
+            for key in keys:
+                self._active[key] += 1
+            PASSWORD_PENDING.set(self._pending)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+                for key in keys:
+                    self._active[key] -= 1
+                    if not self._active[key]:
+                        del self._active[key]
+                PASSWORD_PENDING.set(self._pending)
+
+    async def _run(self, op: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            PASSWORD_SECONDS.observe(time.perf_counter() - start, op=op)
+
+    async def hash(self, password: str, keys: Iterable[str] = ()) -> str:
+        with self._slot(keys):
+            return await self._run("hash", self.context.hash, password)
+
+    async def verify_and_update(self, password: str, stored_hash: str,
+                                keys: Iterable[str] = ()) -> Tuple[bool, Optional[str]]:
+        """(matches, replacement hash or None when the stored one is current)"""
+        with self._slot(keys):
+            valid, new_hash = await self._run("verify", self.context.verify_and_update, password, stored_hash)
+        if new_hash:
+            PASSWORD_REHASHED.inc()
+        return valid, new_hash
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
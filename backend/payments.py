@@ -0,0 +1,277 @@
+"""Stripe checkout client and payment status reconciliation.
+
+``PaymentClients`` keeps one long-lived ``StripeCheckout`` per webhook URL
+(in practice one per public host), so requests reuse its HTTP connections
+instead of building a client per call. The Stripe integration is only
+imported when the first client or checkout request is created; both
+factories can be replaced (benchmarks/loadtest.py uses an offline stub).
+
+``PaymentReconciler`` records what Stripe reports for a checkout session on
+its payment_transactions document. Once the session is terminal that
+document is the answer. Pending sessions are refreshed by status polls at
+most every ``refresh_interval`` seconds and by a background sweep, so a
+session settles even when the buyer never comes back to the success page.
+
+``PaymentFulfilment`` is the webhook side. A verified event is stored in
+the ``payment_events`` inbox, keyed by its Stripe event id so redeliveries
+are dropped, and processed later by a background job. Credits for a paid
+session are granted through the credit ledger under the key
+``payment:<session_id>``, so the webhook, status polls, the sweeper and
+replays can all report the same payment and it is credited once.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_STATUS_LOOKUPS = REGISTRY.counter(
+    "payment_status_lookups_total", "Payment status lookups by where the answer came from", ["source"])
+PAYMENT_SWEEPS = REGISTRY.counter(
+    "payment_sweep_sessions_total", "Pending checkout sessions checked by the sweeper", ["outcome"])
+PAYMENT_EVENTS = REGISTRY.counter(
+    "payment_events_total", "Stripe webhook events by inbox outcome", ["outcome"])
+PAYMENT_FULFILMENTS = REGISTRY.counter(
+    "payment_fulfilments_total", "Credit fulfilment attempts for paid sessions", ["outcome"])
+
+# Checkout session status and payment status values that no longer change
+TERMINAL_SESSION_STATUSES = ("complete", "expired")
+TERMINAL_PAYMENT_STATUSES = ("paid", "no_payment_required")
+
+EVENT_PENDING = "pending"
+EVENT_PROCESSED = "processed"
+EVENT_FAILED = "failed"
+
+STATUS_PROJECTION = {
+    "_id": 0, "session_id": 1, "status": 1, "payment_status": 1, "amount": 1, "amount_total": 1,
+    "currency": 1, "checked_at": 1
+}
+
+
+def is_terminal(transaction: Dict[str, Any]) -> bool:
+    return transaction.get("status") in TERMINAL_SESSION_STATUSES \
+        or transaction.get("payment_status") in TERMINAL_PAYMENT_STATUSES
+
+
+def _stripe_checkout(api_key: str, webhook_url: str):
+    from emergentintegrations.payments.stripe.checkout import StripeCheckout
+    return StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+
+
+def _checkout_session_request(**fields):
+    from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+    return CheckoutSessionRequest(**fields)
+
+
+class PaymentClients:
+    """Shared checkout clients, created on first use"""
+
+    def __init__(self, api_key: str, factory: Optional[Callable[[str, str], Any]] = None,
+                 request_factory: Optional[Callable[..., Any]] = None):
+        self.api_key = api_key
+        self.factory = factory or _stripe_checkout
+        self.request_factory = request_factory or _checkout_session_request
+        self._clients: Dict[str, Any] = {}
+
+    def get(self, webhook_url: str = ""):
+        client = self._clients.get(webhook_url)
+        if client is None:
+            client = self._clients[webhook_url] = self.factory(self.api_key, webhook_url)
+        return client
+
+    def checkout_request(self, **fields):
+        """A checkout session request for the clients' create_checkout_session"""
+        return self.request_factory(**fields)
+
+
+class PaymentReconciler:
+    def __init__(self, transactions, clients: PaymentClients, refresh_interval: float = 5,
+                 sweep_interval: float = 60, sweep_min_age: float = 60, sweep_max_age: float = 25 * 3600,
+                 sweep_batch: int = 100, on_paid: Optional[Callable[[str], Awaitable[Any]]] = None):
+        self.transactions = transactions
+        self.clients = clients
+        self.refresh_interval = refresh_interval
+        self.sweep_interval = sweep_interval
+        self.sweep_min_age = sweep_min_age
+        self.sweep_max_age = sweep_max_age  # Stripe expires unpaid sessions after 24 hours
+        self.sweep_batch = sweep_batch
+        self.on_paid = on_paid
+        self._task: Optional[asyncio.Task] = None
+
+    async def status(self, session_id: str) -> Dict[str, Any]:
+        """Session status from the database, asking Stripe only while it is pending"""
+        transaction = await self.transactions.find_one({"session_id": session_id}, STATUS_PROJECTION)
+        if transaction is not None:
+            checked_at = transaction.get("checked_at")
+            fresh = checked_at is not None \
+                and datetime.utcnow() - checked_at < timedelta(seconds=self.refresh_interval)
+            if is_terminal(transaction) or fresh:
+                PAYMENT_STATUS_LOOKUPS.inc(source="db")
+                if transaction.get("amount_total") is None and transaction.get("amount") is not None:
+                    # Written before Stripe's totals were stored; amount is in dollars
+                    transaction["amount_total"] = round(transaction["amount"] * 100)
+                return transaction
+        PAYMENT_STATUS_LOOKUPS.inc(source="stripe")
+        return await self.refresh(session_id)
+
+    async def refresh(self, session_id: str) -> Dict[str, Any]:
+        """Fetch the session from Stripe and store the result"""
+        status = await self.clients.get().get_checkout_status(session_id)
+        now = datetime.utcnow()
+        fields = {
+            "status": status.status,
+            "payment_status": status.payment_status,
+            "amount_total": status.amount_total,
+            "currency": status.currency,
+            "checked_at": now,
+            "updated_at": now
+        }
+        await self.transactions.update_one({"session_id": session_id}, {"$set": fields})
+        if status.payment_status == "paid" and self.on_paid:
+            await self.on_paid(session_id)
+        return {"session_id": session_id, **fields}
+
+    # Background sweep
+
+    def start(self) -> None:
+        if self._task is None and self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep_once()
+            except Exception:
+                logger.exception("Payment sweep failed")
+
+    async def sweep_once(self) -> int:
+        """Refresh pending sessions between ``sweep_min_age`` and ``sweep_max_age`` old"""
+        now = datetime.utcnow()
+        pending: List[Dict[str, Any]] = await self.transactions.find(
+            {
+                "status": {"$nin": list(TERMINAL_SESSION_STATUSES)},
+                "payment_status": {"$nin": list(TERMINAL_PAYMENT_STATUSES)},
+                "created_at": {
+                    "$gte": now - timedelta(seconds=self.sweep_max_age),
+                    "$lte": now - timedelta(seconds=self.sweep_min_age)
+                },
+                # Skip sessions a status poll has just refreshed
+                "checked_at": {"$not": {"$gte": now - timedelta(seconds=self.sweep_interval)}}
+            },
+            {"_id": 0, "session_id": 1}
+        ).sort("created_at", 1).limit(self.sweep_batch).to_list(length=self.sweep_batch)
+        for transaction in pending:
+            try:
+                result = await self.refresh(transaction["session_id"])
+            except Exception as e:
+                PAYMENT_SWEEPS.inc(outcome="error")
+                logger.warning("Could not reconcile checkout session %s: %s", transaction["session_id"], e)
+            else:
+                PAYMENT_SWEEPS.inc(outcome="settled" if is_terminal(result) else "pending")
+        return len(pending)
+
+
+def webhook_event_id(webhook_response, body: bytes) -> str:
+    """Stripe's event id, or a digest of the payload when the client does not expose one"""
+    event_id = getattr(webhook_response, "event_id", None)
+    return event_id or "body:" + hashlib.sha256(body).hexdigest()
+
+
+class PaymentFulfilment:
+    def __init__(self, events, transactions, ledger,
+                 on_granted: Optional[Callable[[str], Awaitable[Any]]] = None):
+        self.events = events
+        self.transactions = transactions
+        self.ledger = ledger
+        self.on_granted = on_granted
+
+    async def record(self, event_id: str, event_type: Optional[str], session_id: Optional[str],
+                     payment_status: Optional[str], metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Store a verified webhook event; False if it was already received"""
+        try:
+            await self.events.insert_one({
+                "event_id": event_id,
+                "event_type": event_type,
+                "session_id": session_id,
+                "payment_status": payment_status,
+                "metadata": metadata or {},
+                "state": EVENT_PENDING,
+                "received_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            PAYMENT_EVENTS.inc(outcome="duplicate")
+            return False
+        PAYMENT_EVENTS.inc(outcome="received")
+        return True
+
+    async def process(self, event_id: str, force: bool = False) -> str:
+        """Apply an inbox event; processed events are skipped unless ``force``"""
+        event = await self.events.find_one({"event_id": event_id}, {"_id": 0})
+        if event is None:
+            raise LookupError(f"Payment event {event_id} not found")
+        if event["state"] == EVENT_PROCESSED and not force:
+            return "duplicate"
+
+        outcome = "ignored"
+        if event.get("session_id"):
+            await self.transactions.update_one(
+                {"session_id": event["session_id"]},
+                {"$set": {
+                    "payment_status": event.get("payment_status"),
+                    "webhook_processed": True,
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            if event.get("payment_status") == "paid":
+                outcome = await self.fulfil(event["session_id"], event.get("metadata"))
+
+        await self.events.update_one(
+            {"event_id": event_id},
+            {"$set": {"state": EVENT_PROCESSED, "outcome": outcome, "processed_at": datetime.utcnow()},
+             "$unset": {"error": ""}}
+        )
+        PAYMENT_EVENTS.inc(outcome=outcome)
+        return outcome
+
+    async def fulfil(self, session_id: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Grant a paid session's credits to its buyer, at most once"""
+        transaction = await self.transactions.find_one(
+            {"session_id": session_id}, {"_id": 0, "user_id": 1, "credits": 1})
+        user_id = (transaction or {}).get("user_id") or (metadata or {}).get("user_id")
+        if transaction is None or not user_id:
+            # Sessions created before checkouts recorded their buyer
+            PAYMENT_FULFILMENTS.inc(outcome="unmatched")
+            logger.warning("Paid checkout session %s has no buyer to credit", session_id)
+            return "unmatched"
+
+        granted = await self.ledger.grant(
+            user_id, int(transaction["credits"]), f"payment:{session_id}", ref=session_id)
+        await self.transactions.update_one(
+            {"session_id": session_id},
+            {"$set": {"credits_added": True, "user_id": user_id}}
+        )
+        if granted and self.on_granted:
+            await self.on_granted(user_id)
+        outcome = "granted" if granted else "already_granted"
+        PAYMENT_FULFILMENTS.inc(outcome=outcome)
+        return outcome
+
+    async def mark_failed(self, event_id: str, error: str) -> None:
+        await self.events.update_one(
+            {"event_id": event_id},
+            {"$set": {"state": EVENT_FAILED, "error": error, "updated_at": datetime.utcnow()}}
+        )
+        PAYMENT_EVENTS.inc(outcome="failed")
@@ -0,0 +1,286 @@
+"""Opt-in profiling of single requests and pipeline jobs.
+
+A request is profiled when it carries a valid signed ``X-Profile-Request``
+header (see ``sign_profile_token``) or is picked by ``sample_rate``. Jobs
+queued by a profiled request are profiled as well (``tag`` marks their
+payload), and ``job_sample_rate`` samples jobs on its own.
+
+Two profiler backends are supported:
+
+* ``pyinstrument`` (optional dependency) samples the stack in async mode, so
+  time spent awaiting Mongo, the LLM or the CPU executor is attributed to
+  the awaiting line. Saved as an HTML flame view and a text call tree.
+* ``cprofile`` (standard library) records CPU time of every call on the
+  event loop thread, including other requests running at the same time.
+  Saved as a ``.prof`` file (snakeviz, flameprof) and a text summary.
+
+Either way each profile also lists the pipeline steps timed by
+``instrumentation.stage_timer`` with their wall time, which covers work done
+in the CPU executor's worker processes (PyPDF2, ReportLab). Only one profile
+is taken at a time; requests arriving meanwhile run unprofiled.
+"""
+import asyncio
+import cProfile
+import functools
+import hashlib
+import hmac
+import importlib.util
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from instrumentation import route_label, stage_trace
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PROFILES_TAKEN = REGISTRY.counter("profiles_taken_total", "Profiles saved", ["kind", "trigger"])
+PROFILES_SKIPPED = REGISTRY.counter("profiles_skipped_total", "Profiles not taken because another was running")
+
+PROFILE_HEADER = "X-Profile-Request"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_PAYLOAD_KEY = "profile"
+PROFILE_FORMATS = {"html": "text/html", "txt": "text/plain", "prof": "application/octet-stream"}
+
+# True while the current request or job is being profiled
+_profiled: ContextVar[bool] = ContextVar("profiled", default=False)
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def sign_profile_token(secret: str, expires: int) -> str:
+    """Header value that enables profiling until the unix time ``expires``"""
+    signature = hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(secret: str, token: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not secret or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sign_profile_token(secret, int(expires)), f"{expires}.{signature}")
+
+
+class PyinstrumentSession:
+    backend = "pyinstrument"
+
+    def __init__(self, interval: float):
+        from pyinstrument import Profiler  # optional dependency
+        self.profiler = Profiler(interval=interval, async_mode="enabled")
+
+    def start(self) -> None:
+        self.profiler.start()
+
+    def stop(self) -> None:
+        self.profiler.stop()
+
+    def outputs(self) -> Dict[str, bytes]:
+        return {
+            "html": self.profiler.output_html().encode(),
+            "txt": self.profiler.output_text(unicode=False, color=False).encode()
+        }
+
+
+class CProfileSession:
+    backend = "cprofile"
+
+    def __init__(self, interval: float):
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def outputs(self) -> Dict[str, bytes]:
+        self.profile.create_stats()
+        # Same format as Profile.dump_stats, readable with pstats.Stats(path)
+        dump = marshal.dumps(self.profile.stats)
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats("cumulative").print_stats(60)
+        return {"prof": dump, "txt": summary.getvalue().encode()}
+
+
+class ProfileStore:
+    """Profiles on local disk: <id>.json metadata next to the output files"""
+
+    def __init__(self, directory: str, keep: int = 200):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, meta: Dict[str, Any], outputs: Dict[str, bytes]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for fmt, data in outputs.items():
+            with open(os.path.join(self.directory, f"{meta['id']}.{fmt}"), "wb") as f:
+                f.write(data)
+        meta["formats"] = sorted(outputs)
+        # Metadata last, so listed profiles always have their files
+        with open(os.path.join(self.directory, f"{meta['id']}.json"), "w") as f:
+            json.dump(meta, f)
+        self.prune()
+
+    def list(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Saved profiles, newest first"""
+        profiles = []
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # pruned or being written
+        profiles.sort(key=lambda p: p["created_at"], reverse=True)
+        return profiles[:limit] if limit else profiles
+
+    def path(self, profile_id: str, fmt: str) -> Optional[str]:
+        if not _PROFILE_ID.match(profile_id) or fmt not in PROFILE_FORMATS:
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{fmt}")
+        return path if os.path.exists(path) else None
+
+    def prune(self) -> None:
+        for meta in self.list()[self.keep:]:
+            for fmt in list(PROFILE_FORMATS) + ["json"]:
+                try:
+                    os.remove(os.path.join(self.directory, f"{meta['id']}.{fmt}"))
+                except FileNotFoundError:
+                    pass
+
+
+class Profiler:
+    def __init__(self, store: ProfileStore, sample_rate: float = 0, job_sample_rate: float = 0,
+                 secret: str = "", backend: str = "auto", interval: float = 0.001):
+        if backend == "auto":
+            backend = "pyinstrument" if importlib.util.find_spec("pyinstrument") else "cprofile"
+        if backend not in ("pyinstrument", "cprofile"):
+            raise ValueError(f"Unknown profiler backend: {backend}")
+        self.store = store
+        self.sample_rate = sample_rate
+        self.job_sample_rate = job_sample_rate
+        self.secret = secret
+        self.backend = backend
+        self.interval = interval
+        self._busy = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sample_rate > 0 or self.job_sample_rate > 0 or self.secret)
+
+    def request_trigger(self, headers: Headers) -> Optional[str]:
+        token = headers.get(PROFILE_HEADER)
+        if token and verify_profile_token(self.secret, token):
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def tag(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Mark a job payload so the job is profiled when its request is"""
+        if _profiled.get():
+            payload[PROFILE_PAYLOAD_KEY] = True
+        return payload
+
+    def _session(self):
+        cls = PyinstrumentSession if self.backend == "pyinstrument" else CProfileSession
+        return cls(self.interval)
+
+    @asynccontextmanager
+    async def capture(self, kind: str, trigger: str, meta: Dict[str, Any]):
+        """Profile the body; yields the metadata to fill in, or None when busy"""
+        if self._busy:
+            PROFILES_SKIPPED.inc()
+            yield None
+            return
+        self._busy = True
+        session = self._session()
+        trace: List[tuple] = []
+        trace_token = stage_trace.set(trace)
+        profiled_token = _profiled.set(True)
+        meta.update(id=uuid.uuid4().hex, kind=kind, trigger=trigger, backend=session.backend,
+                    created_at=datetime.utcnow().isoformat())
+        started = time.perf_counter()
+        session.start()
+        try:
+            yield meta
+        except BaseException as e:
+            meta["error"] = type(e).__name__
+            raise
+        finally:
+            session.stop()
+            meta["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            meta["stages"] = [
+                {"stage": stage, "ms": round(seconds * 1000, 1), "outcome": outcome}
+                for stage, seconds, outcome in trace
+            ]
+            stage_trace.reset(trace_token)
+            _profiled.reset(profiled_token)
+            self._busy = False
+            try:
+                await asyncio.to_thread(lambda: self.store.save(meta, session.outputs()))
+            except Exception:
+                logger.exception("Could not save profile %s", meta["id"])
+            else:
+                PROFILES_TAKEN.inc(kind=kind, trigger=trigger)
+                logger.info("Saved %s profile %s (%s ms)", kind, meta["id"], meta["duration_ms"])
+
+    def job_handler(self, handler):
+        """Wrap a job handler so tagged or sampled jobs are profiled"""
+        @functools.wraps(handler)
+        async def run(job):
+            if job.payload.get(PROFILE_PAYLOAD_KEY):
+                trigger = "request"
+            elif self.job_sample_rate > 0 and random.random() < self.job_sample_rate:
+                trigger = "sample"
+            else:
+                return await handler(job)
+            meta = {"job_kind": job.kind, "job_id": job.id, "test_id": job.payload.get("test_id")}
+            async with self.capture("job", trigger, meta):
+                return await handler(job)
+        return run
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling sampled or header-signed requests"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        trigger = None
+        if scope["type"] == "http" and self.profiler.enabled:
+            trigger = self.profiler.request_trigger(Headers(scope=scope))
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        meta = {"method": scope["method"], "path": scope["path"]}
+        async with self.profiler.capture("request", trigger, meta) as capturing:
+            if capturing is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    meta["status"] = message["status"]
+                    MutableHeaders(scope=message).append(PROFILE_ID_HEADER, meta["id"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                meta["route"] = route_label(scope)
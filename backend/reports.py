@@ -0,0 +1,128 @@
+"""PDF report rendering.
+
+Functions here are synchronous and CPU bound; they run in the CPU executor's
+worker processes, so they must stay importable without the API server.
+
+Paragraph styles and the fixed parts of the report (title, headings,
+disclaimer) are built once per process by ``ReportTemplate``; each render
+only lays out the metadata lines and the analysis text.
+
+Reports are rendered on demand. ``report_version`` identifies the inputs
+and template a stored report was rendered from, so a report is rendered
+again when either changes.
+"""
+import hashlib
+import io
+from typing import BinaryIO, List, Optional, Tuple
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+
+from metrics import REGISTRY
+
+REPORT_RENDERS = REGISTRY.counter("report_renders_total", "Reports rendered, by what asked for them", ["trigger"])
+
+# Bump REPORT_TEMPLATE_VERSION whenever the report layout changes so stored
+# reports rendered from the old template are rendered again
+REPORT_TEMPLATE_VERSION = "1"
+
+DISCLAIMER = (
+    "<b>DISCLAIMER:</b> This analysis is for educational purposes only and should not replace "
+    "professional veterinary consultation. Always consult with a qualified veterinarian for medical advice."
+)
+
+
+def report_version(analysis_text: str, user_name: str, test_date: str) -> str:
+    digest = hashlib.sha256("\0".join((analysis_text, user_name, test_date)).encode()).hexdigest()
+    return f"{REPORT_TEMPLATE_VERSION}:{digest[:16]}"
+
+
+class ReportTemplate:
+    """Styles and static flowables shared by every report"""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.normal = styles['Normal']
+        title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.darkblue,
+            alignment=1  # Center alignment
+        )
+        disclaimer_style = ParagraphStyle(
+            'Disclaimer',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.red,
+            leftIndent=20,
+            rightIndent=20
+        )
+        # Each appears once per story; layout state is reset on every build
+        self.header: List[Flowable] = [Paragraph("DogBloodGPT Analysis Report", title_style), Spacer(1, 20)]
+        self.analysis_heading: List[Flowable] = [
+            Spacer(1, 20), Paragraph("<b>Blood Test Analysis:</b>", styles['Heading2']), Spacer(1, 12)
+        ]
+        self.footer: List[Flowable] = [Spacer(1, 20), Paragraph(DISCLAIMER, disclaimer_style)]
+
+    def story(self, analysis_text: str, user_name: str, test_date: str) -> List[Flowable]:
+        story = list(self.header)
+        story.append(Paragraph(f"<b>Pet Owner:</b> {user_name}", self.normal))
+        story.append(Paragraph(f"<b>Analysis Date:</b> {test_date}", self.normal))
+        story.extend(self.analysis_heading)
+        for para in analysis_text.split('\n\n'):
+            if para.strip():
+                story.append(Paragraph(para, self.normal))
+                story.append(Spacer(1, 12))
+        story.extend(self.footer)
+        return story
+
+    def render(self, output: BinaryIO, analysis_text: str, user_name: str, test_date: str) -> None:
+        """Lay out the report and write the PDF to ``output``"""
+        doc = SimpleDocTemplate(output, pagesize=letter)
+        doc.build(self.story(analysis_text, user_name, test_date))
+
+
+_template: Optional[ReportTemplate] = None
+
+
+def get_template() -> ReportTemplate:
+    global _template
+    if _template is None:
+        _template = ReportTemplate()
+    return _template
+
+
+class _HashingWriter:
+    """Write-through file wrapper that counts bytes and hashes them"""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        self.sha256.update(data)
+        return self.f.write(data)
+
+
+def render_report(analysis_text: str, user_name: str, test_date: str) -> bytes:
+    """Render the analysis report PDF"""
+    buffer = io.BytesIO()
+    get_template().render(buffer, analysis_text, user_name, test_date)
+    return buffer.getvalue()
+
+
+def render_report_file(path: str, analysis_text: str, user_name: str, test_date: str) -> Tuple[int, str]:
+    """Render the report straight into the file at ``path``.
+
+    Returns (size, sha256 hex) so the caller can store the file without
+    reading it back or passing the PDF between processes.
+    """
+    with open(path, "wb") as f:
+        writer = _HashingWriter(f)
+        get_template().render(writer, analysis_text, user_name, test_date)
+    return writer.size, writer.sha256.hexdigest()
@@ -1,44 +1,173 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse, JSONResponse, FileResponse
+from fastapi.exception_handlers import http_exception_handler
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable
 import os
 import uuid
 import json
+import re
 import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import motor.motor_asyncio
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-import PyPDF2
-import aiofiles
-import io
+from pymongo import ReturnDocument
 import base64
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
+from urllib.parse import quote
 from decouple import config
 
-# Import integrations
-from emergentintegrations.payments.stripe.checkout import (
-    StripeCheckout, 
-    CheckoutSessionResponse, 
-    CheckoutStatusResponse, 
-    CheckoutSessionRequest
+from jobs import Job, LocalJobQueue, MongoJobQueue, JobWorkerPool, PermanentJobError, RetryLater, JOB_QUEUE_DEPTH
+from executor import CpuExecutor, ExecutorSaturated, ExecutorTimeout
+from extraction import extract_pdf, count_pages, PdfTooManyPages
+from uploads import spool_upload
+from blob_store import BlobNotFound, create_blob_store, parse_byte_range
+from indexes import ensure_indexes, missing_indexes
+from passwords import PasswordHasher, HasherSaturated, TooManyConcurrentAttempts, build_crypt_context
+from credits import CreditLedger, InsufficientCredits
+from payments import PaymentClients, PaymentFulfilment, PaymentReconciler, webhook_event_id
+from auth import TokenError, TokenService, UserCache, TOKEN_REFRESH, claims_user
+from pagination import KEYSET_SORT, InvalidCursor, after_cursor, encode_cursor
+from reports import REPORT_RENDERS, REPORT_TEMPLATE_VERSION, render_report_file, report_version
+from metrics import EXPOSITION_CONTENT_TYPE, REGISTRY
+from instrumentation import MongoCommandTimer, RequestMetricsMiddleware, count_error, route_label, stage_timer
+from profiling import PROFILE_FORMATS, PROFILE_HEADER, Profiler, ProfileStore, ProfilingMiddleware, sign_profile_token
+from loop_monitor import LoopLagMonitor
+from analysis_cache import AnalysisCache, LruTtlCache, cache_key
+from llm import StreamHub, stream_message, with_keepalive
+from model_router import (
+    ModelRouter, ModelSpec, REQUEST_ANALYSIS, REQUEST_CHAT, STUB_PROVIDER, TIER_FAST, TIER_LARGE, create_chat
 )
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from llm_gateway import CircuitBreaker, LlmGateway, LlmUnavailable, PRIORITY_CHAT, PRIORITY_UPLOAD
+from chat_manager import ChatSessionManager, estimate_tokens
+from chat_history import ChatHistoryStore
+from fast_path import (
+    ANALYSIS_PATHS, PATH_CACHE, PATH_LLM, PATH_RULES, fast_path_eligible, render_rule_based_analysis
+)
+from lab_parser import prepare_analysis_input, PROMPT_TOKENS_RAW, PROMPT_TOKENS_COMPACT, PROMPT_COMPRESSION
 
 # Environment variables
 MONGO_URL = config('MONGO_URL', default='mongodb://localhost:27017/dogbloodgpt')
 JWT_SECRET_KEY = config('JWT_SECRET_KEY', default='your-super-secret-jwt-key-here')
 STRIPE_API_KEY = config('STRIPE_API_KEY', default='')
+PAYMENT_STATUS_REFRESH_SECONDS = config('PAYMENT_STATUS_REFRESH_SECONDS', default=5, cast=float)
+PAYMENT_SWEEP_INTERVAL = config('PAYMENT_SWEEP_INTERVAL', default=60, cast=float)  # 0 disables the sweeper
+PAYMENT_SWEEP_MIN_AGE = config('PAYMENT_SWEEP_MIN_AGE', default=60, cast=float)
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
+ACCESS_TOKEN_TTL_MINUTES = config('ACCESS_TOKEN_TTL_MINUTES', default=15, cast=int)
+REFRESH_TOKEN_TTL_DAYS = config('REFRESH_TOKEN_TTL_DAYS', default=30, cast=int)
+# Authenticate read-only endpoints from token claims alone, without a users lookup
+AUTH_STATELESS = config('AUTH_STATELESS', default=True, cast=bool)
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=30, cast=float)  # seconds; 0 disables
+USER_CACHE_MAX_ENTRIES = config('USER_CACHE_MAX_ENTRIES', default=10000, cast=int)
+# First scheme hashes new passwords; listed older schemes are upgraded on login.
+# "argon2" needs the argon2-cffi package.
+PASSWORD_SCHEMES = config('PASSWORD_SCHEMES', default='bcrypt', cast=lambda v: [s.strip() for s in v.split(',')])
+BCRYPT_ROUNDS = config('BCRYPT_ROUNDS', default=12, cast=int)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=2, cast=int)
+PASSWORD_HASH_MAX_PENDING = config('PASSWORD_HASH_MAX_PENDING', default=64, cast=int)
+PASSWORD_ATTEMPTS_PER_KEY = config('PASSWORD_ATTEMPTS_PER_KEY', default=2, cast=int)  # per IP and per account
+UPLOAD_DIR = config('UPLOAD_DIR', default='/tmp/dogbloodgpt/uploads')
+# Reports are rendered to files here, then moved or streamed into the blob store
+REPORT_SPOOL_DIR = config('REPORT_SPOOL_DIR', default='/tmp/dogbloodgpt/reports')
+# Reports are rendered on first download; optionally also by a delayed background job
+REPORT_PRERENDER = config('REPORT_PRERENDER', default=False, cast=bool)
+REPORT_PRERENDER_DELAY = config('REPORT_PRERENDER_DELAY', default=60, cast=float)
+JOB_QUEUE_BACKEND = config('JOB_QUEUE_BACKEND', default='local')  # "local" or "mongo"
+# Stages mostly wait on the CPU executor or the LLM, which have their own limits
+JOB_WORKERS = config('JOB_WORKERS', default=16, cast=int)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=3, cast=int)
+BATCH_MAX_FILES = config('BATCH_MAX_FILES', default=20, cast=int)
+# LLM gateway: provider quota (0 = unlimited), retries and circuit breaker
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=8, cast=int)  # provider calls in flight
+LLM_REQUESTS_PER_MINUTE = config('LLM_REQUESTS_PER_MINUTE', default=0, cast=float)
+LLM_TOKENS_PER_MINUTE = config('LLM_TOKENS_PER_MINUTE', default=0, cast=float)
+LLM_MAX_ATTEMPTS = config('LLM_MAX_ATTEMPTS', default=4, cast=int)
+LLM_CIRCUIT_FAILURES = config('LLM_CIRCUIT_FAILURES', default=5, cast=int)
+LLM_CIRCUIT_RESET_SECONDS = config('LLM_CIRCUIT_RESET_SECONDS', default=30, cast=float)
+TESTS_PAGE_SIZE = config('TESTS_PAGE_SIZE', default=20, cast=int)
+TESTS_MAX_PAGE_SIZE = config('TESTS_MAX_PAGE_SIZE', default=100, cast=int)
+TESTS_TOTAL_COUNT_CAP = config('TESTS_TOTAL_COUNT_CAP', default=10000, cast=int)
+ENSURE_INDEXES_ON_STARTUP = config('ENSURE_INDEXES_ON_STARTUP', default=True, cast=bool)
+CPU_EXECUTOR_WORKERS = config('CPU_EXECUTOR_WORKERS', default=0, cast=int)  # 0 = one per core
+CPU_EXECUTOR_MAX_PENDING = config('CPU_EXECUTOR_MAX_PENDING', default=0, cast=int)  # 0 = 4 per worker
+CPU_TASK_TIMEOUT = config('CPU_TASK_TIMEOUT', default=60, cast=float)
+MAX_UPLOAD_BYTES = config('MAX_UPLOAD_BYTES', default=10 * 1024 * 1024, cast=int)
+MAX_PDF_PAGES = config('MAX_PDF_PAGES', default=300, cast=int)
+EXTRACT_PAGES_PER_TASK = config('EXTRACT_PAGES_PER_TASK', default=16, cast=int)
+BLOB_BACKEND = config('BLOB_BACKEND', default='filesystem')  # filesystem, gridfs, s3 or s3-local
+BLOB_ROOT = config('BLOB_ROOT', default='/tmp/dogbloodgpt/blobs')
+BLOB_BUCKET = config('BLOB_BUCKET', default='dogbloodgpt-reports')
+BLOB_ENDPOINT_URL = config('BLOB_ENDPOINT_URL', default='')
+ANALYSIS_CACHE_TTL = config('ANALYSIS_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+ANALYSIS_CACHE_MEMORY_TTL = config('ANALYSIS_CACHE_MEMORY_TTL', default=3600, cast=int)
+ANALYSIS_CACHE_MAX_ENTRIES = config('ANALYSIS_CACHE_MAX_ENTRIES', default=1000, cast=int)
+ANALYSIS_CACHE_MAX_BYTES = config('ANALYSIS_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+
+# Bump ANALYSIS_PROMPT_VERSION whenever the analysis prompt changes so cached
+# analyses produced by the old prompt are no longer reused
+ANALYSIS_PROMPT_VERSION = "2"
+# Model tiers as provider/model; "stub/<name>" is the offline stub provider
+MODEL_LARGE = config('MODEL_LARGE', default='openai/gpt-4')
+MODEL_FAST = config('MODEL_FAST', default='openai/gpt-4o-mini')
+MODEL_ROUTE_FAST_MAX_TOKENS = config('MODEL_ROUTE_FAST_MAX_TOKENS', default=300, cast=int)  # chat questions
+LLM_STUB = config('LLM_STUB', default=False, cast=bool)  # send every tier to the stub provider
+LLM_STUB_LATENCY = config('LLM_STUB_LATENCY', default=0.5, cast=float)  # seconds to first token
+LLM_STUB_OUTPUT_TOKENS = config('LLM_STUB_OUTPUT_TOKENS', default=200, cast=int)
+LLM_STUB_TOKENS_PER_SECOND = config('LLM_STUB_TOKENS_PER_SECOND', default=0, cast=float)  # 0 = instant
+FAST_PATH_ENABLED = config('FAST_PATH_ENABLED', default=True, cast=bool)
+FAST_PATH_MIN_ANALYTES = config('FAST_PATH_MIN_ANALYTES', default=8, cast=int)
+FAST_PATH_TOLERANCE = config('FAST_PATH_TOLERANCE', default=0.1, cast=float)  # fraction of range width
+FAST_PATH_MAX_BORDERLINE = config('FAST_PATH_MAX_BORDERLINE', default=2, cast=int)
+STREAM_KEEPALIVE_SECONDS = config('STREAM_KEEPALIVE_SECONDS', default=15, cast=float)
+CHAT_POOL_MAX_SESSIONS = config('CHAT_POOL_MAX_SESSIONS', default=500, cast=int)
+CHAT_POOL_IDLE_TTL = config('CHAT_POOL_IDLE_TTL', default=1800, cast=int)
+CHAT_HISTORY_TOKEN_BUDGET = config('CHAT_HISTORY_TOKEN_BUDGET', default=1500, cast=int)
+CHAT_CONTEXT_TOKEN_BUDGET = config('CHAT_CONTEXT_TOKEN_BUDGET', default=12000, cast=int)
+CHAT_RECENT_MESSAGES = config('CHAT_RECENT_MESSAGES', default=20, cast=int)  # kept on the session document
+CHAT_HISTORY_PAGE_SIZE = config('CHAT_HISTORY_PAGE_SIZE', default=50, cast=int)
+CHAT_HISTORY_MAX_PAGE_SIZE = config('CHAT_HISTORY_MAX_PAGE_SIZE', default=200, cast=int)
+ADMIN_EMAILS = config('ADMIN_EMAILS', default='', cast=lambda v: {e.strip().lower() for e in v.split(',') if e.strip()})
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)  # fraction of requests
+PROFILING_JOB_SAMPLE_RATE = config('PROFILING_JOB_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_SECRET = config('PROFILING_SECRET', default='')  # signs X-Profile-Request headers; empty disables them
+PROFILER_BACKEND = config('PROFILER_BACKEND', default='auto')  # auto, pyinstrument or cprofile
+PROFILE_DIR = config('PROFILE_DIR', default='/tmp/dogbloodgpt/profiles')
+PROFILES_KEEP = config('PROFILES_KEEP', default=200, cast=int)
+LOOP_LAG_THRESHOLD_MS = config('LOOP_LAG_THRESHOLD_MS', default=200, cast=float)  # 0 disables the monitor
+
+logger = logging.getLogger("dogbloodgpt")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(REPORT_SPOOL_DIR, exist_ok=True)
+    if ENSURE_INDEXES_ON_STARTUP:
+        await ensure_indexes(db)
+    missing = await missing_indexes(db)
+    if missing:
+        logger.warning("Missing Mongo indexes: %s", ", ".join(missing))
+    if isinstance(job_queue, MongoJobQueue):
+        await job_queue.ensure_indexes()
+    await analysis_cache.ensure_indexes()
+    cpu_executor.start()
+    worker_pool.start()
+    loop_monitor.start()
+    if STRIPE_API_KEY:
+        payment_clients.get()
+        payment_reconciler.start()
+    yield
+    await payment_reconciler.stop()
+    await loop_monitor.stop()
+    await worker_pool.stop()
+    cpu_executor.shutdown()
+    password_hasher.shutdown()
 
 # FastAPI app
-app = FastAPI(title="DogBloodGPT API", version="1.0.0")
+app = FastAPI(title="DogBloodGPT API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -49,13 +178,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    count_error(route_label(request.scope), exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy processing other files, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Refuse on the declared length before the multipart body is read
+    if request.method == "POST" and request.url.path.startswith("/api/blood-test/"):
+        content_length = request.headers.get("content-length")
+        max_files = BATCH_MAX_FILES if request.url.path == "/api/blood-test/batch" else 1
+        # Allow some headroom for multipart boundaries and form fields
+        if content_length and content_length.isdigit() and \
+                int(content_length) > max_files * MAX_UPLOAD_BYTES + 64 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"File is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"}
+            )
+    return await call_next(request)
+
+# Opt-in per-request profiles (sampled or X-Profile-Request), listed under /api/admin/profiles
+profiler = Profiler(
+    ProfileStore(PROFILE_DIR, keep=PROFILES_KEEP),
+    sample_rate=PROFILING_SAMPLE_RATE,
+    job_sample_rate=PROFILING_JOB_SAMPLE_RATE,
+    secret=PROFILING_SECRET,
+    backend=PROFILER_BACKEND
+)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Outermost, so it also times requests the middleware above turns away
+app.add_middleware(RequestMetricsMiddleware)
+
+# Logs what is running when the event loop is blocked for LOOP_LAG_THRESHOLD_MS
+loop_monitor = LoopLagMonitor(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+
+@app.exception_handler(HTTPException)
+async def http_error_handler(request: Request, exc: HTTPException):
+    if exc.status_code >= 500:
+        # Most 500s are raised while handling another exception; count that one
+        count_error(route_label(request.scope), exc.__context__ or exc)
+    return await http_exception_handler(request, exc)
+
+@app.exception_handler(HasherSaturated)
+async def hasher_saturated_handler(request: Request, exc: HasherSaturated):
+    count_error(route_label(request.scope), exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-ins in progress, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(TooManyConcurrentAttempts)
+async def too_many_attempts_handler(request: Request, exc: TooManyConcurrentAttempts):
+    count_error(route_label(request.scope), exc)
+    return JSONResponse(status_code=429, content={"detail": "Too many attempts in progress, please wait"})
+
+@app.exception_handler(LlmUnavailable)
+async def llm_unavailable_handler(request: Request, exc: LlmUnavailable):
+    count_error(route_label(request.scope), exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The AI service is temporarily unavailable, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(ExecutorTimeout)
+async def executor_timeout_handler(request: Request, exc: ExecutorTimeout):
+    count_error(route_label(request.scope), exc)
+    return JSONResponse(status_code=504, content={"detail": f"Processing timed out: {exc}"})
+
+# CPU-bound work (PyPDF2, ReportLab) runs here instead of on the event loop
+cpu_executor = CpuExecutor(
+    max_workers=CPU_EXECUTOR_WORKERS or None,
+    max_pending=CPU_EXECUTOR_MAX_PENDING or None,
+    task_timeout=CPU_TASK_TIMEOUT
+)
+
 # MongoDB client
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoCommandTimer()])
 db = client.dogbloodgpt
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    build_crypt_context(PASSWORD_SCHEMES, bcrypt_rounds=BCRYPT_ROUNDS),
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    per_key_limit=PASSWORD_ATTEMPTS_PER_KEY
+)
 security = HTTPBearer()
+token_service = TokenService(
+    JWT_SECRET_KEY,
+    access_ttl=timedelta(minutes=ACCESS_TOKEN_TTL_MINUTES),
+    refresh_ttl=timedelta(days=REFRESH_TOKEN_TTL_DAYS)
+)
+user_cache = UserCache(ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES,
+                       revocation_ttl=ACCESS_TOKEN_TTL_MINUTES * 60)
 
 # Pydantic models
 class UserRegister(BaseModel):
@@ -70,6 +293,10 @@ class UserLogin(BaseModel):
 class ChatMessage(BaseModel):
     message: str
     session_id: str
+    stream: bool = False
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class PaymentRequest(BaseModel):
     credits: int
@@ -89,156 +316,626 @@ users_collection = db.users
 payment_transactions_collection = db.payment_transactions
 blood_tests_collection = db.blood_tests
 chat_sessions_collection = db.chat_sessions
+chat_messages_collection = db.chat_messages
+jobs_collection = db.jobs
+analysis_cache_collection = db.analysis_cache
+credit_ledger_collection = db.credit_ledger
+payment_events_collection = db.payment_events
 
-# Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# Rendered PDF reports live here; blood_tests documents only keep a reference
+blob_store = create_blob_store(
+    BLOB_BACKEND,
+    db=db,
+    root=BLOB_ROOT,
+    bucket=BLOB_BUCKET,
+    endpoint_url=BLOB_ENDPOINT_URL
+)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+credit_ledger = CreditLedger(users_collection, credit_ledger_collection)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm="HS256")
-    return encoded_jwt
+async def on_credits_granted(user_id: str):
+    invalidate_user(user_id)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Webhook inbox and exactly-once crediting of paid checkout sessions
+payment_fulfilment = PaymentFulfilment(
+    payment_events_collection,
+    payment_transactions_collection,
+    credit_ledger,
+    on_granted=on_credits_granted
+)
+
+# One Stripe checkout client per webhook URL, reused across requests
+payment_clients = PaymentClients(STRIPE_API_KEY)
+payment_reconciler = PaymentReconciler(
+    payment_transactions_collection,
+    payment_clients,
+    refresh_interval=PAYMENT_STATUS_REFRESH_SECONDS,
+    sweep_interval=PAYMENT_SWEEP_INTERVAL,
+    sweep_min_age=PAYMENT_SWEEP_MIN_AGE,
+    on_paid=payment_fulfilment.fulfil
+)
+
+analysis_cache = AnalysisCache(
+    analysis_cache_collection,
+    LruTtlCache(
+        max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+        max_bytes=ANALYSIS_CACHE_MAX_BYTES,
+        ttl=ANALYSIS_CACHE_MEMORY_TTL
+    ),
+    ttl=ANALYSIS_CACHE_TTL
+)
+
+# Field projections for read paths; never load more than the handler uses
+USER_PROJECTION = {"_id": 0, "password": 0, "pending_reservations": 0, "pending_grants": 0}
+LOGIN_PROJECTION = {
+    "_id": 0, "id": 1, "email": 1, "full_name": 1, "credits": 1, "password": 1, "token_version": 1
+}
+TEST_LIST_PROJECTION = {"_id": 0, "id": 1, "filename": 1, "created_at": 1, "status": 1}
+TEST_VIEW_PROJECTION = {
+    "_id": 0, "id": 1, "filename": 1, "analysis": 1, "created_at": 1, "status": 1,
+    "error": 1, "analysis_source": 1
+}
+
+# Blood test statuses; the pipeline moves a test through them in this order
+TEST_STATUS_QUEUED = "queued"
+TEST_STATUS_EXTRACTING = "extracting"
+TEST_STATUS_ANALYZING = "analyzing"
+TEST_STATUS_RENDERING = "rendering"  # only tests queued before reports were rendered on demand
+TEST_STATUS_COMPLETED = "completed"
+TEST_STATUS_FAILED = "failed"
+TERMINAL_TEST_STATUSES = (TEST_STATUS_COMPLETED, TEST_STATUS_FAILED)
+
+# Helper functions
+def password_limit_keys(request: Request, email: str) -> List[str]:
+    """Keys that password hashing concurrency is limited by"""
+    client_ip = request.client.host if request.client else "unknown"
+    return [f"ip:{client_ip}", f"account:{email.lower()}"]
+
+def decode_access_token(credentials: HTTPAuthorizationCredentials) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=["HS256"])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        
-        user = await users_collection.find_one({"id": user_id})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
+        return token_service.decode(credentials.credentials)
+    except TokenError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-async def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file"""
+async def load_user(user_id: str) -> Optional[dict]:
+    """User document from the in-process cache, falling back to Mongo"""
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await users_collection.find_one({"id": user_id}, USER_PROJECTION)
+        if user is not None:
+            user_cache.set(user)
+    return user
+
+def invalidate_user(user_id: str) -> None:
+    """Call after changing a user's credits or profile (revocations go through user_cache.revoke)"""
+    user_cache.invalidate(user_id)
+
+def check_token_version(payload: dict, user: dict) -> None:
+    if payload.get("ver", 0) != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Full user document (including credits) for the bearer token"""
+    payload = decode_access_token(credentials)
+    user = await load_user(payload["sub"])
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    check_token_version(payload, user)
+    return user
+
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Identity (id, email, full_name) for read-only endpoints.
+
+    Comes from the token claims with no database hit; the token is still
+    checked against this process's revocation floor and any cached user.
+    Tokens issued before the claims were added, or AUTH_STATELESS=false,
+    fall back to get_current_user.
+    """
+    payload = decode_access_token(credentials)
+    user = claims_user(payload) if AUTH_STATELESS else None
+    if user is None:
+        return await get_current_user(credentials)
+    if user_cache.revoked(user["id"], user["token_version"]):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    cached = user_cache.get(user["id"])
+    if cached is not None:
+        check_token_version(payload, cached)
+        return cached
+    return user
+
+async def get_admin_user(current_user: dict = Depends(get_token_user)):
+    """The current user, if listed in ADMIN_EMAILS"""
+    if current_user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+async def extract_text_from_pdf(path: str, wait: bool = False):
+    """Extract text from a PDF on disk, page ranges in parallel"""
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
+        return await extract_pdf(cpu_executor, path, MAX_PDF_PAGES, EXTRACT_PAGES_PER_TASK, wait=wait)
+    except (ExecutorSaturated, ExecutorTimeout):
+        raise
+    except PdfTooManyPages as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error extracting text from PDF: {str(e)}")
 
-async def analyze_blood_test_with_ai(blood_test_text: str, user_question: str = None) -> str:
-    """Analyze blood test results using OpenAI"""
+async def check_pdf_page_count(path: str, wait: bool = False) -> int:
+    """Reject unreadable or over-limit PDFs before they are queued"""
     try:
-        # System message for blood test analysis
-        system_message = """You are an expert veterinary pathologist specializing in canine blood work analysis. 
-        Your role is to provide detailed, accurate interpretations of dog blood test results.
-        
-        When analyzing blood tests, always:
-        1. Identify each parameter and its reference range
-        2. Highlight any abnormal values (high/low)
-        3. Explain the clinical significance of abnormal findings
-        4. Suggest potential causes for abnormalities
-        5. Recommend follow-up actions if needed
-        6. Use clear, professional language that pet owners can understand
-        
-        Always include a disclaimer that this analysis is for educational purposes and should not replace professional veterinary consultation."""
-
-        # Create chat instance
-        chat = LlmChat(
-            api_key=OPENAI_API_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message=system_message
-        ).with_model("openai", "gpt-4")
-
-        # Create user message
-        if user_question:
-            prompt = f"Here are the blood test results:\n\n{blood_test_text}\n\nSpecific question: {user_question}"
-        else:
-            prompt = f"Please analyze these dog blood test results:\n\n{blood_test_text}"
+        page_count = await cpu_executor.run(count_pages, path, wait=wait)
+    except (ExecutorSaturated, ExecutorTimeout):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+    if page_count > MAX_PDF_PAGES:
+        raise HTTPException(status_code=413, detail=str(PdfTooManyPages(page_count, MAX_PDF_PAGES)))
+    return page_count
 
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        return response.content
+# System message for blood test analysis
+ANALYSIS_SYSTEM_MESSAGE = """You are an expert veterinary pathologist specializing in canine blood work analysis. 
+Your role is to provide detailed, accurate interpretations of dog blood test results.
+
+When analyzing blood tests, always:
+1. Identify each parameter and its reference range
+2. Highlight any abnormal values (high/low)
+3. Explain the clinical significance of abnormal findings
+4. Suggest potential causes for abnormalities
+5. Recommend follow-up actions if needed
+6. Use clear, professional language that pet owners can understand
+
+Always include a disclaimer that this analysis is for educational purposes and should not replace professional veterinary consultation."""
+
+def model_spec(tier: str, spec: str) -> ModelSpec:
+    parsed = ModelSpec.parse(tier, spec)
+    return ModelSpec(tier, STUB_PROVIDER, parsed.model) if LLM_STUB else parsed
+
+model_router = ModelRouter(
+    {TIER_LARGE: model_spec(TIER_LARGE, MODEL_LARGE), TIER_FAST: model_spec(TIER_FAST, MODEL_FAST)},
+    fast_max_prompt_tokens=MODEL_ROUTE_FAST_MAX_TOKENS
+)
+
+def create_llm_chat(session_id: str, spec: ModelSpec):
+    return create_chat(
+        spec,
+        session_id,
+        ANALYSIS_SYSTEM_MESSAGE,
+        api_key=OPENAI_API_KEY,
+        stub_latency=LLM_STUB_LATENCY,
+        stub_output_tokens=LLM_STUB_OUTPUT_TOKENS,
+        stub_tokens_per_second=LLM_STUB_TOKENS_PER_SECOND
+    )
+
+def stream_blood_test_analysis(blood_test_text: str, user_question: str = None,
+                               spec: Optional[ModelSpec] = None) -> AsyncIterator[str]:
+    """Stream a one-off analysis (or an answer to a question) as text deltas"""
+    spec = spec or model_router.route(REQUEST_ANALYSIS, estimate_tokens(blood_test_text))
+    chat = create_llm_chat(str(uuid.uuid4()), spec)
+
+    # Create user message
+    if user_question:
+        prompt = f"Here are the blood test results:\n\n{blood_test_text}\n\nSpecific question: {user_question}"
+    else:
+        prompt = f"Please analyze these dog blood test results:\n\n{blood_test_text}"
+
+    return stream_message(chat, prompt)
+
+# Every provider call goes through the gateway; chat is admitted ahead of uploads
+llm_gateway = LlmGateway(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_attempts=LLM_MAX_ATTEMPTS,
+    breaker=CircuitBreaker(LLM_CIRCUIT_FAILURES, LLM_CIRCUIT_RESET_SECONDS)
+)
+
+def stream_chat_message(chat, prompt: str) -> AsyncIterator[str]:
+    return llm_gateway.stream(
+        lambda: stream_message(chat, prompt),
+        priority=PRIORITY_CHAT,
+        prompt_tokens=estimate_tokens(prompt)
+    )
+
+# One pooled chat client per chat session, so follow-up questions do not resend the report
+chat_manager = ChatSessionManager(
+    chat_factory=lambda session_id, tier: create_llm_chat(f"chat-{session_id}-{tier}", model_router.tiers[tier]),
+    stream_fn=stream_chat_message,
+    max_sessions=CHAT_POOL_MAX_SESSIONS,
+    idle_ttl=CHAT_POOL_IDLE_TTL,
+    history_token_budget=CHAT_HISTORY_TOKEN_BUDGET,
+    context_token_budget=CHAT_CONTEXT_TOKEN_BUDGET
+)
+
+# Messages are stored one per document; the session keeps the newest few and a summary
+chat_history = ChatHistoryStore(
+    chat_sessions_collection,
+    chat_messages_collection,
+    recent_messages=CHAT_RECENT_MESSAGES,
+    summary_token_budget=chat_manager.summary_token_budget
+)
+
+async def analyze_blood_test_with_ai(blood_test_text: str, user_question: str = None,
+                                     on_delta: Optional[Callable[[str], None]] = None,
+                                     on_reset: Optional[Callable[[], None]] = None,
+                                     key: Optional[str] = None, spec: Optional[ModelSpec] = None) -> str:
+    """Analyze blood test results using OpenAI.
 
+    Calls with the same ``key`` while one is in flight share its result
+    (only the first caller's ``on_delta`` sees tokens). When the gateway
+    retries after some deltas were passed on, ``on_reset`` is called
+    before the retry's first delta.
+    """
+    emitted = False
+
+    async def collect() -> str:
+        nonlocal emitted
+        parts = []
+        async for delta in stream_blood_test_analysis(blood_test_text, user_question, spec):
+            if emitted and not parts and on_reset:
+                on_reset()
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+                emitted = True
+        return "".join(parts)
+
+    try:
+        return await llm_gateway.call(
+            collect,
+            priority=PRIORITY_UPLOAD,
+            prompt_tokens=estimate_tokens(blood_test_text),
+            key=key
+        )
+    except LlmUnavailable as e:
+        # The circuit is open: come back once it may have closed, without spending an attempt
+        raise RetryLater(e.retry_after, str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing blood test: {str(e)}")
 
-async def generate_pdf_report(analysis_text: str, user_name: str, test_date: str) -> bytes:
-    """Generate PDF report from analysis"""
+async def generate_pdf_report(test_id: str, analysis_text: str, user_name: str, test_date: str,
+                              wait: bool = False) -> dict:
+    """Render the PDF report into the blob store and return its reference.
+
+    The worker process writes the PDF to a spool file, so the document never
+    passes through this process's memory on the filesystem and GridFS backends.
+    With ``wait`` a full CPU executor is waited on instead of raising.
+    """
+    path = os.path.join(REPORT_SPOOL_DIR, f"{test_id}-{uuid.uuid4().hex}.pdf")
     try:
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.darkblue,
-            alignment=1  # Center alignment
-        )
-        story.append(Paragraph("DogBloodGPT Analysis Report", title_style))
-        story.append(Spacer(1, 20))
+        try:
+            with stage_timer("render"):
+                _, etag = await cpu_executor.run(
+                    render_report_file, path, analysis_text, user_name, test_date, wait=wait
+                )
+        except (ExecutorSaturated, ExecutorTimeout):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error generating PDF report: {str(e)}")
+        with stage_timer("store"):
+            info = await blob_store.put_file(f"reports/{test_id}.pdf", path, "application/pdf", etag=etag)
+        return info.to_dict()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
 
-        # Metadata
-        story.append(Paragraph(f"<b>Pet Owner:</b> {user_name}", styles['Normal']))
-        story.append(Paragraph(f"<b>Analysis Date:</b> {test_date}", styles['Normal']))
-        story.append(Spacer(1, 20))
+# Fields needed to render a test's report and tell whether the stored one is current
+REPORT_FIELDS = {"id": 1, "owner_name": 1, "analysis": 1, "created_at": 1, "report_blob": 1}
 
-        # Analysis content
-        story.append(Paragraph("<b>Blood Test Analysis:</b>", styles['Heading2']))
-        story.append(Spacer(1, 12))
-        
-        # Split analysis into paragraphs
-        paragraphs = analysis_text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                story.append(Paragraph(para, styles['Normal']))
-                story.append(Spacer(1, 12))
-
-        # Disclaimer
-        disclaimer_style = ParagraphStyle(
-            'Disclaimer',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.red,
-            leftIndent=20,
-            rightIndent=20
+def report_inputs(test: dict) -> tuple:
+    return test["analysis"], test["owner_name"], test["created_at"].strftime("%Y-%m-%d")
+
+def report_is_current(test: dict) -> bool:
+    report_blob = test.get("report_blob")
+    if not report_blob:
+        return False
+    if "version" not in report_blob:
+        # Rendered at upload time, before versioning, from the first template
+        return REPORT_TEMPLATE_VERSION == "1"
+    return report_blob["version"] == report_version(*report_inputs(test))
+
+# Renders in progress by test id, so concurrent downloads share one render
+report_renders: Dict[str, asyncio.Future] = {}
+
+async def ensure_report(test: dict, trigger: str, wait: bool = False) -> dict:
+    """The test's report blob, rendered first if missing or stale"""
+    if report_is_current(test):
+        return test["report_blob"]
+    pending = report_renders.get(test["id"])
+    if pending is not None:
+        return await asyncio.shield(pending)
+    pending = asyncio.get_running_loop().create_future()
+    report_renders[test["id"]] = pending
+    try:
+        inputs = report_inputs(test)
+        report_blob = await generate_pdf_report(test["id"], *inputs, wait=wait)
+        report_blob["version"] = report_version(*inputs)
+        await blood_tests_collection.update_one({"id": test["id"]}, {"$set": {"report_blob": report_blob}})
+        REPORT_RENDERS.inc(trigger=trigger)
+    except BaseException as e:
+        if not pending.done():
+            pending.set_exception(e if isinstance(e, Exception) else RuntimeError("Render cancelled"))
+            pending.exception()  # mark retrieved when nobody else is waiting
+        raise
+    else:
+        pending.set_result(report_blob)
+        return report_blob
+    finally:
+        report_renders.pop(test["id"], None)
+
+async def store_report(test_id: str, pdf_report: bytes) -> dict:
+    """Save a rendered report to the blob store and return its reference"""
+    with stage_timer("store"):
+        info = await blob_store.put(f"reports/{test_id}.pdf", pdf_report, "application/pdf")
+    return info.to_dict()
+
+async def migrate_legacy_report(test: dict) -> dict:
+    """Move a base64 pdf_report embedded in a blood test into the blob store"""
+    report_blob = await store_report(test["id"], base64.b64decode(test["pdf_report"]))
+    await blood_tests_collection.update_one(
+        {"id": test["id"]},
+        {"$set": {"report_blob": report_blob}, "$unset": {"pdf_report": ""}}
+    )
+    return report_blob
+
+# Background pipeline: upload -> extract -> analyze; the PDF report is rendered on demand
+async def set_test_status(test_id: str, status: str, **fields):
+    await blood_tests_collection.update_one(
+        {"id": test_id},
+        {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+    )
+
+# Fields the credit helpers below need from a blood test document
+CREDIT_FIELDS = {"user_id": 1, "credit_key": 1, "credit_part": 1}
+
+async def commit_test_credit(test: dict):
+    """Keep the credit reserved for a test once its report is ready"""
+    with stage_timer("credit"):
+        if test.get("credit_part"):
+            await credit_ledger.commit_part(test["credit_key"], test["credit_part"])
+        elif test.get("credit_key"):
+            await credit_ledger.commit(test["credit_key"])
+
+async def refund_test_credit(test: dict):
+    """Give back the credit reserved for a test that failed"""
+    with stage_timer("credit"):
+        if test.get("credit_part"):
+            await credit_ledger.refund_part(test["credit_key"], test["credit_part"])
+        elif test.get("credit_key"):
+            await credit_ledger.refund(test["credit_key"])
+        else:
+            # Tests queued before the credit ledger existed
+            await users_collection.update_one({"id": test["user_id"]}, {"$inc": {"credits": 1}})
+    invalidate_user(test["user_id"])
+
+async def complete_test(test_id: str, test: dict, **fields):
+    """Mark the test completed once its analysis is stored and keep its credit"""
+    await set_test_status(test_id, TEST_STATUS_COMPLETED, **fields)
+    await commit_test_credit(test)
+    if REPORT_PRERENDER:
+        await job_queue.put("render", {"test_id": test_id}, delay=REPORT_PRERENDER_DELAY)
+
+async def run_extract_stage(job: Job):
+    test_id = job.payload["test_id"]
+    test = await blood_tests_collection.find_one({"id": test_id}, {"_id": 0, "upload_path": 1})
+    if not test:
+        raise PermanentJobError(f"Blood test {test_id} not found")
+    await set_test_status(test_id, TEST_STATUS_EXTRACTING)
+
+    upload_path = test["upload_path"]
+    with stage_timer("extract"):
+        try:
+            document = await extract_text_from_pdf(upload_path, wait=True)
+        except HTTPException as e:
+            raise PermanentJobError(e.detail)
+        if not document.text.strip():
+            raise PermanentJobError("No text could be extracted from the PDF")
+
+        # Reduce the raw text to a table of parsed lab values for the prompt
+        analysis_input, lab_values, unparsed_rows = await cpu_executor.run(
+            prepare_analysis_input, document.text, wait=True
         )
-        story.append(Spacer(1, 20))
-        story.append(Paragraph("<b>DISCLAIMER:</b> This analysis is for educational purposes only and should not replace professional veterinary consultation. Always consult with a qualified veterinarian for medical advice.", disclaimer_style))
+    raw_tokens, compact_tokens = estimate_tokens(document.text), estimate_tokens(analysis_input)
+    PROMPT_TOKENS_RAW.inc(raw_tokens)
+    PROMPT_TOKENS_COMPACT.inc(compact_tokens)
+    PROMPT_COMPRESSION.observe(raw_tokens / max(compact_tokens, 1))
+    logger.info(
+        "Prompt preprocessing for test %s: %d analytes, %d unparsed rows, %d -> %d tokens (%.1fx)",
+        test_id, len(lab_values), len(unparsed_rows), raw_tokens, compact_tokens,
+        raw_tokens / max(compact_tokens, 1)
+    )
 
-        doc.build(story)
-        buffer.seek(0)
-        return buffer.read()
+    await set_test_status(
+        test_id,
+        TEST_STATUS_ANALYZING,
+        extracted_text=document.text,
+        pages=document.page_offsets(),
+        analysis_input=analysis_input,
+        lab_values=lab_values,
+        unparsed_rows=unparsed_rows
+    )
+    await job_queue.put("analyze", profiler.tag({"test_id": test_id}))
+    os.remove(upload_path)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating PDF report: {str(e)}")
+async def run_analyze_stage(job: Job):
+    test_id = job.payload["test_id"]
+    test = await blood_tests_collection.find_one(
+        {"id": test_id},
+        {"_id": 0, "lab_values": 1, "unparsed_rows": 1, "analysis_input": 1, "extracted_text": 1,
+         **CREDIT_FIELDS}
+    )
+    if not test:
+        raise PermanentJobError(f"Blood test {test_id} not found")
+
+    if job.attempts > 1:
+        # Tokens from the failed attempt may have reached subscribers
+        analysis_stream_hub.publish(test_id, {"event": "reset"})
+    with stage_timer("analyze"):
+        fields = await produce_analysis(test_id, test)
+    await complete_test(test_id, test, **fields)
+
+async def produce_analysis(test_id: str, test: dict) -> dict:
+    """The test's analysis fields: rule-based, from the analysis cache or from the LLM"""
+    # Normal or trivially abnormal panels get a rule-based report without an LLM round trip
+    lab_values = test.get("lab_values") or []
+    if FAST_PATH_ENABLED and fast_path_eligible(
+        lab_values, test.get("unparsed_rows"),
+        FAST_PATH_MIN_ANALYTES, FAST_PATH_TOLERANCE, FAST_PATH_MAX_BORDERLINE
+    ):
+        analysis = render_rule_based_analysis(lab_values, FAST_PATH_TOLERANCE)
+        ANALYSIS_PATHS.inc(path=PATH_RULES)
+        return {"analysis": analysis, "analysis_source": PATH_RULES}
+
+    analysis_input = test.get("analysis_input") or test["extracted_text"]
+    spec = model_router.route(REQUEST_ANALYSIS, estimate_tokens(analysis_input))
+    key = cache_key(analysis_input, ANALYSIS_PROMPT_VERSION, spec.name)
+    cached = await analysis_cache.get(key)
+    if cached:
+        ANALYSIS_PATHS.inc(path=PATH_CACHE)
+        return {"analysis": cached["analysis"], "analysis_key": key, "analysis_source": PATH_CACHE}
+
+    started = time.perf_counter()
+    analysis = await analyze_blood_test_with_ai(
+        analysis_input,
+        on_delta=lambda delta: analysis_stream_hub.publish(test_id, {"event": "token", "delta": delta}),
+        on_reset=lambda: analysis_stream_hub.publish(test_id, {"event": "reset"}),
+        key=key,
+        spec=spec
+    )
+    ANALYSIS_PATHS.inc(path=PATH_LLM)
+    await analysis_cache.put(key, {
+        "analysis": analysis,
+        "llm_seconds": time.perf_counter() - started,
+        "prompt_tokens": estimate_tokens(analysis_input)
+    })
+    return {"analysis": analysis, "analysis_key": key, "analysis_source": PATH_LLM}
+
+async def run_render_stage(job: Job):
+    """Pre-render a completed test's report (REPORT_PRERENDER).
+
+    Also finishes tests queued for rendering before reports became lazy.
+    """
+    test_id = job.payload["test_id"]
+    test = await blood_tests_collection.find_one(
+        {"id": test_id},
+        {"_id": 0, "status": 1, **REPORT_FIELDS, **CREDIT_FIELDS}
+    )
+    if not test:
+        raise PermanentJobError(f"Blood test {test_id} not found")
+
+    # Accepted work: wait for CPU capacity rather than spend a job attempt on it
+    await ensure_report(test, trigger="background", wait=True)
+    if test["status"] == TEST_STATUS_RENDERING:
+        await set_test_status(test_id, TEST_STATUS_COMPLETED)
+        await commit_test_credit(test)
+
+async def run_payment_event(job: Job):
+    try:
+        await payment_fulfilment.process(job.payload["event_id"])
+    except LookupError as e:
+        raise PermanentJobError(str(e))
+
+async def handle_failed_job(job: Job, error: Exception):
+    """Mark the test failed and give the reserved credit back, or mark a payment event failed"""
+    if job.kind == "payment_event":
+        # Left in the inbox as failed for tools/replay_payment_events.py
+        await payment_fulfilment.mark_failed(job.payload["event_id"], str(error))
+        return
+    test_id = job.payload.get("test_id")
+    test = await blood_tests_collection.find_one_and_update(
+        {"id": test_id, "status": {"$nin": list(TERMINAL_TEST_STATUSES)}},
+        {"$set": {"status": TEST_STATUS_FAILED, "error": str(error), "updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "upload_path": 1, **CREDIT_FIELDS}
+    )
+    if test:
+        await refund_test_credit(test)
+        upload_path = test.get("upload_path")
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+# Live analysis tokens for clients following /api/blood-test/{id}/events
+analysis_stream_hub = StreamHub()
+
+if JOB_QUEUE_BACKEND == "mongo":
+    job_queue = MongoJobQueue(jobs_collection, max_attempts=JOB_MAX_ATTEMPTS)
+else:
+    job_queue = LocalJobQueue(max_attempts=JOB_MAX_ATTEMPTS)
+
+worker_pool = JobWorkerPool(
+    job_queue,
+    handlers={
+        "extract": profiler.job_handler(run_extract_stage),
+        "analyze": profiler.job_handler(run_analyze_stage),
+        "render": profiler.job_handler(run_render_stage),
+        "payment_event": run_payment_event,
+    },
+    concurrency=JOB_WORKERS,
+    on_dead_letter=handle_failed_job,
+)
 
 # Routes
 @app.get("/")
 async def root():
     return {"message": "DogBloodGPT API is running"}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """In-process metrics snapshot (executor queue depth, stage timings)"""
+    return REGISTRY.snapshot()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_prometheus_metrics():
+    """The same metrics for Prometheus / OpenMetrics scrapers"""
+    try:
+        JOB_QUEUE_DEPTH.set(await job_queue.depth())
+    except Exception as e:
+        logger.warning("Could not read job queue depth: %s", e)
+    return Response(REGISTRY.exposition(), media_type=EXPOSITION_CONTENT_TYPE)
+
+@app.get("/api/admin/profiles")
+async def list_profiles(
+    limit: int = Query(50, ge=1, le=PROFILES_KEEP),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Saved request and job profiles, newest first"""
+    profiles = await asyncio.to_thread(profiler.store.list, limit)
+    return {"backend": profiler.backend, "enabled": profiler.enabled, "items": profiles}
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    format: str = Query("txt", pattern="^(html|txt|prof)$"),
+    current_user: dict = Depends(get_admin_user)
+):
+    path = profiler.store.path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type=PROFILE_FORMATS[format], filename=f"profile-{profile_id}.{format}")
+
+@app.post("/api/admin/profiles/token")
+async def create_profile_token(
+    ttl: int = Query(600, ge=1, le=24 * 3600),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Header that profiles any request sending it until it expires"""
+    if not PROFILING_SECRET:
+        raise HTTPException(status_code=400, detail="PROFILING_SECRET is not configured")
+    expires = int(time.time()) + ttl
+    return {
+        "header": PROFILE_HEADER,
+        "value": sign_profile_token(PROFILING_SECRET, expires),
+        "expires_at": datetime.utcfromtimestamp(expires).isoformat()
+    }
+
 @app.post("/api/auth/register")
-async def register(user: UserRegister):
+async def register(user: UserRegister, request: Request):
     # Check if user already exists
-    existing_user = await users_collection.find_one({"email": user.email})
+    existing_user = await users_collection.find_one({"email": user.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
     user_id = str(uuid.uuid4())
-    hashed_password = hash_password(user.password)
+    hashed_password = await password_hasher.hash(user.password, password_limit_keys(request, user.email))
     
     new_user = {
         "id": user_id,
@@ -252,12 +949,8 @@ async def register(user: UserRegister):
     
     await users_collection.insert_one(new_user)
     
-    # Create JWT token
-    access_token = create_access_token(data={"sub": user_id})
-    
     return {
-        "access_token": access_token,
-        "token_type": "bearer",
+        **token_service.token_pair(new_user),
         "user": {
             "id": user_id,
             "email": user.email,
@@ -267,18 +960,22 @@ async def register(user: UserRegister):
     }
 
 @app.post("/api/auth/login")
-async def login(user: UserLogin):
+async def login(user: UserLogin, request: Request):
     # Find user
-    db_user = await users_collection.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    db_user = await users_collection.find_one({"email": user.email}, LOGIN_PROJECTION)
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    # Create JWT token
-    access_token = create_access_token(data={"sub": db_user["id"]})
+    valid, new_hash = await password_hasher.verify_and_update(
+        user.password, db_user["password"], password_limit_keys(request, user.email)
+    )
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash used an old scheme or cost; replace it transparently
+        await users_collection.update_one({"id": db_user["id"]}, {"$set": {"password": new_hash}})
     
     return {
-        "access_token": access_token,
-        "token_type": "bearer",
+        **token_service.token_pair(db_user),
         "user": {
             "id": db_user["id"],
             "email": db_user["email"],
@@ -287,6 +984,38 @@ async def login(user: UserLogin):
         }
     }
 
+@app.post("/api/auth/refresh")
+async def refresh_tokens(request: RefreshRequest):
+    """Exchange a refresh token for a new access / refresh token pair"""
+    try:
+        payload = token_service.decode(request.refresh_token, TOKEN_REFRESH)
+    except TokenError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    # Read the user fresh so a revocation elsewhere is seen immediately
+    user = await users_collection.find_one({"id": payload["sub"]}, USER_PROJECTION)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    check_token_version(payload, user)
+    user_cache.set(user)
+    return token_service.token_pair(user)
+
+@app.post("/api/auth/logout")
+async def logout_everywhere(current_user: dict = Depends(get_current_user)):
+    """Revoke every access and refresh token issued to the current user"""
+    user = await users_collection.find_one_and_update(
+        {"id": current_user["id"]},
+        {"$inc": {"token_version": 1}},
+        projection=USER_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    # Keep the new version rather than dropping the entry, so stateless endpoints see the revocation
+    user_cache.revoke(user["id"], user["token_version"])
+    user_cache.set(user)
+    return {"status": "logged_out"}
+
 @app.get("/api/user/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
     return {
@@ -297,27 +1026,31 @@ async def get_profile(current_user: dict = Depends(get_current_user)):
     }
 
 @app.post("/api/payments/create-checkout")
-async def create_checkout(request: Request, credits: int = Form(...), host_url: str = Form(...)):
+async def create_checkout(
+    request: Request,
+    credits: int = Form(...),
+    host_url: str = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
     """Create Stripe checkout session for credits"""
     try:
         # Fixed price: $97 per credit
         amount = float(credits * 97)
         
-        # Initialize Stripe checkout
         webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        stripe_checkout = payment_clients.get(webhook_url)
         
         # Create success and cancel URLs
         success_url = f"{host_url}/payment-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{host_url}/payment-cancel"
         
         # Create checkout session
-        checkout_request = CheckoutSessionRequest(
+        checkout_request = payment_clients.checkout_request(
             amount=amount,
             currency="usd",
             success_url=success_url,
             cancel_url=cancel_url,
-            metadata={"credits": str(credits), "source": "dogbloodgpt"}
+            metadata={"credits": str(credits), "source": "dogbloodgpt", "user_id": current_user["id"]}
         )
         
         session = await stripe_checkout.create_checkout_session(checkout_request)
@@ -328,9 +1061,10 @@ async def create_checkout(request: Request, credits: int = Form(...), host_url:
             "amount": amount,
             "currency": "usd",
             "credits": credits,
+            "user_id": current_user["id"],
             "payment_status": "pending",
             "created_at": datetime.utcnow(),
-            "metadata": {"credits": str(credits), "source": "dogbloodgpt"}
+            "metadata": {"credits": str(credits), "source": "dogbloodgpt", "user_id": current_user["id"]}
         }
         
         await payment_transactions_collection.insert_one(transaction)
@@ -342,36 +1076,18 @@ async def create_checkout(request: Request, credits: int = Form(...), host_url:
 
 @app.get("/api/payments/status/{session_id}")
 async def get_payment_status(session_id: str):
-    """Get payment status for a session"""
+    """Get payment status for a session.
+
+    Terminal sessions are answered from payment_transactions; Stripe is
+    only asked while the payment is still pending.
+    """
     try:
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-        status = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update transaction in database
-        transaction = await payment_transactions_collection.find_one({"session_id": session_id})
-        if transaction:
-            await payment_transactions_collection.update_one(
-                {"session_id": session_id},
-                {"$set": {"payment_status": status.payment_status, "updated_at": datetime.utcnow()}}
-            )
-            
-            # If payment is successful and credits haven't been added yet
-            if status.payment_status == "paid" and transaction.get("credits_added") != True:
-                # Add credits to user (you'll need to implement user association)
-                credits_to_add = int(transaction["credits"])
-                await payment_transactions_collection.update_one(
-                    {"session_id": session_id},
-                    {"$set": {"credits_added": True}}
-                )
-                
-                # Note: You'll need to implement user association with payments
-                # For now, returning success
-        
+        status = await payment_reconciler.status(session_id)
         return {
-            "status": status.status,
-            "payment_status": status.payment_status,
-            "amount_total": status.amount_total,
-            "currency": status.currency
+            "status": status.get("status"),
+            "payment_status": status.get("payment_status"),
+            "amount_total": status.get("amount_total"),
+            "currency": status.get("currency")
         }
         
     except Exception as e:
@@ -379,188 +1095,569 @@ async def get_payment_status(session_id: str):
 
 @app.post("/api/webhook/stripe")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
+    """Verify a Stripe webhook and queue it; the event is applied in the background"""
+    body = await request.body()
+    stripe_signature = request.headers.get("Stripe-Signature")
     try:
-        body = await request.body()
-        stripe_signature = request.headers.get("Stripe-Signature")
-        
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-        webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
-        
-        # Update transaction status
-        if webhook_response.session_id:
-            await payment_transactions_collection.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": webhook_response.payment_status,
-                    "webhook_processed": True,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-        
-        return {"status": "success"}
-        
+        webhook_response = await payment_clients.get().handle_webhook(body, stripe_signature)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Webhook error: {str(e)}")
+    
+    # Stripe redelivers until it gets a 2xx; a repeated event id is acknowledged and dropped
+    event_id = webhook_event_id(webhook_response, body)
+    if await payment_fulfilment.record(
+        event_id,
+        getattr(webhook_response, "event_type", None),
+        webhook_response.session_id,
+        webhook_response.payment_status,
+        getattr(webhook_response, "metadata", None)
+    ):
+        await job_queue.put("payment_event", {"event_id": event_id})
+    
+    return {"status": "success"}
 
 @app.post("/api/blood-test/upload")
 async def upload_blood_test(
     file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
-    """Upload and analyze blood test PDF"""
+    """Upload a blood test PDF and queue it for analysis.
+
+    Retrying with the same Idempotency-Key header returns the original
+    test instead of charging another credit.
+    """
     try:
-        # Check if user has credits
-        if current_user["credits"] < 1:
-            raise HTTPException(status_code=400, detail="Insufficient credits")
-        
         # Read and validate file
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
         
-        file_content = await file.read()
+        # Shed load before taking the file when the CPU stages are backed up
+        if cpu_executor.saturated:
+            raise ExecutorSaturated(cpu_executor.retry_after)
         
-        # Extract text from PDF
-        extracted_text = await extract_text_from_pdf(file_content)
+        test_id = str(uuid.uuid4())
+        upload_path = os.path.join(UPLOAD_DIR, f"{test_id}.pdf")
+        await spool_upload(file, upload_path, MAX_UPLOAD_BYTES)
+        try:
+            page_count = await check_pdf_page_count(upload_path)
+            
+            # Reserve a credit up front; it is committed when the report is
+            # ready and refunded if the pipeline fails
+            credit_key = f"upload:{current_user['id']}:{idempotency_key or test_id}"
+            try:
+                with stage_timer("credit"):
+                    reservation = await credit_ledger.reserve(current_user["id"], 1, credit_key, ref=test_id)
+            except InsufficientCredits:
+                raise HTTPException(status_code=400, detail="Insufficient credits")
+            invalidate_user(current_user["id"])
+        except BaseException:
+            os.remove(upload_path)
+            raise
         
-        if not extracted_text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
+        if reservation.replayed:
+            os.remove(upload_path)
+            existing = await blood_tests_collection.find_one(
+                {"id": reservation.ref, "user_id": current_user["id"]},
+                {"_id": 0, "status": 1}
+            )
+            if existing:
+                return {
+                    "test_id": reservation.ref,
+                    "status": existing["status"],
+                    "credits_remaining": reservation.balance
+                }
+            raise HTTPException(status_code=409, detail="A previous upload with this key did not complete")
         
-        # Analyze with AI
-        analysis = await analyze_blood_test_with_ai(extracted_text)
+        try:
+            blood_test = {
+                "id": test_id,
+                "user_id": current_user["id"],
+                "owner_name": current_user["full_name"],
+                "filename": file.filename,
+                "upload_path": upload_path,
+                "page_count": page_count,
+                "credit_key": credit_key,
+                "created_at": datetime.utcnow(),
+                "status": TEST_STATUS_QUEUED
+            }
+            await blood_tests_collection.insert_one(blood_test)
+            await job_queue.put("extract", profiler.tag({"test_id": test_id}))
+        except Exception:
+            await credit_ledger.refund(credit_key)
+            invalidate_user(current_user["id"])
+            os.remove(upload_path)
+            raise
         
-        # Generate PDF report
-        pdf_report = await generate_pdf_report(
-            analysis, 
-            current_user["full_name"], 
-            datetime.now().strftime("%Y-%m-%d")
-        )
+        return {
+            "test_id": test_id,
+            "status": TEST_STATUS_QUEUED,
+            "credits_remaining": reservation.balance
+        }
         
-        # Save to database
-        test_id = str(uuid.uuid4())
-        blood_test = {
+    except (HTTPException, ExecutorSaturated, ExecutorTimeout):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing blood test: {str(e)}")
+
+BATCH_TEST_PROJECTION = {"_id": 0, "id": 1, "filename": 1, "status": 1, "error": 1, "updated_at": 1}
+
+async def get_batch_progress(batch_id: str, user_id: str) -> Optional[dict]:
+    tests = await blood_tests_collection.find(
+        {"batch_id": batch_id, "user_id": user_id},
+        BATCH_TEST_PROJECTION
+    ).sort("batch_index", 1).to_list(length=BATCH_MAX_FILES)
+    if not tests:
+        return None
+    counts = {}
+    for test in tests:
+        counts[test["status"]] = counts.get(test["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": len(tests),
+        "counts": counts,
+        "done": all(test["status"] in TERMINAL_TEST_STATUSES for test in tests),
+        "tests": tests
+    }
+
+@app.post("/api/blood-test/batch")
+async def upload_blood_test_batch(
+    files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Upload several blood test PDFs at once, one credit each.
+
+    All credits are reserved in one atomic step, or none are. Files then
+    go through the pipeline concurrently; poll the batch for progress.
+    """
+    try:
+        if not files:
+            raise HTTPException(status_code=400, detail="No files uploaded")
+        if len(files) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch")
+        for file in files:
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"{file.filename}: only PDF files are supported")
+        
+        if cpu_executor.saturated:
+            raise ExecutorSaturated(cpu_executor.retry_after)
+        
+        batch_id = str(uuid.uuid4())
+        test_ids = [str(uuid.uuid4()) for _ in files]
+        upload_paths = [os.path.join(UPLOAD_DIR, f"{test_id}.pdf") for test_id in test_ids]
+        
+        def remove_uploads():
+            for path in upload_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        try:
+            # Let every task finish before cleaning up after one that failed
+            spooled = await asyncio.gather(*(
+                spool_upload(file, path, MAX_UPLOAD_BYTES) for file, path in zip(files, upload_paths)
+            ), return_exceptions=True)
+            for result in spooled:
+                if isinstance(result, BaseException):
+                    raise result
+            # A batch can hold more files than the executor takes at once: queue for
+            # its slots rather than turn the batch away (a busy executor was refused above)
+            page_counts = await asyncio.gather(
+                *(check_pdf_page_count(path, wait=True) for path in upload_paths), return_exceptions=True
+            )
+            for result in page_counts:
+                if isinstance(result, BaseException):
+                    raise result
+            
+            credit_key = f"batch:{current_user['id']}:{idempotency_key or batch_id}"
+            try:
+                with stage_timer("credit"):
+                    reservation = await credit_ledger.reserve(
+                        current_user["id"], len(files), credit_key, ref=batch_id
+                    )
+            except InsufficientCredits:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient credits: this batch needs {len(files)}"
+                )
+            invalidate_user(current_user["id"])
+        except BaseException:
+            remove_uploads()
+            raise
+        
+        if reservation.replayed:
+            remove_uploads()
+            progress = await get_batch_progress(reservation.ref, current_user["id"])
+            if progress is None:
+                raise HTTPException(status_code=409, detail="A previous batch with this key did not complete")
+            return {**progress, "credits_remaining": reservation.balance}
+        
+        now = datetime.utcnow()
+        blood_tests = [{
             "id": test_id,
             "user_id": current_user["id"],
+            "owner_name": current_user["full_name"],
             "filename": file.filename,
-            "extracted_text": extracted_text,
-            "analysis": analysis,
-            "pdf_report": base64.b64encode(pdf_report).decode('utf-8'),
-            "created_at": datetime.utcnow(),
-            "status": "completed"
-        }
+            "upload_path": path,
+            "page_count": page_count,
+            "batch_id": batch_id,
+            "batch_index": index,
+            "credit_key": credit_key,
+            "credit_part": test_id,
+            "created_at": now,
+            "status": TEST_STATUS_QUEUED
+        } for index, (test_id, file, path, page_count) in enumerate(zip(test_ids, files, upload_paths, page_counts))]
+        try:
+            await blood_tests_collection.insert_many(blood_tests)
+        except Exception:
+            await credit_ledger.refund(credit_key)
+            invalidate_user(current_user["id"])
+            remove_uploads()
+            raise
         
-        await blood_tests_collection.insert_one(blood_test)
-        
-        # Deduct credit
-        await users_collection.update_one(
-            {"id": current_user["id"]},
-            {"$inc": {"credits": -1}}
-        )
+        # From here each test settles its own credit, even if queueing fails
+        for test in blood_tests:
+            try:
+                await job_queue.put("extract", profiler.tag({"test_id": test["id"]}))
+            except Exception as e:
+                await handle_failed_job(Job(id="", kind="extract", payload={"test_id": test["id"]}), e)
         
         return {
-            "test_id": test_id,
-            "analysis": analysis,
-            "status": "completed",
-            "credits_remaining": current_user["credits"] - 1
+            "batch_id": batch_id,
+            "tests": [
+                {"test_id": test["id"], "filename": test["filename"], "status": test["status"]}
+                for test in blood_tests
+            ],
+            "credits_remaining": reservation.balance
         }
         
+    except (HTTPException, ExecutorSaturated, ExecutorTimeout):
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing blood test: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing blood tests: {str(e)}")
+
+@app.get("/api/blood-test/batch/{batch_id}")
+async def get_blood_test_batch(batch_id: str, current_user: dict = Depends(get_token_user)):
+    """Per-file progress of a batch upload"""
+    progress = await get_batch_progress(batch_id, current_user["id"])
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
+
+@app.get("/api/blood-test/{test_id}/status")
+async def get_blood_test_status(test_id: str, current_user: dict = Depends(get_token_user)):
+    """Get pipeline status for a blood test"""
+    test = await blood_tests_collection.find_one(
+        {"id": test_id, "user_id": current_user["id"]},
+        {"_id": 0, "id": 1, "status": 1, "error": 1, "created_at": 1, "updated_at": 1}
+    )
+    if not test:
+        raise HTTPException(status_code=404, detail="Blood test not found")
+    return test
+
+@app.get("/api/blood-test/{test_id}/events")
+async def stream_blood_test_status(test_id: str, current_user: dict = Depends(get_token_user)):
+    """Server-sent events stream of pipeline status changes and analysis tokens.
+
+    A ``reset`` event means the analysis is being regenerated: discard the
+    tokens received so far.
+    """
+    projection = {"_id": 0, "id": 1, "status": 1, "error": 1}
+    test = await blood_tests_collection.find_one({"id": test_id, "user_id": current_user["id"]}, projection)
+    if not test:
+        raise HTTPException(status_code=404, detail="Blood test not found")
+
+    async def event_stream():
+        last_status = None
+        current = test
+        with analysis_stream_hub.subscribe(test_id) as tokens:
+            while current:
+                if current["status"] != last_status:
+                    last_status = current["status"]
+                    yield f"event: status\ndata: {json.dumps(current)}\n\n"
+                if last_status in TERMINAL_TEST_STATUSES:
+                    break
+                try:
+                    # Forward analysis tokens as they arrive; re-check status when idle
+                    event = await asyncio.wait_for(tokens.get(), timeout=1)
+                    data = {k: v for k, v in event.items() if k != "event"}
+                    yield f"event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+                current = await blood_tests_collection.find_one({"id": test_id}, projection)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/blood-test/{test_id}")
-async def get_blood_test(test_id: str, current_user: dict = Depends(get_current_user)):
+async def get_blood_test(test_id: str, current_user: dict = Depends(get_token_user)):
     """Get blood test results"""
-    test = await blood_tests_collection.find_one({"id": test_id, "user_id": current_user["id"]})
+    test = await blood_tests_collection.find_one({"id": test_id, "user_id": current_user["id"]}, TEST_VIEW_PROJECTION)
     if not test:
         raise HTTPException(status_code=404, detail="Blood test not found")
     
     return {
         "id": test["id"],
         "filename": test["filename"],
-        "analysis": test["analysis"],
+        "analysis": test.get("analysis"),
         "created_at": test["created_at"],
-        "status": test["status"]
+        "status": test["status"],
+        "error": test.get("error"),
+        "analysis_source": test.get("analysis_source")
     }
 
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
 @app.get("/api/blood-test/{test_id}/download")
-async def download_report(test_id: str, current_user: dict = Depends(get_current_user)):
-    """Download PDF report"""
-    test = await blood_tests_collection.find_one({"id": test_id, "user_id": current_user["id"]})
+async def download_report(test_id: str, request: Request, current_user: dict = Depends(get_token_user)):
+    """Stream the PDF report; supports Range requests and If-None-Match.
+
+    The report is rendered on the first download, and again after the
+    analysis or the report template changes.
+    """
+    test = await blood_tests_collection.find_one(
+        {"id": test_id, "user_id": current_user["id"]},
+        {"_id": 0, "filename": 1, "status": 1, "pdf_report": 1, **REPORT_FIELDS}
+    )
     if not test:
         raise HTTPException(status_code=404, detail="Blood test not found")
     
-    # Decode PDF report
-    pdf_bytes = base64.b64decode(test["pdf_report"])
+    if not test.get("report_blob") and test.get("pdf_report"):
+        # Documents written before the blob store are migrated on first download
+        test["report_blob"] = await migrate_legacy_report(test)
+    if not test.get("analysis") or test["status"] not in (TEST_STATUS_COMPLETED, TEST_STATUS_RENDERING):
+        raise HTTPException(status_code=409, detail="Report is not ready yet")
+    report_blob = await ensure_report(test, trigger="download")
+    
+    try:
+        info = await blob_store.stat(report_blob["key"])
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Report file not found")
+    
+    etag = f'"{info.etag}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": content_disposition(
+            f"blood_test_report_{test['filename'].replace('.pdf', '')}.pdf"
+        )
+    }
     
-    # Save to temporary file
-    temp_filename = f"report_{test_id}.pdf"
-    temp_path = f"/tmp/{temp_filename}"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+    
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), info.size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{info.size}"})
     
-    async with aiofiles.open(temp_path, "wb") as f:
-        await f.write(pdf_bytes)
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+    else:
+        start, end = 0, info.size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
     
-    return FileResponse(
-        temp_path,
-        filename=f"blood_test_report_{test['filename'].replace('.pdf', '')}.pdf",
-        media_type="application/pdf"
+    return StreamingResponse(
+        blob_store.iter_range(info.key, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+async def save_chat_turn(session_id: str, user_id: str, question: str, response: str):
+    await chat_history.append_turn(session_id, user_id, question, response)
+
+def stream_chat_turn(message: ChatMessage, test: dict, chat_session: dict) -> AsyncIterator[str]:
+    # Short questions go to the fast model tier
+    spec = model_router.route(REQUEST_CHAT, estimate_tokens(message.message))
+    return chat_manager.stream_turn(
+        message.session_id,
+        test.get("analysis_input") or test["extracted_text"],
+        chat_session.get("recent", []),
+        message.message,
+        tier=spec.tier,
+        summary=chat_session.get("summary", ""),
+        message_count=chat_session.get("message_count", 0)
+    )
+
+def stream_chat_response(message: ChatMessage, test: dict, chat_session: dict, user_id: str,
+                         accept: str) -> StreamingResponse:
+    """Stream a chat answer as SSE, or as NDJSON when the client accepts it"""
+    ndjson = "application/x-ndjson" in accept
+
+    def encode(event: str, data: dict) -> str:
+        if ndjson:
+            return json.dumps({"type": event, **data}) + "\n"
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def body():
+        parts = []
+        try:
+            deltas = stream_chat_turn(message, test, chat_session)
+            async for delta in with_keepalive(deltas, STREAM_KEEPALIVE_SECONDS):
+                if delta is None:
+                    # Keeps proxies from closing the connection while the model thinks
+                    yield json.dumps({"type": "ping"}) + "\n" if ndjson else ": ping\n\n"
+                    continue
+                parts.append(delta)
+                yield encode("token", {"delta": delta})
+        except Exception as e:
+            yield encode("error", {"detail": f"Error in chat: {str(e)}"})
+            return
+
+        response = "".join(parts)
+        await save_chat_turn(message.session_id, user_id, message.message, response)
+        yield encode("done", {"response": response})
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson" if ndjson else "text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @app.post("/api/chat/ask")
 async def chat_with_results(
     message: ChatMessage,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    """Chat about blood test results"""
+    """Chat about blood test results; set "stream": true for incremental output"""
     try:
         # Get blood test from session_id (assuming session_id is test_id)
-        test = await blood_tests_collection.find_one({"id": message.session_id, "user_id": current_user["id"]})
+        test = await blood_tests_collection.find_one(
+            {"id": message.session_id, "user_id": current_user["id"]},
+            {"_id": 0, "status": 1, "analysis_input": 1, "extracted_text": 1}
+        )
         if not test:
             raise HTTPException(status_code=404, detail="Blood test not found")
+        if test["status"] != TEST_STATUS_COMPLETED:
+            raise HTTPException(status_code=409, detail="Blood test analysis is not finished yet")
         
-        # Get existing chat session or create new one
-        chat_session = await chat_sessions_collection.find_one({"session_id": message.session_id})
-        if not chat_session:
-            chat_session = {
-                "session_id": message.session_id,
-                "user_id": current_user["id"],
-                "test_id": message.session_id,
-                "messages": [],
-                "created_at": datetime.utcnow()
-            }
-            await chat_sessions_collection.insert_one(chat_session)
+        # Get existing chat session or create new one; only the summary and newest messages are read
+        chat_session = await chat_history.get_or_create(message.session_id, current_user["id"], message.session_id)
+        
+        if message.stream:
+            return stream_chat_response(
+                message, test, chat_session, current_user["id"], request.headers.get("accept", "")
+            )
         
-        # Analyze with AI including user question
-        response = await analyze_blood_test_with_ai(test["extracted_text"], message.message)
+        # Ask within the pooled session; the report is only sent when the session is seeded
+        response = "".join([delta async for delta in stream_chat_turn(message, test, chat_session)])
         
         # Save chat messages
-        await chat_sessions_collection.update_one(
-            {"session_id": message.session_id},
-            {"$push": {
-                "messages": {
-                    "$each": [
-                        {"role": "user", "content": message.message, "timestamp": datetime.utcnow()},
-                        {"role": "assistant", "content": response, "timestamp": datetime.utcnow()}
-                    ]
-                }
-            }}
-        )
+        await save_chat_turn(message.session_id, current_user["id"], message.message, response)
         
         return {"response": response}
         
+    except (HTTPException, LlmUnavailable):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
+@app.get("/api/chat/{session_id}/messages")
+async def get_chat_messages(
+    session_id: str,
+    before: Optional[int] = Query(None, ge=1),
+    limit: int = Query(None, ge=1),
+    current_user: dict = Depends(get_token_user)
+):
+    """Chat history, oldest first, one page at a time from the newest end.
+
+    Pass the returned next_before back as ``before`` for older messages.
+    """
+    limit = min(limit or CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_MAX_PAGE_SIZE)
+    session = await chat_history.load(
+        {"session_id": session_id, "user_id": current_user["id"]}, current_user["id"]
+    )
+    if session is None:
+        return {"items": [], "next_before": None}
+    
+    messages, next_before = await chat_history.page(session_id, before, limit)
+    return {
+        "items": [{
+            "id": m["id"],
+            "seq": m["seq"],
+            "role": m["role"],
+            "content": m["content"],
+            "timestamp": m["timestamp"]
+        } for m in messages],
+        "next_before": next_before
+    }
+
 @app.get("/api/user/blood-tests")
-async def get_user_blood_tests(current_user: dict = Depends(get_current_user)):
-    """Get all blood tests for current user"""
-    tests = await blood_tests_collection.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(length=100)
+async def get_user_blood_tests(
+    limit: int = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    filename_prefix: Optional[str] = None,
+    include_total: bool = False,
+    current_user: dict = Depends(get_token_user)
+):
+    """List the current user's blood tests, newest first, one page at a time.
+
+    Pass the returned next_cursor back as ``cursor`` for the following page.
+    """
+    limit = min(limit or TESTS_PAGE_SIZE, TESTS_MAX_PAGE_SIZE)
     
-    return [{
-        "id": test["id"],
-        "filename": test["filename"],
-        "created_at": test["created_at"],
-        "status": test["status"]
-    } for test in tests]
+    query = {"user_id": current_user["id"]}
+    if status:
+        query["status"] = status
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    if filename_prefix:
+        query["filename"] = {"$regex": f"^{re.escape(filename_prefix)}"}
+    
+    try:
+        page_query = {"$and": [query, after_cursor(cursor)]} if cursor else query
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Fetch one extra item to learn whether another page exists
+    tests = await blood_tests_collection.find(
+        page_query,
+        TEST_LIST_PROJECTION
+    ).sort(KEYSET_SORT).limit(limit + 1).to_list(length=limit + 1)
+    
+    has_more = len(tests) > limit
+    tests = tests[:limit]
+    result = {
+        "items": [{
+            "id": test["id"],
+            "filename": test["filename"],
+            "created_at": test["created_at"],
+            "status": test["status"]
+        } for test in tests],
+        "next_cursor": encode_cursor(tests[-1]["created_at"], tests[-1]["id"]) if has_more else None
+    }
+    
+    if include_total:
+        # Counting is capped so it stays cheap for very large histories
+        total = await blood_tests_collection.count_documents(query, limit=TESTS_TOTAL_COUNT_CAP)
+        result["total"] = total
+        result["total_is_estimate"] = total >= TESTS_TOTAL_COUNT_CAP
+    
+    return result
 
 if __name__ == "__main__":
     import uvicorn
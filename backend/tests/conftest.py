@@ -0,0 +1,23 @@
+"""Shared fixtures: backend modules on the path and a fresh in-memory Mongo.
+
+Run from backend/ with ``python -m pytest tests``. Tests drive coroutines
+with ``asyncio.run`` so no pytest plugin is needed.
+"""
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+from mongo_standin import StandInClient
+
+
+@pytest.fixture
+def db():
+    """An empty stand-in database; a little latency so concurrent calls interleave"""
+    client = StandInClient()
+    client.latency = 0.001
+    return client["test"]
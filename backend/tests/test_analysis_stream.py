@@ -0,0 +1,28 @@
+import asyncio
+
+import server
+from llm_gateway import LlmGateway
+
+
+def test_retry_after_partial_output_resets_subscribers(monkeypatch):
+    calls = []
+
+    async def flaky_stream(text, question, spec):
+        calls.append(text)
+        yield "Hemoglobin "
+        if len(calls) == 1:
+            raise ConnectionError("provider dropped the stream")
+        yield "is normal."
+
+    monkeypatch.setattr(server, "stream_blood_test_analysis", flaky_stream)
+    monkeypatch.setattr(server, "llm_gateway", LlmGateway(base_delay=0.001))
+    events = []
+
+    analysis = asyncio.run(server.analyze_blood_test_with_ai(
+        "HGB 14.1 g/dL",
+        on_delta=lambda delta: events.append(delta),
+        on_reset=lambda: events.append(None),
+    ))
+
+    assert analysis == "Hemoglobin is normal."
+    assert events == ["Hemoglobin ", None, "Hemoglobin ", "is normal."]
@@ -0,0 +1,33 @@
+import time
+
+from auth import UserCache
+
+
+def test_revocation_outlives_the_cached_user():
+    cache = UserCache(ttl=30, revocation_ttl=60)
+    cache.set({"id": "u1", "token_version": 1})
+    cache.revoke("u1", 1)
+    cache.invalidate("u1")
+    assert cache.get("u1") is None
+    assert cache.revoked("u1", 0)
+    assert not cache.revoked("u1", 1)
+
+
+def test_revocation_floor_never_goes_down():
+    cache = UserCache(revocation_ttl=60)
+    cache.revoke("u1", 3)
+    cache.revoke("u1", 2)
+    assert cache.revoked("u1", 2)
+
+
+def test_revocation_floor_expires_with_the_access_tokens():
+    cache = UserCache(revocation_ttl=0.01)
+    cache.revoke("u1", 1)
+    time.sleep(0.02)
+    assert not cache.revoked("u1", 0)
+
+
+def test_revocation_works_with_the_cache_disabled():
+    cache = UserCache(ttl=0, revocation_ttl=60)
+    cache.revoke("u1", 1)
+    assert cache.revoked("u1", 0)
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from blob_store import BlobNotFound, FilesystemBlobStore
+
+
+def test_replaced_blob_matches_its_metadata(tmp_path):
+    store = FilesystemBlobStore(str(tmp_path))
+
+    async def scenario():
+        await store.put("reports/t1.pdf", b"first version")
+        info = await store.put("reports/t1.pdf", b"second")
+        return info, await store.stat("reports/t1.pdf"), await store.read("reports/t1.pdf")
+
+    info, stat, data = asyncio.run(scenario())
+    assert stat == info
+    assert data == b"second"
+    # The first version's data file is gone once the metadata moved on
+    assert sorted(os.listdir(tmp_path / "reports")) == sorted(["t1.pdf.meta", f"t1.pdf.{info.etag}"])
+
+
+def test_put_file_moves_the_file_into_place(tmp_path):
+    store = FilesystemBlobStore(str(tmp_path / "blobs"))
+    spool = tmp_path / "spool.pdf"
+    spool.write_bytes(b"%PDF-1.4 report")
+
+    async def scenario():
+        info = await store.put_file("reports/t2.pdf", str(spool), "application/pdf")
+        chunks = [chunk async for chunk in store.iter_range("reports/t2.pdf", 5, 7)]
+        return info, b"".join(chunks)
+
+    info, part = asyncio.run(scenario())
+    assert not spool.exists()
+    assert info.size == 15
+    assert part == b"1.4"
+
+
+def test_blobs_written_before_etag_named_files_still_read(tmp_path):
+    store = FilesystemBlobStore(str(tmp_path))
+    (tmp_path / "reports").mkdir()
+    (tmp_path / "reports" / "old.pdf").write_bytes(b"legacy")
+    (tmp_path / "reports" / "old.pdf.meta").write_text(json.dumps(
+        {"key": "reports/old.pdf", "size": 6, "etag": "e", "content_type": "application/pdf"}))
+
+    async def scenario():
+        data = await store.read("reports/old.pdf")
+        await store.put("reports/old.pdf", b"new")
+        return data, await store.read("reports/old.pdf")
+
+    assert asyncio.run(scenario()) == (b"legacy", b"new")
+    assert not (tmp_path / "reports" / "old.pdf").exists()
+
+
+def test_deleted_blob_is_not_found(tmp_path):
+    store = FilesystemBlobStore(str(tmp_path))
+
+    async def scenario():
+        await store.put("reports/t3.pdf", b"data")
+        await store.delete("reports/t3.pdf")
+        with pytest.raises(BlobNotFound):
+            await store.stat("reports/t3.pdf")
+        with pytest.raises(BlobNotFound):
+            await store.read("reports/t3.pdf")
+
+    asyncio.run(scenario())
+    assert os.listdir(tmp_path / "reports") == []
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from credits import CreditLedger, InsufficientCredits, STATE_GRANTED, STATE_RESERVED
+from payments import PaymentFulfilment
+
+
+async def make_ledger(db, credits=0, **kwargs):
+    await db.credit_ledger.create_index("key", unique=True)
+    await db.users.insert_one({"id": "u1", "credits": credits, "pending_reservations": [], "pending_grants": []})
+    return CreditLedger(db.users, db.credit_ledger, **kwargs)
+
+
+async def user(db):
+    return await db.users.find_one({"id": "u1"}, {"_id": 0})
+
+
+def test_concurrent_fulfil_credits_a_session_once(db):
+    async def scenario():
+        ledger = await make_ledger(db)
+        await db.payment_transactions.insert_one({"session_id": "cs_1", "user_id": "u1", "credits": 3})
+        fulfilment = PaymentFulfilment(db.payment_events, db.payment_transactions, ledger)
+        # The webhook job and the status reconciler fulfilling the same paid session
+        outcomes = await asyncio.gather(*(fulfilment.fulfil("cs_1") for _ in range(4)))
+        return outcomes, await user(db), await db.credit_ledger.find_one({"key": "payment:cs_1"})
+
+    outcomes, doc, entry = asyncio.run(scenario())
+    assert sorted(outcomes) == ["already_granted"] * 3 + ["granted"]
+    assert doc["credits"] == 3
+    assert doc["pending_grants"] == []
+    assert entry["state"] == STATE_GRANTED
+
+
+def test_grant_after_completion_is_replayed(db):
+    async def scenario():
+        ledger = await make_ledger(db)
+        first = await ledger.grant("u1", 2, "payment:cs_2")
+        second = await ledger.grant("u1", 2, "payment:cs_2")
+        return first, second, await user(db)
+
+    first, second, doc = asyncio.run(scenario())
+    assert (first, second) == (True, False)
+    assert doc["credits"] == 2
+
+
+def test_concurrent_grants_with_one_key_credit_once(db):
+    async def scenario():
+        ledger = await make_ledger(db)
+        granted = await asyncio.gather(*(ledger.grant("u1", 5, "payment:cs_4") for _ in range(6)))
+        return granted, await user(db)
+
+    granted, doc = asyncio.run(scenario())
+    assert sorted(granted) == [False] * 5 + [True]
+    assert doc["credits"] == 5
+    assert doc["pending_grants"] == []
+
+
+def test_stalled_grant_is_taken_over_once(db):
+    async def scenario():
+        ledger = await make_ledger(db, claim_after=0.05)
+        # An earlier call that incremented, then stopped before marking the entry granted
+        await db.credit_ledger.insert_one({
+            "key": "payment:cs_3", "user_id": "u1", "amount": 2, "owner": "gone", "state": "granting"})
+        await db.users.update_one({"id": "u1"}, {"$inc": {"credits": 2}, "$push": {"pending_grants": "payment:cs_3"}})
+        granted = await ledger.grant("u1", 2, "payment:cs_3")
+        return granted, await user(db)
+
+    granted, doc = asyncio.run(scenario())
+    assert granted is True
+    assert doc["credits"] == 2
+    assert doc["pending_grants"] == []
+
+
+def test_concurrent_reserve_with_one_key_charges_once(db):
+    async def scenario():
+        ledger = await make_ledger(db, credits=3)
+        reservations = await asyncio.gather(*(
+            ledger.reserve("u1", 1, "upload:u1:k", ref=f"test-{i}") for i in range(5)
+        ))
+        return reservations, await user(db)
+
+    reservations, doc = asyncio.run(scenario())
+    assert sorted(r.replayed for r in reservations) == [False] + [True] * 4
+    assert {r.ref for r in reservations} == {next(r.ref for r in reservations if not r.replayed)}
+    assert all(r.state == STATE_RESERVED for r in reservations)
+    assert doc["credits"] == 2
+
+
+def test_concurrent_reserves_never_overdraw(db):
+    async def scenario():
+        ledger = await make_ledger(db, credits=3)
+        results = await asyncio.gather(*(
+            ledger.reserve("u1", 1, f"upload:u1:{i}") for i in range(6)
+        ), return_exceptions=True)
+        return results, await user(db)
+
+    results, doc = asyncio.run(scenario())
+    assert sum(isinstance(r, InsufficientCredits) for r in results) == 3
+    assert doc["credits"] == 0
+
+
+def test_refund_gives_credit_back_once(db):
+    async def scenario():
+        ledger = await make_ledger(db, credits=1)
+        await ledger.reserve("u1", 1, "upload:u1:r")
+        refunds = await asyncio.gather(ledger.refund("upload:u1:r"), ledger.refund("upload:u1:r"))
+        return refunds, await user(db)
+
+    refunds, doc = asyncio.run(scenario())
+    assert sorted(refunds) == [False, True]
+    assert doc["credits"] == 1
+    assert doc["pending_reservations"] == []
+
+
+def test_rejected_reservation_can_be_retried(db):
+    async def scenario():
+        ledger = await make_ledger(db)
+        with pytest.raises(InsufficientCredits):
+            await ledger.reserve("u1", 1, "upload:u1:again")
+        await db.users.update_one({"id": "u1"}, {"$set": {"credits": 1}})
+        return await ledger.reserve("u1", 1, "upload:u1:again"), await user(db)
+
+    reservation, doc = asyncio.run(scenario())
+    assert not reservation.replayed
+    assert doc["credits"] == 0
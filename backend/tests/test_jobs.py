@@ -0,0 +1,163 @@
+import asyncio
+
+from jobs import JobWorkerPool, LocalJobQueue, MongoJobQueue, PermanentJobError, RetryLater
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+class FlakyQueue(LocalJobQueue):
+    """Local queue whose get() fails the first ``failures`` times"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def get(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("queue unreachable")
+        return await super().get()
+
+
+def test_worker_survives_queue_errors():
+    async def scenario():
+        queue = FlakyQueue(failures=3)
+        done = []
+
+        async def handler(job):
+            done.append(job.payload["n"])
+
+        pool = JobWorkerPool(queue, {"work": handler}, concurrency=1, error_backoff=0.001)
+        pool.start()
+        try:
+            await queue.put("work", {"n": 1})
+            await wait_for(lambda: done)
+        finally:
+            await pool.stop()
+        return done
+
+    assert asyncio.run(scenario()) == [1]
+
+
+def test_failing_dead_letter_handler_does_not_kill_the_worker():
+    async def scenario():
+        queue = LocalJobQueue()
+        done = []
+
+        async def handler(job):
+            if job.payload["n"] == 1:
+                raise PermanentJobError("bad input")
+            done.append(job.payload["n"])
+
+        async def on_dead_letter(job, error):
+            raise ConnectionError("refund failed")
+
+        pool = JobWorkerPool(queue, {"work": handler}, concurrency=1, on_dead_letter=on_dead_letter)
+        pool.start()
+        try:
+            await queue.put("work", {"n": 1})
+            await queue.put("work", {"n": 2})
+            await wait_for(lambda: done)
+        finally:
+            await pool.stop()
+        return done, queue.buried
+
+    done, buried = asyncio.run(scenario())
+    assert done == [2]
+    assert [job.payload["n"] for job in buried] == [1]
+
+
+def test_failed_job_is_retried_then_buried():
+    async def scenario():
+        queue = LocalJobQueue(max_attempts=3)
+        attempts = []
+        dead = []
+
+        async def handler(job):
+            attempts.append(job.attempts)
+            raise RuntimeError("still broken")
+
+        async def on_dead_letter(job, error):
+            dead.append(str(error))
+
+        pool = JobWorkerPool(queue, {"work": handler}, concurrency=1, on_dead_letter=on_dead_letter,
+                             retry_base_delay=0.001)
+        pool.start()
+        try:
+            await queue.put("work", {})
+            await wait_for(lambda: dead)
+        finally:
+            await pool.stop()
+        return attempts, dead
+
+    attempts, dead = asyncio.run(scenario())
+    assert attempts == [1, 2, 3]
+    assert dead == ["still broken"]
+
+
+def test_deferred_job_keeps_its_attempts():
+    async def scenario():
+        queue = LocalJobQueue(max_attempts=2)
+        attempts = []
+        dead = []
+
+        async def handler(job):
+            attempts.append(job.attempts)
+            if len(attempts) <= 4:
+                raise RetryLater(0.001, "circuit open")
+
+        async def on_dead_letter(job, error):
+            dead.append(job)
+
+        pool = JobWorkerPool(queue, {"work": handler}, concurrency=1, on_dead_letter=on_dead_letter)
+        pool.start()
+        try:
+            await queue.put("work", {})
+            await wait_for(lambda: len(attempts) == 5)
+        finally:
+            await pool.stop()
+        return attempts, dead
+
+    attempts, dead = asyncio.run(scenario())
+    assert attempts == [1] * 5
+    assert dead == []
+
+
+def test_mongo_queue_deferral_hands_back_the_attempt(db):
+    async def scenario():
+        queue = MongoJobQueue(db.jobs, poll_interval=0.005)
+        await queue.put("work", {})
+        job = await queue.get()
+        await queue.retry(job, 0, count_attempt=False)
+        return await queue.get()
+
+    assert asyncio.run(scenario()).attempts == 1
+
+
+def test_mongo_queue_claims_each_job_once(db):
+    async def scenario():
+        queue = MongoJobQueue(db.jobs, poll_interval=0.005)
+        seen = []
+
+        async def handler(job):
+            seen.append(job.payload["n"])
+
+        pools = [JobWorkerPool(queue, {"work": handler}, concurrency=3) for _ in range(2)]
+        for pool in pools:
+            pool.start()
+        try:
+            for n in range(20):
+                await queue.put("work", {"n": n})
+            await wait_for(lambda: len(seen) >= 20)
+            await asyncio.sleep(0.05)
+        finally:
+            for pool in pools:
+                await pool.stop()
+        return seen
+
+    assert sorted(asyncio.run(scenario())) == list(range(20))
@@ -0,0 +1,34 @@
+from lab_parser import format_lab_table, scan_lab_panel
+
+PANEL = """Happy Paws Veterinary Clinic
+ALT 62 U/L 10-125
+ALKP 1,250 H U/L 23-212
+GLU 5,6 mmol/L 3.9-7.9
+CREA see comment
+"""
+
+
+def test_result_rows_and_unparsed_rows():
+    values, unparsed = scan_lab_panel(PANEL)
+    assert [(v.analyte, v.value, v.flag) for v in values] == [
+        ("ALT", 62, ""), ("ALKP", 1250, "H"), ("GLU", 5.6, "")]
+    assert unparsed == []
+
+
+def test_repeated_page_is_not_a_conflict():
+    values, unparsed = scan_lab_panel(PANEL + PANEL)
+    assert len(values) == 3
+    assert unparsed == []
+
+
+def test_conflicting_duplicate_is_kept_as_unparsed():
+    values, unparsed = scan_lab_panel(PANEL + "ALT 350 H U/L 10-125\n")
+    assert [v.value for v in values if v.analyte == "ALT"] == [62]
+    assert unparsed == ["ALT 350 H U/L 10-125"]
+    assert format_lab_table(values, unparsed).endswith(
+        "Result rows that could not be parsed (as printed):\nALT 350 H U/L 10-125")
+
+
+def test_row_of_known_analyte_that_does_not_parse():
+    _, unparsed = scan_lab_panel("BUN 20 mg/dL 40-7\n")
+    assert unparsed == ["BUN 20 mg/dL 40-7"]
@@ -0,0 +1,48 @@
+import asyncio
+
+from llm import with_keepalive
+
+
+class SlowStream:
+    """Async iterator standing in for a provider stream that must be closed"""
+
+    def __init__(self):
+        self.sent = False
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.sent:
+            self.sent = True
+            return "a"
+        await asyncio.sleep(10)
+        return "b"
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_keepalive_closes_the_wrapped_stream():
+    chunks = SlowStream()
+
+    async def scenario():
+        stream = with_keepalive(chunks, interval=0.01)
+        seen = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return seen
+
+    assert asyncio.run(scenario()) == ["a", None]
+    assert chunks.closed
+
+
+def test_keepalive_passes_chunks_through():
+    async def chunks():
+        for chunk in ("a", "b"):
+            yield chunk
+
+    async def scenario():
+        return [chunk async for chunk in with_keepalive(chunks(), interval=1)]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
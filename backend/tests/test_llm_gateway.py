@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_gateway import CircuitBreaker, LlmGateway, LlmUnavailable, RetryBudget
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"provider returned {status_code}")
+        self.status_code = status_code
+
+
+def flaky(failures, error=lambda: ProviderError(503), result="ok"):
+    """Provider call that raises ``error()`` for the first ``failures`` calls"""
+    calls = []
+
+    async def fn():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error()
+        return result
+
+    return fn, calls
+
+
+def gateway(**kwargs):
+    kwargs.setdefault("base_delay", 0.001)
+    return LlmGateway(**kwargs)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(LlmUnavailable) as excinfo:
+        breaker.before_call()
+    assert 1 <= excinfo.value.retry_after <= 30
+
+
+def test_breaker_lets_one_trial_through_after_the_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    trial = breaker.before_call()
+    assert trial is not None
+    with pytest.raises(LlmUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.before_call() is None
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.01)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(LlmUnavailable):
+        breaker.before_call()
+
+
+def test_abandoned_trial_frees_the_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    trial = breaker.before_call()
+    breaker.end_trial(trial)
+    assert breaker.before_call() is not None
+
+
+def test_transient_errors_are_retried():
+    fn, calls = flaky(2)
+    assert asyncio.run(gateway(max_attempts=4).call(fn)) == "ok"
+    assert len(calls) == 3
+
+
+def test_retries_stop_at_max_attempts():
+    fn, calls = flaky(10)
+    with pytest.raises(ProviderError):
+        asyncio.run(gateway(max_attempts=3).call(fn))
+    assert len(calls) == 3
+
+
+def test_caller_errors_are_not_retried():
+    fn, calls = flaky(1, error=lambda: ProviderError(400))
+    llm = gateway()
+    with pytest.raises(ProviderError):
+        asyncio.run(llm.call(fn))
+    assert len(calls) == 1
+    assert not llm.breaker.is_open
+
+
+def test_retry_budget_limits_retries():
+    fn, calls = flaky(10)
+    llm = gateway(max_attempts=10, retry_budget=RetryBudget(ratio=0, initial=2))
+    with pytest.raises(ProviderError):
+        asyncio.run(llm.call(fn))
+    assert len(calls) == 3
+
+
+def test_open_circuit_fails_fast_without_calling_the_provider():
+    fn, calls = flaky(10)
+    llm = gateway(max_attempts=2, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    with pytest.raises(ProviderError):
+        asyncio.run(llm.call(fn))
+    with pytest.raises(LlmUnavailable):
+        asyncio.run(llm.call(fn))
+    assert len(calls) == 2
+
+
+def test_identical_calls_in_flight_are_sent_once():
+    async def scenario():
+        llm = gateway()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "analysis"
+
+        results = await asyncio.gather(*(llm.call(fn, key="same-prompt") for _ in range(3)))
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == ["analysis"] * 3
+    assert calls == [1]
+
+
+def test_stream_is_retried_only_before_output():
+    def open_stream(fail_after):
+        attempts = []
+
+        async def stream():
+            attempts.append(1)
+            if len(attempts) == 1:
+                for _ in range(fail_after):
+                    yield "partial "
+                raise ProviderError(503)
+            yield "whole answer"
+
+        return stream, attempts
+
+    async def consume(llm, stream):
+        return [delta async for delta in llm.stream(stream)]
+
+    stream, attempts = open_stream(fail_after=0)
+    assert asyncio.run(consume(gateway(), stream)) == ["whole answer"]
+    assert len(attempts) == 2
+
+    stream, attempts = open_stream(fail_after=1)
+    with pytest.raises(ProviderError):
+        asyncio.run(consume(gateway(), stream))
+    assert len(attempts) == 1
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Re-run Stripe webhook events from the payment_events inbox.
+
+Processes events that are still pending (for example when the API stopped
+before its background job ran) or that failed, oldest first. Crediting goes
+through the credit ledger under the checkout session's key, so replaying an
+event that was already applied never grants credits twice. The API's
+cached user profiles catch up within USER_CACHE_TTL.
+
+Usage (from backend/, with the same environment as the API):
+    python tools/replay_payment_events.py [--states pending,failed] [--event-id ID]
+                                          [--older-than SECONDS] [--limit N] [--force] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import motor.motor_asyncio
+from decouple import config
+
+from credits import CreditLedger
+from payments import EVENT_FAILED, EVENT_PENDING, PaymentFulfilment
+
+MONGO_URL = config('MONGO_URL', default='mongodb://localhost:27017/dogbloodgpt')
+
+
+async def replay(args):
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    db = client.dogbloodgpt
+    fulfilment = PaymentFulfilment(
+        db.payment_events, db.payment_transactions, CreditLedger(db.users, db.credit_ledger)
+    )
+
+    if args.event_id:
+        query = {"event_id": args.event_id}
+    else:
+        # Leave recent pending events to the API's own background job
+        query = {
+            "state": {"$in": args.states.split(",")},
+            "received_at": {"$lte": datetime.utcnow() - timedelta(seconds=args.older_than)}
+        }
+    events = await db.payment_events.find(
+        query, {"_id": 0, "event_id": 1, "event_type": 1, "session_id": 1, "state": 1}
+    ).sort("received_at", 1).limit(args.limit).to_list(length=args.limit)
+    print(f"{len(events)} events to replay")
+
+    outcomes = {}
+    for event in events:
+        if args.dry_run:
+            print(f"{event['event_id']} {event.get('event_type')} session={event.get('session_id')} "
+                  f"state={event['state']}")
+            continue
+        try:
+            outcome = await fulfilment.process(event["event_id"], force=args.force or bool(args.event_id))
+        except Exception as e:
+            await fulfilment.mark_failed(event["event_id"], str(e))
+            outcome = "failed"
+            print(f"{event['event_id']} failed: {e}")
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    if outcomes:
+        print(", ".join(f"{outcome}={count}" for outcome, count in sorted(outcomes.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--states", default=f"{EVENT_PENDING},{EVENT_FAILED}")
+    parser.add_argument("--event-id", help="replay this event only, even if already processed")
+    parser.add_argument("--older-than", type=float, default=60, help="seconds since the event was received")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--force", action="store_true", help="also re-run processed events")
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(replay(parser.parse_args()))
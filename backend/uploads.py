@@ -0,0 +1,31 @@
+"""Spooling of uploaded files to local disk with an early size limit"""
+import os
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+async def spool_upload(file: UploadFile, dest_path: str, max_bytes: int) -> int:
+    """Copy an upload to ``dest_path`` chunk by chunk; returns the size in bytes.
+
+    The copy stops and the partial file is removed as soon as the upload
+    grows past ``max_bytes``, so oversized files never reach the parser.
+    """
+    size = 0
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than the {max_bytes // (1024 * 1024)} MB limit"
+                    )
+                await f.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return size
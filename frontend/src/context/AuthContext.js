@@ -1,5 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import axios from 'axios';
+import api from '../utils/api';
 
 const AuthContext = createContext();
 
@@ -31,7 +32,8 @@ export const AuthProvider = ({ children }) => {
 
   const fetchUserProfile = async () => {
     try {
-      const response = await axios.get(`${backendUrl}/api/user/profile`);
+      // Through the shared client so an expired access token is refreshed
+      const response = await api.get('/api/user/profile');
       setUser(response.data);
     } catch (error) {
       console.error('Error fetching user profile:', error);
@@ -48,9 +50,10 @@ export const AuthProvider = ({ children }) => {
         password,
       });
 
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refresh_token', refresh_token);
       setToken(access_token);
       setUser(userData);
       
@@ -72,9 +75,10 @@ export const AuthProvider = ({ children }) => {
         full_name: fullName,
       });
 
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refresh_token', refresh_token);
       setToken(access_token);
       setUser(userData);
       
@@ -90,6 +94,7 @@ export const AuthProvider = ({ children }) => {
 
   const logout = () => {
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     setToken(null);
     setUser(null);
     delete axios.defaults.headers.common['Authorization'];
@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { motion } from 'framer-motion';
 import { CreditCard, Zap, Check, Star, Shield } from 'lucide-react';
 import toast from 'react-hot-toast';
+import api from '../utils/api';
 
 const BuyCredits = () => {
   const [credits, setCredits] = useState(1);
@@ -44,22 +45,12 @@ const BuyCredits = () => {
     try {
       const hostUrl = window.location.origin;
       
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/payments/create-checkout`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/x-www-form-urlencoded',
-        },
-        body: new URLSearchParams({
-          credits: selectedCredits,
-          host_url: hostUrl
-        })
-      });
-
-      if (!response.ok) {
-        throw new Error('Failed to create checkout session');
-      }
-
-      const data = await response.json();
+      // Authenticated, so the purchase is credited to this account
+      const response = await api.post('/api/payments/create-checkout', new URLSearchParams({
+        credits: selectedCredits,
+        host_url: hostUrl
+      }));
+      const data = response.data;
       
       if (data.url) {
         window.location.href = data.url;
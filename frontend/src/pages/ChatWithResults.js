@@ -14,6 +14,8 @@ import { useAuth } from '../context/AuthContext';
 import api from '../utils/api';
 import toast from 'react-hot-toast';
 
+const backendUrl = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+
 const ChatWithResults = () => {
   const { testId } = useParams();
   const { user } = useAuth();
@@ -22,6 +24,8 @@ const ChatWithResults = () => {
   const [inputMessage, setInputMessage] = useState('');
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
+  const [historyBefore, setHistoryBefore] = useState(null);
+  const [loadingHistory, setLoadingHistory] = useState(false);
   const messagesEndRef = useRef(null);
 
   useEffect(() => {
@@ -37,15 +41,19 @@ const ChatWithResults = () => {
       const response = await api.get(`/api/blood-test/${testId}`);
       setTest(response.data);
       
-      // Add initial welcome message
-      setMessages([
-        {
-          id: 1,
-          role: 'assistant',
-          content: `Hi! I'm here to help you understand your dog's blood test results from ${response.data.filename}. Feel free to ask me any questions about the analysis!`,
-          timestamp: new Date()
-        }
-      ]);
+      // Add initial welcome message, followed by the newest page of earlier messages
+      const welcome = {
+        id: 1,
+        role: 'assistant',
+        content: `Hi! I'm here to help you understand your dog's blood test results from ${response.data.filename}. Feel free to ask me any questions about the analysis!`,
+        timestamp: new Date()
+      };
+      setMessages([welcome]);
+      const history = await fetchHistory();
+      if (history) {
+        setMessages([welcome, ...history.items]);
+        setHistoryBefore(history.next_before);
+      }
     } catch (error) {
       toast.error('Failed to fetch test results');
       console.error('Error fetching test:', error);
@@ -54,10 +62,72 @@ const ChatWithResults = () => {
     }
   };
 
+  // One page of stored chat messages, oldest first; null if it could not be loaded
+  const fetchHistory = async (before = null) => {
+    try {
+      const params = before ? { before } : {};
+      const response = await api.get(`/api/chat/${testId}/messages`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching chat history:', error);
+      return null;
+    }
+  };
+
+  const loadEarlierMessages = async () => {
+    if (!historyBefore || loadingHistory) return;
+    setLoadingHistory(true);
+    const history = await fetchHistory(historyBefore);
+    if (history) {
+      // Older messages go between the welcome message and what is already shown
+      setMessages(prev => [prev[0], ...history.items, ...prev.slice(1)]);
+      setHistoryBefore(history.next_before);
+    } else {
+      toast.error('Failed to load earlier messages');
+    }
+    setLoadingHistory(false);
+  };
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Reads the NDJSON stream from /api/chat/ask and passes each token to onDelta
+  const streamChatAnswer = async (text, onDelta) => {
+    const response = await fetch(`${backendUrl}/api/chat/ask`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Accept: 'application/x-ndjson',
+        Authorization: `Bearer ${localStorage.getItem('token')}`,
+      },
+      body: JSON.stringify({ message: text, session_id: testId, stream: true }),
+    });
+    if (!response.ok) {
+      throw new Error(`Chat request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const event = JSON.parse(line);
+        if (event.type === 'token') {
+          onDelta(event.delta);
+        } else if (event.type === 'error') {
+          throw new Error(event.detail);
+        }
+      }
+    }
+  };
+
   const sendMessage = async (e) => {
     e.preventDefault();
     if (!inputMessage.trim() || sending) return;
@@ -73,32 +143,31 @@ const ChatWithResults = () => {
     setInputMessage('');
     setSending(true);
 
-    try {
-      const response = await api.post('/api/chat/ask', {
-        message: inputMessage,
-        session_id: testId
-      });
-
-      const aiMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
-        content: response.data.response,
-        timestamp: new Date()
-      };
+    const aiMessageId = Date.now() + 1;
+    setMessages(prev => [...prev, {
+      id: aiMessageId,
+      role: 'assistant',
+      content: '',
+      timestamp: new Date()
+    }]);
+    const appendToAiMessage = (delta) => {
+      setMessages(prev => prev.map(msg => (
+        msg.id === aiMessageId ? { ...msg, content: msg.content + delta } : msg
+      )));
+    };
 
-      setMessages(prev => [...prev, aiMessage]);
+    try {
+      await streamChatAnswer(inputMessage, appendToAiMessage);
     } catch (error) {
       toast.error('Failed to send message');
       console.error('Chat error:', error);
       
-      // Add error message
-      const errorMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
-        content: 'I apologize, but I encountered an error while processing your message. Please try again.',
-        timestamp: new Date()
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      // Replace the partial answer with an error message
+      setMessages(prev => prev.map(msg => (
+        msg.id === aiMessageId
+          ? { ...msg, content: 'I apologize, but I encountered an error while processing your message. Please try again.' }
+          : msg
+      )));
     } finally {
       setSending(false);
     }
@@ -220,6 +289,17 @@ const ChatWithResults = () => {
         >
           {/* Messages */}
           <div className="flex-1 overflow-y-auto p-6 space-y-4">
+            {historyBefore && (
+              <div className="text-center">
+                <button
+                  onClick={loadEarlierMessages}
+                  disabled={loadingHistory}
+                  className="text-sm text-primary-600 dark:text-primary-400 hover:text-primary-700 dark:hover:text-primary-300 disabled:opacity-50"
+                >
+                  {loadingHistory ? 'Loading...' : 'Load earlier messages'}
+                </button>
+              </div>
+            )}
             {messages.map((message) => (
               <div
                 key={message.id}
@@ -22,6 +22,8 @@ const Dashboard = () => {
   const { user } = useAuth();
   const [bloodTests, setBloodTests] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [stats, setStats] = useState({
     totalTests: 0,
     thisMonth: 0,
@@ -34,20 +36,21 @@ const Dashboard = () => {
 
   const fetchBloodTests = async () => {
     try {
-      const response = await api.get('/api/user/blood-tests');
-      setBloodTests(response.data);
-      
-      // Calculate stats
       const now = new Date();
-      const thisMonth = response.data.filter(test => {
-        const testDate = new Date(test.created_at);
-        return testDate.getMonth() === now.getMonth() && testDate.getFullYear() === now.getFullYear();
-      }).length;
+      const monthStart = new Date(now.getFullYear(), now.getMonth(), 1);
+      const [response, monthResponse] = await Promise.all([
+        api.get('/api/user/blood-tests', { params: { include_total: true } }),
+        api.get('/api/user/blood-tests', {
+          params: { limit: 1, include_total: true, created_from: monthStart.toISOString() }
+        })
+      ]);
+      setBloodTests(response.data.items);
+      setNextCursor(response.data.next_cursor);
       
       setStats({
-        totalTests: response.data.length,
-        thisMonth,
-        creditsUsed: response.data.length
+        totalTests: response.data.total,
+        thisMonth: monthResponse.data.total,
+        creditsUsed: response.data.total
       });
     } catch (error) {
       toast.error('Failed to fetch blood tests');
@@ -57,6 +60,20 @@ const Dashboard = () => {
     }
   };
 
+  const loadMoreBloodTests = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await api.get('/api/user/blood-tests', { params: { cursor: nextCursor } });
+      setBloodTests(tests => [...tests, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error('Failed to fetch blood tests');
+      console.error('Error fetching blood tests:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString) => {
     return new Date(dateString).toLocaleDateString('en-US', {
       year: 'numeric',
@@ -273,6 +290,17 @@ const Dashboard = () => {
                   </div>
                 </motion.div>
               ))}
+              {nextCursor && (
+                <div className="text-center pt-2">
+                  <button
+                    onClick={loadMoreBloodTests}
+                    disabled={loadingMore}
+                    className="text-primary-600 dark:text-primary-400 hover:text-primary-700 dark:hover:text-primary-300 font-medium transition-colors duration-200 disabled:opacity-50"
+                  >
+                    {loadingMore ? 'Loading...' : 'Load more'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </motion.div>
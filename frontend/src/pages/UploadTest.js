@@ -16,25 +16,37 @@ import { useAuth } from '../context/AuthContext';
 import api from '../utils/api';
 import toast from 'react-hot-toast';
 
+// Matches BATCH_MAX_FILES on the backend
+const MAX_BATCH_FILES = 20;
+
 const UploadTest = () => {
   const { user, updateUserCredits } = useAuth();
   const navigate = useNavigate();
   const [uploading, setUploading] = useState(false);
-  const [uploadedFile, setUploadedFile] = useState(null);
+  const [uploadedFiles, setUploadedFiles] = useState([]);
+  // One key per selection, so retrying the same upload is not charged twice
+  const [uploadKey, setUploadKey] = useState(null);
   const [dragActive, setDragActive] = useState(false);
 
   const onDrop = (acceptedFiles) => {
-    const file = acceptedFiles[0];
-    if (file) {
+    const files = acceptedFiles.filter(file => {
       if (file.type !== 'application/pdf') {
-        toast.error('Please upload a PDF file');
-        return;
+        toast.error(`${file.name}: please upload a PDF file`);
+        return false;
       }
       if (file.size > 10 * 1024 * 1024) { // 10MB limit
-        toast.error('File size must be less than 10MB');
-        return;
+        toast.error(`${file.name}: file size must be less than 10MB`);
+        return false;
       }
-      setUploadedFile(file);
+      return true;
+    });
+    if (files.length > MAX_BATCH_FILES) {
+      toast.error(`You can upload at most ${MAX_BATCH_FILES} files at once`);
+      return;
+    }
+    if (files.length > 0) {
+      setUploadedFiles(files);
+      setUploadKey(window.crypto.randomUUID());
     }
   };
 
@@ -43,7 +55,7 @@ const UploadTest = () => {
     accept: {
       'application/pdf': ['.pdf']
     },
-    multiple: false,
+    multiple: true,
     onDragEnter: () => setDragActive(true),
     onDragLeave: () => setDragActive(false),
     onDropAccepted: () => setDragActive(false),
@@ -51,30 +63,38 @@ const UploadTest = () => {
   });
 
   const handleUpload = async () => {
-    if (!uploadedFile) {
+    if (uploadedFiles.length === 0) {
       toast.error('Please select a file first');
       return;
     }
 
-    if (user.credits < 1) {
+    if (user.credits < uploadedFiles.length) {
       toast.error('Insufficient credits. Please buy credits first.');
       return;
     }
 
     setUploading(true);
     const formData = new FormData();
-    formData.append('file', uploadedFile);
+    const isBatch = uploadedFiles.length > 1;
+    // Several files go up in one request and are analyzed concurrently
+    uploadedFiles.forEach(file => formData.append(isBatch ? 'files' : 'file', file));
 
     try {
-      const response = await api.post('/api/blood-test/upload', formData, {
+      const response = await api.post(isBatch ? '/api/blood-test/batch' : '/api/blood-test/upload', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'Idempotency-Key': uploadKey,
         },
       });
 
-      toast.success('Blood test uploaded and analyzed successfully!');
       updateUserCredits(response.data.credits_remaining);
-      navigate(`/report/${response.data.test_id}`);
+      if (isBatch) {
+        toast.success(`${uploadedFiles.length} blood tests uploaded! Analysis is in progress.`);
+        navigate('/dashboard');
+      } else {
+        toast.success('Blood test uploaded! Analysis is in progress.');
+        navigate(`/report/${response.data.test_id}`);
+      }
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Upload failed');
       console.error('Upload error:', error);
@@ -83,8 +103,8 @@ const UploadTest = () => {
     }
   };
 
-  const removeFile = () => {
-    setUploadedFile(null);
+  const removeFile = (index) => {
+    setUploadedFiles(files => files.filter((_, i) => i !== index));
   };
 
   const formatFileSize = (bytes) => {
@@ -101,14 +121,14 @@ const UploadTest = () => {
       title: 'Upload PDF',
       description: 'Select your dog\'s blood test PDF file',
       icon: Upload,
-      active: !uploadedFile
+      active: uploadedFiles.length === 0
     },
     {
       number: '02',
       title: 'AI Analysis',
       description: 'Our AI analyzes the blood test parameters',
       icon: Brain,
-      active: uploadedFile && !uploading
+      active: uploadedFiles.length > 0 && !uploading
     },
     {
       number: '03',
@@ -189,7 +209,7 @@ const UploadTest = () => {
           transition={{ duration: 0.6, delay: 0.2 }}
           className="glass-morphism rounded-2xl p-8 mb-8"
         >
-          {!uploadedFile ? (
+          {uploadedFiles.length === 0 ? (
             <div
               {...getRootProps()}
               className={`file-upload-area ${isDragActive || dragActive ? 'active' : ''}`}
@@ -203,7 +223,7 @@ const UploadTest = () => {
                   {isDragActive ? 'Drop your PDF here' : 'Upload Blood Test PDF'}
                 </h3>
                 <p className="text-gray-600 dark:text-gray-400 mb-4">
-                  Drag and drop your PDF file here, or click to select
+                  Drag and drop your PDF files here, or click to select
                 </p>
                 <div className="flex items-center justify-center space-x-4 text-sm text-gray-500 dark:text-gray-400">
                   <div className="flex items-center">
@@ -218,34 +238,38 @@ const UploadTest = () => {
               </div>
             </div>
           ) : (
-            <div className="bg-white dark:bg-gray-800 rounded-xl p-4 border border-gray-200 dark:border-gray-700">
-              <div className="flex items-center justify-between">
-                <div className="flex items-center space-x-3">
-                  <div className="w-10 h-10 bg-red-100 dark:bg-red-900/30 rounded-lg flex items-center justify-center">
-                    <FileText className="w-5 h-5 text-red-600 dark:text-red-400" />
-                  </div>
-                  <div>
-                    <p className="font-medium text-gray-900 dark:text-white">
-                      {uploadedFile.name}
-                    </p>
-                    <p className="text-sm text-gray-500 dark:text-gray-400">
-                      {formatFileSize(uploadedFile.size)}
-                    </p>
+            <div className="space-y-3">
+              {uploadedFiles.map((file, index) => (
+                <div key={`${file.name}-${index}`} className="bg-white dark:bg-gray-800 rounded-xl p-4 border border-gray-200 dark:border-gray-700">
+                  <div className="flex items-center justify-between">
+                    <div className="flex items-center space-x-3">
+                      <div className="w-10 h-10 bg-red-100 dark:bg-red-900/30 rounded-lg flex items-center justify-center">
+                        <FileText className="w-5 h-5 text-red-600 dark:text-red-400" />
+                      </div>
+                      <div>
+                        <p className="font-medium text-gray-900 dark:text-white">
+                          {file.name}
+                        </p>
+                        <p className="text-sm text-gray-500 dark:text-gray-400">
+                          {formatFileSize(file.size)}
+                        </p>
+                      </div>
+                    </div>
+                    <button
+                      onClick={() => removeFile(index)}
+                      className="p-2 text-gray-400 hover:text-red-500 transition-colors duration-200"
+                    >
+                      <X className="w-5 h-5" />
+                    </button>
                   </div>
                 </div>
-                <button
-                  onClick={removeFile}
-                  className="p-2 text-gray-400 hover:text-red-500 transition-colors duration-200"
-                >
-                  <X className="w-5 h-5" />
-                </button>
-              </div>
+              ))}
             </div>
           )}
         </motion.div>
 
         {/* Upload Button */}
-        {uploadedFile && (
+        {uploadedFiles.length > 0 && (
           <motion.div
             initial={{ opacity: 0, y: 20 }}
             animate={{ opacity: 1, y: 0 }}
@@ -254,7 +278,7 @@ const UploadTest = () => {
           >
             <button
               onClick={handleUpload}
-              disabled={uploading || user.credits < 1}
+              disabled={uploading || user.credits < uploadedFiles.length}
               className="cyber-button px-8 py-4 text-lg disabled:opacity-50 disabled:cursor-not-allowed"
             >
               {uploading ? (
@@ -269,13 +293,15 @@ const UploadTest = () => {
               ) : (
                 <>
                   <Brain className="w-6 h-6 mr-2" />
-                  Analyze Blood Test (1 Credit)
+                  {uploadedFiles.length === 1
+                    ? 'Analyze Blood Test (1 Credit)'
+                    : `Analyze ${uploadedFiles.length} Blood Tests (${uploadedFiles.length} Credits)`}
                 </>
               )}
             </button>
-            {user.credits < 1 && (
+            {user.credits < uploadedFiles.length && (
               <p className="mt-4 text-red-600 dark:text-red-400">
-                You need at least 1 credit to analyze a blood test.{' '}
+                You need {uploadedFiles.length} credit{uploadedFiles.length === 1 ? '' : 's'} to analyze {uploadedFiles.length === 1 ? 'this blood test' : 'these blood tests'}.{' '}
                 <button
                   onClick={() => navigate('/buy-credits')}
                   className="underline hover:no-underline"
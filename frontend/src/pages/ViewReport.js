@@ -25,6 +25,24 @@ const ViewReport = () => {
     fetchTest();
   }, [testId]);
 
+  // Poll the pipeline until the analysis has finished or failed
+  useEffect(() => {
+    if (!test || ['completed', 'failed'].includes(test.status)) {
+      return undefined;
+    }
+    const timer = setInterval(async () => {
+      try {
+        const response = await api.get(`/api/blood-test/${testId}/status`);
+        if (response.data.status !== test.status) {
+          fetchTest();
+        }
+      } catch (error) {
+        console.error('Error polling test status:', error);
+      }
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [test, testId]);
+
   const fetchTest = async () => {
     try {
       const response = await api.get(`/api/blood-test/${testId}`);
@@ -71,7 +89,7 @@ const ViewReport = () => {
 
   const formatAnalysis = (analysis) => {
     // Split analysis into sections based on common patterns
-    const sections = analysis.split('\n\n').filter(section => section.trim());
+    const sections = (analysis || '').split('\n\n').filter(section => section.trim());
     return sections;
   };
 
@@ -196,7 +214,11 @@ const ViewReport = () => {
             <div className="flex items-center space-x-2">
               <div className="w-2 h-2 bg-green-500 rounded-full"></div>
               <span className="text-sm text-gray-600 dark:text-gray-400">
-                Analysis Complete
+                {test.status === 'completed'
+                  ? 'Analysis Complete'
+                  : test.status === 'failed'
+                    ? `Analysis Failed${test.error ? `: ${test.error}` : ''}`
+                    : 'Analysis in progress...'}
               </span>
             </div>
           </div>